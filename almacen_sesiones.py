@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger('documentai_invoice')
+
+
+def _tamano(datos: Any) -> int:
+    """Tamaño aproximado de una entrada: bytes de su JSON compacto."""
+    return len(json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+class EntradaDemasiadoGrande(ValueError):
+    """El resultado supera por sí solo el presupuesto de bytes del almacén."""
+
+
+def _validar_tamano(data_id: str, tamano: int, max_bytes: int):
+    # Guardarlo expulsaría todas las demás entradas y aun así quedaría fuera del presupuesto
+    if tamano > max_bytes:
+        logger.warning(f"Resultado {data_id} ({tamano} bytes) supera el presupuesto de sesiones; no se guarda")
+        raise EntradaDemasiadoGrande(
+            f"Resultado de {tamano} bytes supera el máximo de {max_bytes} bytes (SESIONES_MAX_BYTES)")
+
+
+class AlmacenSesiones:
+    """
+    Almacén en memoria del proceso (un solo worker) de resultados por data_id,
+    seguro entre hilos y acotado:
+    - ttl: segundos que vive cada entrada desde que se guarda
+    - max_entradas / max_bytes: al superarse se expulsa la entrada menos usada (LRU)
+    """
+
+    # Los datos solo son visibles para el proceso que los guardó
+    compartido = False
+
+    def __init__(self, ttl: float = 3600, max_entradas: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # data_id -> (expira, tamaño, datos)
+        self._entradas: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._expulsiones_lru = 0
+        self._expiradas = 0
+
+    def guardar(self, data_id: str, datos: Dict[str, Any]):
+        tamano = _tamano(datos)
+        _validar_tamano(data_id, tamano, self.max_bytes)
+
+        with self._lock:
+            self._quitar(data_id)
+            self._entradas[data_id] = (time.monotonic() + self.ttl, tamano, datos)
+            self._bytes += tamano
+            self._purgar_expiradas()
+            while len(self._entradas) > 1 and (
+                    len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                antiguo, _ = next(iter(self._entradas.items()))
+                self._quitar(antiguo)
+                self._expulsiones_lru += 1
+
+    def obtener(self, data_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entrada = self._entradas.get(data_id)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                self._quitar(data_id)
+                self._expiradas += 1
+                return None
+            self._entradas.move_to_end(data_id)
+            return entrada[2]
+
+    def eliminar(self, data_id: str):
+        with self._lock:
+            self._quitar(data_id)
+
+    def existe(self, data_id: str) -> bool:
+        """Si el data_id sigue vigente, sin retornar sus datos."""
+        return self.obtener(data_id) is not None
+
+    def __contains__(self, data_id: str) -> bool:
+        return self.existe(data_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entradas)
+
+    def _quitar(self, data_id: str):
+        entrada = self._entradas.pop(data_id, None)
+        if entrada is not None:
+            self._bytes -= entrada[1]
+
+    def _purgar_expiradas(self):
+        # El orden LRU no es el de expiración, pero con un TTL único casi coincide:
+        # basta revisar desde el inicio hasta la primera entrada vigente
+        ahora = time.monotonic()
+        for data_id in list(self._entradas):
+            if self._entradas[data_id][0] >= ahora:
+                break
+            self._quitar(data_id)
+            self._expiradas += 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': 'memoria',
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'max_entradas': self.max_entradas,
+                'max_bytes': self.max_bytes,
+                'expulsiones_lru': self._expulsiones_lru,
+                'expiradas': self._expiradas,
+            }
+
+
+class AlmacenSQLite:
+    """
+    Almacén compartido entre workers y procesos del mismo host sobre SQLite en modo WAL.
+    Misma API y límites que AlmacenSesiones; el orden LRU se guarda en la columna `usado`.
+    """
+
+    compartido = True
+
+    def __init__(self, ruta: str, ttl: float = 3600, max_entradas: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024, tabla: str = 'sesiones'):
+        if not tabla.isidentifier():
+            raise ValueError(f"Nombre de tabla no válido: {tabla!r}")
+        self.ruta = ruta
+        self.tabla = tabla
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._expulsiones_lru = 0
+        self._expiradas = 0
+
+        # Conexión solo para crear la tabla: si el almacén se crea en el proceso maestro
+        # (gunicorn --preload), ninguna conexión abierta pasa a los workers al hacer fork
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.tabla} (
+                    data_id TEXT PRIMARY KEY,
+                    expira REAL NOT NULL,
+                    usado REAL NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    datos TEXT NOT NULL
+                )""")
+            con.execute(f"CREATE INDEX IF NOT EXISTS {self.tabla}_usado ON {self.tabla} (usado)")
+        finally:
+            con.close()
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión por hilo y por proceso: sqlite3 no comparte conexiones tras un fork
+        con = getattr(self._local, 'con', None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def guardar(self, data_id: str, datos: Dict[str, Any]):
+        texto = json.dumps(datos, ensure_ascii=False, separators=(',', ':'))
+        tamano = len(texto.encode('utf-8'))
+        _validar_tamano(data_id, tamano, self.max_bytes)
+        ahora = time.time()
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute(
+                f"INSERT OR REPLACE INTO {self.tabla} VALUES (?, ?, ?, ?, ?)",
+                (data_id, ahora + self.ttl, ahora, tamano, texto))
+            expiradas = con.execute(
+                f"DELETE FROM {self.tabla} WHERE expira < ?", (ahora,)).rowcount
+            expulsadas = 0
+            entradas, total = con.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM {self.tabla}").fetchone()
+            if entradas > self.max_entradas or total > self.max_bytes:
+                for antiguo, tam in con.execute(
+                        f"SELECT data_id, tamano FROM {self.tabla} WHERE data_id != ? ORDER BY usado",
+                        (data_id,)).fetchall():
+                    if entradas <= self.max_entradas and total <= self.max_bytes:
+                        break
+                    con.execute(f"DELETE FROM {self.tabla} WHERE data_id = ?", (antiguo,))
+                    entradas -= 1
+                    total -= tam
+                    expulsadas += 1
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self._expiradas += expiradas
+            self._expulsiones_lru += expulsadas
+
+    def obtener(self, data_id: str) -> Optional[Dict[str, Any]]:
+        ahora = time.time()
+        con = self._conexion()
+        fila = con.execute(
+            f"SELECT expira, datos FROM {self.tabla} WHERE data_id = ?", (data_id,)).fetchone()
+        if fila is None:
+            return None
+        if fila[0] < ahora:
+            self.eliminar(data_id)
+            with self._lock:
+                self._expiradas += 1
+            return None
+        con.execute(f"UPDATE {self.tabla} SET usado = ? WHERE data_id = ?", (ahora, data_id))
+        return json.loads(fila[1])
+
+    def eliminar(self, data_id: str):
+        self._conexion().execute(f"DELETE FROM {self.tabla} WHERE data_id = ?", (data_id,))
+
+    def existe(self, data_id: str) -> bool:
+        """Si el data_id sigue vigente: solo lee el índice, sin decodificar el JSON ni tocar `usado`."""
+        fila = self._conexion().execute(
+            f"SELECT 1 FROM {self.tabla} WHERE data_id = ? AND expira >= ?", (data_id, time.time())).fetchone()
+        return fila is not None
+
+    def __contains__(self, data_id: str) -> bool:
+        return self.existe(data_id)
+
+    def __len__(self) -> int:
+        return self._conexion().execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0]
+
+    def estadisticas(self) -> Dict[str, Any]:
+        entradas, total = self._conexion().execute(
+            f"SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM {self.tabla}").fetchone()
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'entradas': entradas,
+                'bytes': total,
+                'max_entradas': self.max_entradas,
+                'max_bytes': self.max_bytes,
+                # Contadores de este proceso
+                'expulsiones_lru': self._expulsiones_lru,
+                'expiradas': self._expiradas,
+            }
+
+
+class AlmacenRedis:
+    """
+    Almacén compartido entre hosts sobre cualquier cliente compatible con redis-py
+    (set/get/delete/scan_iter). La expiración la aplica Redis con EX=ttl y el límite
+    de memoria se delega a su política maxmemory (p. ej. allkeys-lru).
+    """
+
+    compartido = True
+
+    def __init__(self, cliente, ttl: float = 3600, prefijo: str = 'ievm:sesion:'):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    @classmethod
+    def desde_url(cls, url: str, **kwargs) -> 'AlmacenRedis':
+        try:
+            import redis
+        except ImportError:
+            raise EnvironmentError(
+                "ALMACEN_SESIONES=redis requiere el paquete 'redis' (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def guardar(self, data_id: str, datos: Dict[str, Any]):
+        texto = json.dumps(datos, ensure_ascii=False, separators=(',', ':'))
+        self.cliente.set(self.prefijo + data_id, texto.encode('utf-8'), ex=max(1, int(self.ttl)))
+
+    def obtener(self, data_id: str) -> Optional[Dict[str, Any]]:
+        valor = self.cliente.get(self.prefijo + data_id)
+        if valor is None:
+            return None
+        return json.loads(valor)
+
+    def eliminar(self, data_id: str):
+        self.cliente.delete(self.prefijo + data_id)
+
+    def existe(self, data_id: str) -> bool:
+        return bool(self.cliente.exists(self.prefijo + data_id))
+
+    def __contains__(self, data_id: str) -> bool:
+        return self.existe(data_id)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.cliente.scan_iter(match=self.prefijo + '*'))
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'backend': 'redis',
+            'entradas': len(self),
+        }
+
+
+def crear_almacen():
+    """
+    Construye el almacén indicado por ALMACEN_SESIONES:
+    - memoria (por defecto): solo válido con un único worker
+    - sqlite: compartido por los workers del host (SESIONES_SQLITE_RUTA)
+    - redis: compartido entre instancias (REDIS_URL)
+    """
+    tipo = os.getenv('ALMACEN_SESIONES', 'memoria').strip().lower()
+    ttl = float(os.getenv('SESIONES_TTL_SEGUNDOS', '3600'))
+    max_entradas = int(os.getenv('SESIONES_MAX_ENTRADAS', '1000'))
+    max_bytes = int(os.getenv('SESIONES_MAX_BYTES', str(64 * 1024 * 1024)))
+
+    if tipo == 'memoria':
+        return AlmacenSesiones(ttl=ttl, max_entradas=max_entradas, max_bytes=max_bytes)
+    if tipo == 'sqlite':
+        ruta = os.getenv('SESIONES_SQLITE_RUTA') or os.path.join(
+            tempfile.gettempdir(), 'ievm_sesiones.sqlite3')
+        return AlmacenSQLite(ruta, ttl=ttl, max_entradas=max_entradas, max_bytes=max_bytes)
+    if tipo == 'redis':
+        url = os.getenv('REDIS_URL')
+        if not url:
+            raise EnvironmentError("Falta variable: REDIS_URL")
+        return AlmacenRedis.desde_url(url, ttl=ttl)
+    raise EnvironmentError(f"ALMACEN_SESIONES no válido: {tipo}")
+
+
+def crear_almacen_trabajos(almacen):
+    """
+    Almacén para publicar el estado de los trabajos entre workers, separado del de
+    resultados: otra tabla (sqlite) u otro prefijo (redis), con su propio TTL
+    (TRABAJOS_TTL_SEGUNDOS) y límites, para que los estados no ocupen lugares de
+    resultados. None si `almacen` no es compartido (un solo worker no necesita publicar).
+    """
+    ttl = float(os.getenv('TRABAJOS_TTL_SEGUNDOS', '900'))
+    if isinstance(almacen, AlmacenSQLite):
+        return AlmacenSQLite(
+            almacen.ruta, ttl=ttl, tabla='trabajos',
+            max_entradas=int(os.getenv('TRABAJOS_MAX_ENTRADAS', '10000')),
+            max_bytes=int(os.getenv('TRABAJOS_MAX_BYTES', str(16 * 1024 * 1024))))
+    if isinstance(almacen, AlmacenRedis):
+        return AlmacenRedis(almacen.cliente, ttl=ttl, prefijo='ievm:trabajo:')
+    return None
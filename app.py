@@ -1,22 +1,68 @@
 import os
 import sys
 import json
+import hmac
+import signal
 import logging
 import tempfile
 import threading
 import uuid
-from flask import Flask, request, jsonify, render_template_string, send_file
+import time
+import queue
+import hashlib
+from collections import deque
+from functools import lru_cache
+from typing import Dict
+from flask import Flask, Request, request, jsonify, render_template, url_for, stream_with_context
+from markupsafe import Markup, escape
 from dotenv import load_dotenv
 from test_documentai import (
-    setup_environment,
-    cargar_etiquetas,
-    process_document,
-    preparar_datos_para_bd
+    procesar_documento,
+    preparar_datos_para_bd,
+    VERSION_VALIDADORES
 )
+from configuracion import obtener_configuracion, recargar_configuracion
+from cola_trabajos import ColaTrabajos, ColaLlena, COMPLETADO, ERROR, trabajo_actual
+from cache_extraccion import CacheExtraccion, clave_cache
+from modelo_factura import serializar
+from cache_respuestas import CacheRespuestas, elegir_codificacion, IDENTIDAD
+from almacen_sesiones import crear_almacen, crear_almacen_trabajos
+from preprocesamiento import estadisticas as estadisticas_preprocesamiento
 from flask_cors import CORS
 
 
-app = Flask(__name__)
+class RequestEnMemoria(Request):
+    """Mantiene en memoria las subidas de hasta SUBIDA_MAX_MEMORIA bytes; las mayores pasan a disco."""
+    max_memoria = int(os.getenv('SUBIDA_MAX_MEMORIA', str(8 * 1024 * 1024)))
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=self.max_memoria, mode='rb+')
+
+    @property
+    def max_content_length(self):
+        # Un lote trae muchos archivos en la misma solicitud: límite propio
+        if self.path == '/api/v1/invoices/batch':
+            return int(os.getenv('MAX_TAMANO_LOTE', str(200 * 1024 * 1024)))
+        return super().max_content_length
+
+
+# Las hojas de estilo se sirven con ?v=<hash del contenido>: una URL nunca cambia de contenido
+MAX_AGE_ESTATICOS = 365 * 24 * 3600
+
+
+class AppIEVM(Flask):
+    def send_static_file(self, filename):
+        respuesta = super().send_static_file(filename)
+        respuesta.cache_control.no_cache = None
+        respuesta.cache_control.public = True
+        respuesta.cache_control.max_age = MAX_AGE_ESTATICOS
+        respuesta.cache_control.immutable = True
+        return respuesta
+
+
+app = AppIEVM(__name__)
+app.request_class = RequestEnMemoria
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_TAMANO_SUBIDA', str(20 * 1024 * 1024)))
 CORS(app)
 
 # Cargar variables de entorno
@@ -30,60 +76,108 @@ formatter = logging.Formatter('[%(levelname)s] %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# Diccionario para almacenar datos de sesión
-session_data = {}
+# Resultados por data_id: acotados por TTL, número de entradas y bytes.
+# Con más de un worker usar ALMACEN_SESIONES=sqlite o redis
+session_data = crear_almacen()
+# Estados de los trabajos publicados para los demás workers (aparte de los resultados)
+estados_trabajos = crear_almacen_trabajos(session_data)
+
+
+def _publicar_trabajo(trabajo):
+    # Con un almacén compartido, cualquier worker puede responder /jobs/<id>
+    estados_trabajos.guardar(trabajo.id, _estado_trabajo(trabajo))
+
+
+def _data_id_valido(data_id: str) -> bool:
+    """Los data_id son UUID: cualquier otra clave no es un resultado."""
+    try:
+        return str(uuid.UUID(data_id)) == data_id
+    except ValueError:
+        return False
+
+
+def _obtener_resultado(data_id: str):
+    return session_data.obtener(data_id) if _data_id_valido(data_id) else None
+
+
+# Cola de extracciones: un pool acotado atiende las llamadas a Document AI
+cola_trabajos = ColaTrabajos(
+    max_trabajadores=int(os.getenv('MAX_TRABAJOS_CONCURRENTES', '4')),
+    max_pendientes=int(os.getenv('MAX_TRABAJOS_PENDIENTES', '32')),
+    publicar=_publicar_trabajo if estados_trabajos is not None else None
+)
+
+# Cache de extracciones por hash de la imagen (nivel en disco opcional)
+cache_extraccion = CacheExtraccion(
+    max_entradas=int(os.getenv('CACHE_MAX_ENTRADAS', '256')),
+    ttl=float(os.getenv('CACHE_TTL_SEGUNDOS', str(7 * 24 * 3600))),
+    directorio=os.getenv('CACHE_DIRECTORIO') or None,
+    max_bytes_disco=int(os.getenv('CACHE_MAX_BYTES_DISCO', str(100 * 1024 * 1024)))
+)
+
+# /gui y /download ya generados (y comprimidos) por data_id
+cache_respuestas = CacheRespuestas(
+    max_entradas=int(os.getenv('RESPUESTAS_MAX_ENTRADAS', '512')),
+    max_bytes=int(os.getenv('RESPUESTAS_MAX_BYTES', str(32 * 1024 * 1024)))
+)
+# Segundos que el navegador reutiliza /gui y /download sin consultar (luego revalida con ETag)
+MAX_AGE_RESULTADOS = int(os.getenv('RESULTADOS_MAX_AGE', '3600'))
+MAX_IDS_DESCARGA = int(os.getenv('MAX_IDS_DESCARGA', '500'))
+# Espera máxima de POST /api/v1/invoices antes de responder 202 con el trabajo
+API_TIMEOUT_SEGUNDOS = float(os.getenv('API_TIMEOUT_SEGUNDOS', '120'))
+MAX_ARCHIVOS_LOTE = int(os.getenv('MAX_ARCHIVOS_LOTE', '200'))
+# Intervalo de los comentarios de /jobs/<id>/eventos mientras no hay etapas nuevas
+LATIDO_SSE_SEGUNDOS = float(os.getenv('LATIDO_SSE_SEGUNDOS', '15'))
+
+# Configuración y esquema de etiquetas: se construyen una vez al arrancar
+try:
+    obtener_configuracion()
+except EnvironmentError as e:
+    logger.error(f"Configuración inválida al iniciar, se reintentará en la primera solicitud: {e}")
+
+
+def _recargar_por_senal(signum, frame):
+    try:
+        recargar_configuracion()
+    except Exception:
+        logger.exception("No se pudo recargar la configuración; se mantiene la anterior")
+
+
+# `kill -HUP <pid>` recarga la configuración sin reiniciar el proceso
+if threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, _recargar_por_senal)
+
+
+@lru_cache(maxsize=None)
+def _version_estatico(nombre: str) -> str:
+    with open(os.path.join(app.static_folder, nombre), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+@app.context_processor
+def _funciones_plantillas():
+    return {'estatico': lambda nombre: url_for('static', filename=nombre, v=_version_estatico(nombre))}
+
+
+@app.template_filter('nl2br')
+def nl2br(valor) -> Markup:
+    """Escapa el texto extraído por OCR y convierte sus saltos de línea en <br>."""
+    if valor is None:
+        return Markup('N/A')
+    return Markup('<br>').join(escape(valor).split('\n'))
+
+
+# Las plantillas se compilan una vez al iniciar; Jinja las mantiene en su cache
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
+PLANTILLAS = ('index.html', 'espera.html', 'resultado.html', 'gui.html')
+for _plantilla in PLANTILLAS:
+    app.jinja_env.get_template(_plantilla)
 
 
 @app.route('/')
 def index():
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <title>Subir Factura - IEVM</title>
-        <style>
-            body {
-                background-color: #F3ECE7;
-                font-family: Arial, sans-serif;
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-                justify-content: center;
-                height: 100vh;
-                margin: 0;
-            }
-            h1 {
-                color: #2c3e50;
-            }
-            form {
-                background: #fff;
-                padding: 20px;
-                border-radius: 10px;
-                box-shadow: 0 0 10px rgba(0,0,0,0.1);
-            }
-            button {
-                background-color: #2c3e50;
-                color: white;
-                padding: 10px 20px;
-                border: none;
-                border-radius: 5px;
-                cursor: pointer;
-                margin-top: 10px;
-            }
-        </style>
-    </head>
-    <body>
-        <h1>Subir Factura para Procesar</h1>
-        <form action="/upload" method="POST" enctype="multipart/form-data">
-            <input type="file" name="file" accept="image/*" required />
-            <br/>
-            <button type="submit">Procesar</button>
-        </form>
-    </body>
-    </html>
-    """
-    return render_template_string(html_content)
+    return render_template('index.html')
 
 
 @app.route('/upload', methods=['POST'])
@@ -95,464 +189,450 @@ def upload_and_redirect():
     if file.filename == '':
         return "Nombre de archivo vacío", 400
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-        file.save(temp_file.name)
-        filename = os.path.basename(temp_file.name)
+    # Los bytes van directo a la cola: sin archivo temporal ni segunda lectura
+    contenido = file.read()
+    if not contenido:
+        return "Archivo vacío", 400
+
+    try:
+        trabajo = cola_trabajos.enviar(procesar_factura, contenido)
+    except ColaLlena as e:
+        logger.warning(str(e))
+        return jsonify({'error': 'Servidor ocupado, intente nuevamente', 'detalle': str(e)}), 503
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': trabajo.id, 'estado_url': f"/jobs/{trabajo.id}"}), 202
+
+    return render_template('espera.html', job_id=trabajo.id), 202
+
+
+def procesar_factura(contenido: bytes) -> str:
+    """Extrae la factura a partir de los bytes subidos, almacena el resultado y retorna su data_id."""
+    # Dentro de la cola, cada etapa queda registrada en el trabajo (/jobs/<id>/eventos)
+    trabajo = trabajo_actual()
+    progreso = None if trabajo is None else (lambda etapa: cola_trabajos.avanzar(trabajo, etapa))
+
+    config = obtener_configuracion()
+    clave = clave_cache(contenido, config.entorno, config.version_esquema,
+                        VERSION_VALIDADORES, config.preprocesamiento.firma())
+
+    datos_bd = cache_extraccion.obtener(clave)
+    if datos_bd is None:
+        resultado = procesar_documento(
+            contenido, config.entorno, config.etiquetas,
+            preprocesamiento=config.preprocesamiento, progreso=progreso)
+        datos_bd = preparar_datos_para_bd(resultado)
+        cache_extraccion.guardar(clave, datos_bd)
+    else:
+        logger.info("Factura encontrada en cache; se omite Document AI")
+
+    # Generar un ID único para estos datos
+    data_id = str(uuid.uuid4())
+
+    # Almacenar el resultado en el almacén de sesiones
+    session_data.guardar(data_id, datos_bd)
+    if progreso is not None:
+        progreso('almacenado')
+    return data_id
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def estado_trabajo(job_id):
+    trabajo = cola_trabajos.obtener(job_id)
+    if trabajo is not None:
+        return jsonify(_estado_trabajo(trabajo))
+
+    # Puede haberlo encolado otro worker
+    publicado = estados_trabajos.obtener(job_id) if estados_trabajos is not None else None
+    if publicado is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(publicado)
+
 
-    return f"""
-    <script>
-        window.location.href = "/predict/{filename}";
-    </script>
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancelar_trabajo(job_id):
+    """Abandona un trabajo: si aún no empezó se descarta y libera su lugar en la cola."""
+    if cola_trabajos.obtener(job_id) is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'id': job_id, 'cancelado': cola_trabajos.cancelar(job_id)})
+
+
+@app.route('/jobs/<job_id>/eventos', methods=['GET'])
+def eventos_trabajo(job_id):
+    """
+    Progreso del trabajo como Server-Sent Events: un evento `etapa` por cada etapa
+    (recibido, preprocesado, enviado_documentai, postprocesamiento, almacenado) y al
+    final `resultado` o `error`. Con ?cancelar=1, si el cliente se desconecta antes de
+    que el trabajo empiece, este se cancela.
     """
+    trabajo = cola_trabajos.obtener(job_id)
+    if trabajo is not None:
+        eventos = _eventos_locales(trabajo, request.args.get('cancelar') == '1')
+    elif estados_trabajos is not None and estados_trabajos.obtener(job_id) is not None:
+        # Lo encoló otro worker: se sigue su estado publicado
+        eventos = _eventos_publicados(job_id)
+    else:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    return app.response_class(
+        stream_with_context(eventos),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _evento(tipo: str, datos: dict) -> str:
+    return f"event: {tipo}\ndata: {serializar(datos)}\n\n"
 
 
-@app.route('/predict/<filename>', methods=['GET'])
-def predict_with_file(filename):
-    temp_path = os.path.join(tempfile.gettempdir(), filename)
-    if not os.path.exists(temp_path):
-        return jsonify({'error': 'Archivo no encontrado'}), 404
+def _evento_final(estado: dict) -> str:
+    return _evento('resultado' if estado['estado'] == COMPLETADO else 'error', estado)
 
+
+def _eventos_locales(trabajo, cancelar_al_salir: bool):
+    enviadas = 0
     try:
-        config = setup_environment()
-        etiquetas = cargar_etiquetas()
+        while True:
+            listo = trabajo.listo
+            etapas = trabajo.esperar_etapas(enviadas, LATIDO_SSE_SEGUNDOS)
+            for etapa, instante in etapas:
+                yield _evento('etapa', {'etapa': etapa, 'ms': round((instante - trabajo.creado) * 1000, 1)})
+            enviadas += len(etapas)
+            if listo:
+                break
+            if not etapas and not trabajo.listo:
+                # Comentario SSE: mantiene viva la conexión y detecta clientes desconectados
+                yield ": latido\n\n"
+        yield _evento_final(_estado_trabajo(trabajo))
+    finally:
+        if cancelar_al_salir and not trabajo.listo:
+            cola_trabajos.cancelar(trabajo.id)
+
+
+def _eventos_publicados(job_id: str):
+    etapa = None
+    while True:
+        publicado = estados_trabajos.obtener(job_id)
+        if publicado is None:
+            yield _evento('error', {'id': job_id, 'error': 'Trabajo no encontrado'})
+            return
+        if publicado.get('etapa') != etapa:
+            etapa = publicado.get('etapa')
+            yield _evento('etapa', {'etapa': etapa})
+        else:
+            yield ": latido\n\n"
+        if publicado['estado'] in (COMPLETADO, ERROR):
+            yield _evento_final(publicado)
+            return
+        time.sleep(1)
+
+
+def _estado_trabajo(trabajo) -> dict:
+    respuesta = trabajo.a_dict()
+    if trabajo.estado == COMPLETADO:
+        respuesta['data_id'] = trabajo.resultado
+        respuesta['resultado_url'] = f"/resultado/{trabajo.resultado}"
+        respuesta['api_url'] = f"/api/v1/invoices/{trabajo.resultado}"
+    return respuesta
+
+
+def _leer_cuerpo_limitado(limite: int = None, bloque: int = 64 * 1024):
+    """
+    Cuerpo crudo de la solicitud, o None si supera `limite` bytes. Werkzeug solo
+    aplica MAX_CONTENT_LENGTH al parsear formularios, así que aquí se comprueba
+    Content-Length y además se corta la lectura (cuerpos chunked sin longitud).
+    """
+    if limite is None:
+        return request.get_data(cache=False)
+    if request.content_length is not None and request.content_length > limite:
+        return None
+    partes = []
+    leidos = 0
+    while True:
+        parte = request.stream.read(bloque)
+        if not parte:
+            return b''.join(partes)
+        leidos += len(parte)
+        if leidos > limite:
+            return None
+        partes.append(parte)
+
+
+@app.route('/api/v1/invoices', methods=['POST'])
+def api_crear_factura():
+    """
+    Extracción en una sola solicitud para clientes programáticos: la imagen o PDF va
+    como multipart (campo `file`) o como cuerpo crudo, y la respuesta es JSON con
+    datos_bd y los tiempos. Con ?async=1 (o Prefer: respond-async) responde 202 de
+    inmediato, igual que si la extracción supera API_TIMEOUT_SEGUNDOS.
+    """
+    # Solo multipart trae `file`; con cualquier otro tipo (curl --data-binary envía
+    # application/x-www-form-urlencoded) se lee el cuerpo antes de que Flask lo
+    # consuma como formulario
+    if request.mimetype == 'multipart/form-data':
+        archivo = request.files.get('file')
+        contenido = archivo.read() if archivo is not None else b''
+    else:
+        contenido = _leer_cuerpo_limitado(request.max_content_length)
+        if contenido is None:
+            return jsonify({'error': 'Archivo demasiado grande',
+                            'max_bytes': request.max_content_length}), 413
+    if not contenido:
+        return jsonify({'error': 'Archivo no enviado o vacío'}), 400
 
-        resultado = process_document(temp_path, config, etiquetas)
-        datos_bd = preparar_datos_para_bd(resultado)
+    try:
+        trabajo = cola_trabajos.enviar(procesar_factura, contenido)
+    except ColaLlena as e:
+        logger.warning(str(e))
+        return jsonify({'error': 'Servidor ocupado, intente nuevamente', 'detalle': str(e)}), 503
 
-        # Generar un ID único para estos datos
-        data_id = str(uuid.uuid4())
-
-        # Almacenar datos en memoria (no en disco)
-        session_data[data_id] = datos_bd
-
-        os.unlink(temp_path)
-
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html lang="es">
-            <head>
-                <meta charset="UTF-8">
-                <title>Resultado del Análisis</title>
-                <style>
-                    body {
-                        background-color: #F9F9F9;
-                        font-family: Arial, sans-serif;
-                        padding: 30px;
-                    }
-                    pre {
-                        background-color: #fff;
-                        border: 1px solid #ccc;
-                        padding: 20px;
-                        border-radius: 10px;
-                        white-space: pre-wrap;
-                        word-wrap: break-word;
-                    }
-                    .button-container {
-                        display: flex;
-                        gap: 10px;
-                        margin-top: 20px;
-                        flex-wrap: wrap;
-                    }
-                    a {
-                        display: inline-block;
-                        padding: 10px 15px;
-                        background-color: #2c3e50;
-                        color: white;
-                        text-decoration: none;
-                        border-radius: 5px;
-                        text-align: center;
-                    }
-                    .gui-link {
-                        background-color: #27ae60;
-                    }
-                    .download-link {
-                        background-color: #2980b9;
-                    }
-                </style>
-            </head>
-            <body>
-                <h2>Resultado del Análisis</h2>
-                <pre>{{ resultado }}</pre>
-                
-                <div class="button-container">
-                    <a href="/">🔙 Subir otro archivo</a>
-                    <a href="/gui/{{ data_id }}" class="gui-link">📊 Abrir GUI de Facturación</a>
-                    <a href="/download/{{ data_id }}" class="download-link">💾 Descargar Datos (JSON)</a>
-                </div>
-            </body>
-            </html>
-        """, resultado=json.dumps(datos_bd, indent=4, ensure_ascii=False), data_id=data_id)
+    asincrono = request.args.get('async', '').lower() in ('1', 'true', 'si') or \
+        'respond-async' in request.headers.get('Prefer', '')
+    if asincrono or not trabajo.esperar(API_TIMEOUT_SEGUNDOS):
+        respuesta = jsonify(_estado_trabajo(trabajo))
+        respuesta.headers['Location'] = f"/jobs/{trabajo.id}"
+        return respuesta, 202
 
-    except Exception as e:
-        logger.exception("Error en el procesamiento")
-        return jsonify({'error': 'Error interno', 'detalle': str(e)}), 500
+    if trabajo.estado != COMPLETADO:
+        return jsonify({'error': 'Error al procesar la factura', 'detalle': trabajo.error,
+                        'tiempos': trabajo.tiempos()}), 500
 
+    datos_bd = session_data.obtener(trabajo.resultado)
+    return jsonify(_respuesta_api(trabajo.resultado, datos_bd, trabajo.tiempos()))
 
-@app.route('/download/<data_id>', methods=['GET'])
-def download_json(data_id):
-    datos_bd = session_data.get(data_id)
+
+@app.route('/api/v1/invoices/<data_id>', methods=['GET'])
+def api_obtener_factura(data_id):
+    datos_bd = _obtener_resultado(data_id)
+    if not datos_bd:
+        return jsonify({'error': 'Datos no encontrados o expirados'}), 404
+    return jsonify(_respuesta_api(data_id, datos_bd))
+
+
+@app.route('/api/v1/invoices/batch', methods=['POST'])
+def api_lote_facturas():
+    """
+    Varios archivos en una sola solicitud multipart (cualquier campo de archivo, p. ej.
+    `file` repetido). Las extracciones corren en la cola acotada y cada resultado se
+    envía como una línea NDJSON apenas termina, en orden de finalización y con el
+    nombre original del archivo.
+    """
+    archivos = [archivo for _, archivo in request.files.items(multi=True)]
+    if not archivos:
+        return jsonify({'error': 'No se enviaron archivos'}), 400
+    if len(archivos) > MAX_ARCHIVOS_LOTE:
+        return jsonify({'error': f'Máximo {MAX_ARCHIVOS_LOTE} archivos por lote'}), 400
+
+    return app.response_class(
+        stream_with_context(_procesar_lote(archivos)),
+        mimetype='application/x-ndjson')
+
+
+def _procesar_lote(archivos):
+    # Cada solicitud mantiene a lo sumo max_trabajadores archivos en la cola, para no
+    # acaparar los pendientes que necesitan las subidas individuales
+    en_vuelo_max = cola_trabajos.max_trabajadores
+    terminados: 'queue.Queue' = queue.Queue()
+    nombres: Dict[str, str] = {}
+    por_enviar = deque(archivos)
+    ocupada_desde = None
+
+    while por_enviar or nombres:
+        while por_enviar and len(nombres) < en_vuelo_max:
+            archivo = por_enviar[0]
+            contenido = archivo.read()
+            nombre = archivo.filename or archivo.name
+            if not contenido:
+                por_enviar.popleft()
+                yield serializar({'archivo': nombre, 'error': 'Archivo vacío'}) + '\n'
+                continue
+            try:
+                trabajo = cola_trabajos.enviar(procesar_factura, contenido, avisar=terminados.put)
+            except ColaLlena:
+                # La cola está ocupada por otras solicitudes: reintentar al liberarse un lugar
+                archivo.seek(0)
+                ocupada_desde = ocupada_desde or time.monotonic()
+                if not nombres:
+                    if time.monotonic() - ocupada_desde > API_TIMEOUT_SEGUNDOS:
+                        por_enviar.popleft()
+                        yield serializar({'archivo': nombre, 'error': 'Servidor ocupado'}) + '\n'
+                    else:
+                        time.sleep(0.5)
+                break
+            ocupada_desde = None
+            por_enviar.popleft()
+            nombres[trabajo.id] = nombre
+
+        if not nombres:
+            continue
+        trabajo = terminados.get()
+        nombre = nombres.pop(trabajo.id)
+        if trabajo.estado == COMPLETADO:
+            linea = _respuesta_api(trabajo.resultado, session_data.obtener(trabajo.resultado), trabajo.tiempos())
+            linea = {'archivo': nombre, **linea}
+        else:
+            linea = {'archivo': nombre, 'error': trabajo.error, 'tiempos': trabajo.tiempos()}
+        yield serializar(linea) + '\n'
+
+
+def _respuesta_api(data_id: str, datos_bd: dict, tiempos: dict = None) -> dict:
+    respuesta = {
+        'data_id': data_id,
+        'datos_bd': datos_bd,
+        'gui_url': f"/gui/{data_id}",
+        'download_url': f"/download/{data_id}",
+    }
+    if tiempos is not None:
+        respuesta['tiempos'] = tiempos
+    return respuesta
+
+
+@app.route('/metricas', methods=['GET'])
+def metricas():
+    return jsonify({
+        'cola': cola_trabajos.estadisticas(),
+        'cache': cache_extraccion.estadisticas(),
+        'sesiones': session_data.estadisticas(),
+        'estados_trabajos': estados_trabajos.estadisticas() if estados_trabajos is not None else None,
+        'respuestas': cache_respuestas.estadisticas(),
+        'preprocesamiento': estadisticas_preprocesamiento.a_dict()
+    })
+
+
+@app.route('/resultado/<data_id>', methods=['GET'])
+def mostrar_resultado(data_id):
+    datos_bd = _obtener_resultado(data_id)
     if not datos_bd:
         return "Datos no encontrados o expirados", 404
+    return _renderizar_resultado(data_id, datos_bd)
+
+
+def _renderizar_resultado(data_id: str, datos_bd: dict):
+    return render_template(
+        'resultado.html',
+        resultado=json.dumps(datos_bd, indent=4, ensure_ascii=False),
+        data_id=data_id)
+
+
+def _respuesta_resultado(vista: str, data_id: str, generar, mimetype: str, **cabeceras):
+    """
+    Respuesta de una vista inmutable de un resultado: cuerpo memorizado por data_id,
+    ETag fuerte (304 con If-None-Match) y gzip/brotli según Accept-Encoding.
+    `generar(datos_bd)` retorna el cuerpo en bytes.
+    """
+    # Solo se comprueba que siga vigente: los datos se leen únicamente si hay que generar el cuerpo
+    if not _data_id_valido(data_id) or not session_data.existe(data_id):
+        cache_respuestas.descartar(data_id)
+        return "Datos no encontrados o expirados", 404
+
+    def cargar() -> bytes:
+        datos_bd = session_data.obtener(data_id)
+        if not datos_bd:
+            raise KeyError(data_id)
+        return generar(datos_bd)
+
+    try:
+        cuerpo, etag = cache_respuestas.obtener(vista, data_id, IDENTIDAD, cargar)
+    except KeyError:
+        return "Datos no encontrados o expirados", 404
 
-    # Crear un archivo JSON temporal
-    nombre_archivo = f"factura_{data_id}.json"
-    temp_path = os.path.join(tempfile.gettempdir(), nombre_archivo)
+    codificacion = elegir_codificacion(request.accept_encodings, len(cuerpo))
+    if codificacion != IDENTIDAD:
+        original = cuerpo
+        cuerpo, etag = cache_respuestas.obtener(vista, data_id, codificacion, lambda: original)
 
-    with open(temp_path, 'w', encoding='utf-8') as f:
-        json.dump(datos_bd, f, ensure_ascii=False, indent=4)
+    respuesta = app.response_class(cuerpo, mimetype=mimetype, headers=cabeceras)
+    respuesta.set_etag(etag)
+    respuesta.vary.add('Accept-Encoding')
+    if codificacion != IDENTIDAD:
+        respuesta.content_encoding = codificacion
+    respuesta.cache_control.private = True
+    respuesta.cache_control.max_age = MAX_AGE_RESULTADOS
+    return respuesta.make_conditional(request)
 
-    return send_file(
-        temp_path,
-        as_attachment=True,
-        download_name=nombre_archivo,
-        mimetype='application/json'
-    )
+
+@app.route('/download/<data_id>', methods=['GET'])
+def download_json(data_id):
+    # ?compacto=1: sin indentación ni espacios (más liviano para integraciones)
+    if request.args.get('compacto', '').lower() in ('1', 'true', 'si'):
+        vista, indent = 'download-compacto', None
+    else:
+        vista, indent = 'download', 4
+    return _respuesta_resultado(
+        vista, data_id,
+        lambda datos_bd: serializar(datos_bd, indent).encode('utf-8'),
+        'application/json',
+        **{'Content-Disposition': f'attachment; filename="factura_{data_id}.json"'})
+
+
+@app.route('/download', methods=['GET'])
+def download_ndjson():
+    """
+    Varios resultados como NDJSON (?ids=id1,id2,...): una línea compacta por data_id,
+    generada mientras se envía. Los data_id inexistentes o expirados van como línea de error.
+    """
+    ids = [i for i in request.args.get('ids', '').split(',') if i.strip()]
+    if not ids:
+        return jsonify({'error': 'Indique ids=id1,id2,...'}), 400
+    if len(ids) > MAX_IDS_DESCARGA:
+        return jsonify({'error': f'Máximo {MAX_IDS_DESCARGA} ids por descarga'}), 400
+
+    def lineas():
+        for data_id in map(str.strip, ids):
+            datos_bd = _obtener_resultado(data_id)
+            if datos_bd:
+                linea = {'data_id': data_id, 'datos_bd': datos_bd}
+            else:
+                linea = {'data_id': data_id, 'error': 'Datos no encontrados o expirados'}
+            yield serializar(linea) + '\n'
+
+    return app.response_class(
+        stream_with_context(lineas()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename="facturas.ndjson"'})
 
 
 @app.route('/gui/<data_id>', methods=['GET'])
 def mostrar_gui_factura(data_id):
-    datos_bd = session_data.get(data_id)
-    if not datos_bd:
-        return "Datos no encontrados o expirados", 404
+    return _respuesta_resultado(
+        'gui', data_id,
+        lambda datos_bd: render_template(
+            'gui.html', datos=datos_bd, data_id=data_id,
+            secciones_adicionales=SECCIONES_ADICIONALES).encode('utf-8'),
+        'text/html')
+
+
+SECCIONES_ADICIONALES = (
+    ('facturacion', 'Facturación'),
+    ('pago', 'Información de Pago'),
+    ('responsables', 'Responsables'),
+)
 
-    # Función para convertir saltos de línea en <br>
-    def format_value(value):
-        if isinstance(value, str):
-            return value.replace('\n', '<br>')
-        return value
 
-    # Construir tabla de cliente
-    tabla_cliente = """
-    <table class="data-table">
-        <tr><th colspan="2">Datos del Cliente</th></tr>
-    """
-    for campo, valor in datos_bd.get('cliente', {}).items():
-        valor_formateado = format_value(valor)
-        tabla_cliente += f"""
-        <tr>
-            <td class="field-name">{campo.replace('_', ' ').title()}</td>
-            <td>{valor_formateado}</td>
-        </tr>
-        """
-    tabla_cliente += "</table>"
-
-    # Construir tabla de contrato
-    tabla_contrato = """
-    <table class="data-table">
-        <tr><th colspan="2">Detalles del Contrato</th></tr>
+@app.route('/admin/recargar-configuracion', methods=['POST'])
+def recargar_configuracion_admin():
     """
-    for campo, valor in datos_bd.get('contrato', {}).items():
-        valor_formateado = format_value(valor)
-        tabla_contrato += f"""
-        <tr>
-            <td class="field-name">{campo.replace('_', ' ').title()}</td>
-            <td>{valor_formateado}</td>
-        </tr>
-        """
-    tabla_contrato += "</table>"
-
-    # Construir tablas de facturación, pago y responsables
-    tablas_adicionales = ""
-    secciones = [
-        ('facturacion', 'Facturación'),
-        ('pago', 'Información de Pago'),
-        ('responsables', 'Responsables')
-    ]
-
-    for seccion, titulo in secciones:
-        if seccion in datos_bd:
-            tabla_html = f"""
-            <table class="data-table">
-                <tr><th colspan="2">{titulo}</th></tr>
-            """
-            for campo, valor in datos_bd[seccion].items():
-                valor_formateado = format_value(
-                    valor) if valor is not None else "N/A"
-                tabla_html += f"""
-                <tr>
-                    <td class="field-name">{campo.replace('_', ' ').title()}</td>
-                    <td>{valor_formateado}</td>
-                </tr>
-                """
-            tabla_html += "</table>"
-            tablas_adicionales += tabla_html
-
-    # Construir tabla de productos
-    tabla_productos = """
-    <table class="data-table">
-        <tr>
-            <th>Cantidad</th>
-            <th>Código</th>
-            <th>Detalle</th>
-            <th>Valor Unitario</th>
-            <th>Valor Total</th>
-        </tr>
+    Recarga la configuración solo en el worker que atiende la solicitud. Para
+    aplicarla en todos, `kill -HUP <pid del maestro de gunicorn>` reemplaza los
+    workers de forma ordenada y cada uno arranca con la configuración nueva.
     """
-    for producto in datos_bd.get('productos', []):
-        cantidad = format_value(producto.get('cantidad', 'N/A'))
-        codigo = format_value(producto.get('codigo', 'N/A'))
-        detalle = format_value(producto.get('detalle', 'N/A'))
-        valor_unitario = format_value(producto.get('valor_unitario', 'N/A'))
-        valor_total = format_value(producto.get('valor_total', 'N/A'))
-
-        tabla_productos += f"""
-        <tr>
-            <td>{cantidad}</td>
-            <td>{codigo}</td>
-            <td>{detalle}</td>
-            <td>{valor_unitario}</td>
-            <td>{valor_total}</td>
-        </tr>
-        """
-    tabla_productos += "</table>"
-
-    # Construir sección de validación
-    tabla_validacion = ""
-    if 'validacion' in datos_bd:
-        validacion = datos_bd['validacion']
-        tabla_validacion = """
-        <div class="validation-section">
-            <h3>Validación y Advertencias</h3>
-            <div class="validation-grid">
-        """
-
-        # Advertencias
-        if validacion.get('advertencias'):
-            tabla_validacion += """
-            <div class="validation-card">
-                <h4>Advertencias</h4>
-                <ul>
-            """
-            for advertencia in validacion['advertencias']:
-                tabla_validacion += f"<li>{advertencia}</li>"
-            tabla_validacion += """
-                </ul>
-            </div>
-            """
-
-        # Campos faltantes
-        if validacion.get('campos_faltantes'):
-            tabla_validacion += """
-            <div class="validation-card">
-                <h4>Campos Faltantes</h4>
-                <ul>
-            """
-            for campo in validacion['campos_faltantes']:
-                tabla_validacion += f"<li>{campo}</li>"
-            tabla_validacion += """
-                </ul>
-            </div>
-            """
-
-        tabla_validacion += "</div></div>"
-
-    # HTML completo con estilos
-    return render_template_string(f"""
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Visualizador de Factura - IEVM</title>
-        <style>
-            * {{
-                box-sizing: border-box;
-                margin: 0;
-                padding: 0;
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            }}
-            body {{
-                background-color: #f5f7fa;
-                color: #333;
-                line-height: 1.6;
-                padding: 20px;
-            }}
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background: white;
-                border-radius: 10px;
-                box-shadow: 0 0 20px rgba(0,0,0,0.1);
-                overflow: hidden;
-            }}
-            header {{
-                background: linear-gradient(135deg, #2c3e50, #4a6491);
-                color: white;
-                padding: 30px 40px;
-                text-align: center;
-            }}
-            header h1 {{
-                margin-bottom: 10px;
-                font-size: 2.2rem;
-            }}
-            .content {{
-                padding: 30px;
-            }}
-            .section {{
-                margin-bottom: 30px;
-                padding-bottom: 20px;
-                border-bottom: 1px solid #eaeaea;
-            }}
-            .section:last-child {{
-                border-bottom: none;
-            }}
-            .section-title {{
-                color: #2c3e50;
-                margin-bottom: 20px;
-                padding-bottom: 10px;
-                border-bottom: 2px solid #3498db;
-                font-size: 1.6rem;
-            }}
-            .data-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-                gap: 20px;
-                margin-bottom: 30px;
-            }}
-            .data-table {{
-                width: 100%;
-                border-collapse: collapse;
-                border-radius: 8px;
-                overflow: hidden;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.05);
-            }}
-            .data-table th {{
-                background-color: #3498db;
-                color: white;
-                padding: 15px;
-                text-align: left;
-                font-weight: 600;
-            }}
-            .data-table td {{
-                padding: 12px 15px;
-                border-bottom: 1px solid #eee;
-            }}
-            .data-table tr:nth-child(even) {{
-                background-color: #f8f9fa;
-            }}
-            .field-name {{
-                font-weight: 600;
-                color: #2c3e50;
-                width: 40%;
-            }}
-            .validation-section {{
-                background-color: #fff8e1;
-                border-radius: 8px;
-                padding: 20px;
-                margin-top: 20px;
-                border-left: 4px solid #ffc107;
-            }}
-            .validation-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-                gap: 20px;
-                margin-top: 15px;
-            }}
-            .validation-card {{
-                background-color: white;
-                padding: 15px;
-                border-radius: 6px;
-                box-shadow: 0 2px 5px rgba(0,0,0,0.05);
-            }}
-            .validation-card h4 {{
-                color: #d32f2f;
-                margin-bottom: 10px;
-            }}
-            .validation-card ul {{
-                padding-left: 20px;
-            }}
-            .validation-card li {{
-                margin-bottom: 8px;
-            }}
-            .actions {{
-                display: flex;
-                justify-content: center;
-                gap: 15px;
-                margin-top: 30px;
-                flex-wrap: wrap;
-            }}
-            .btn {{
-                display: inline-block;
-                padding: 12px 25px;
-                background: #3498db;
-                color: white;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: 600;
-                transition: all 0.3s ease;
-                border: none;
-                cursor: pointer;
-                font-size: 1rem;
-            }}
-            .btn:hover {{
-                transform: translateY(-2px);
-                box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            }}
-            .btn-download {{
-                background: #27ae60;
-            }}
-            .btn-download:hover {{
-                background: #219653;
-            }}
-            .btn-back {{
-                background: #95a5a6;
-            }}
-            .btn-back:hover {{
-                background: #7f8c8d;
-            }}
-            @media (max-width: 768px) {{
-                .data-table {{
-                    display: block;
-                    overflow-x: auto;
-                }}
-                .actions {{
-                    flex-direction: column;
-                    align-items: center;
-                }}
-                .btn {{
-                    width: 100%;
-                    max-width: 300px;
-                    text-align: center;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <header>
-                <h1>Visualizador de Contrato</h1>
-                <p>IEVM - Información detallada del documento</p>
-            </header>
-            <div class="content">
-                <div class="section">
-                    <h2 class="section-title">Información Básica</h2>
-                    <div class="data-grid">
-                        {tabla_cliente}
-                        {tabla_contrato}
-                    </div>
-                </div>
-                <div class="section">
-                    <h2 class="section-title">Detalles Adicionales</h2>
-                    <div class="data-grid">
-                        {tablas_adicionales}
-                    </div>
-                </div>
-                <div class="section">
-                    <h2 class="section-title">Productos/Servicios</h2>
-                    {tabla_productos}
-                </div>
-                <div class="section">
-                    {tabla_validacion}
-                </div>
-                <div class="actions">
-                    <a href="/" class="btn btn-back">Volver al Inicio</a>
-                    <a href="/download/{data_id}" class="btn btn-download">Descargar JSON</a>
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
-    """)
+    try:
+        token = obtener_configuracion().admin_token
+    except EnvironmentError:
+        # Configuración aún inválida: justo el caso en que se quiere recargar
+        token = os.getenv('ADMIN_TOKEN')
+
+    enviado = request.headers.get('X-Admin-Token', '')
+    if not token or not hmac.compare_digest(enviado.encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'error': 'No autorizado'}), 403
+
+    try:
+        config = recargar_configuracion()
+    except Exception as e:
+        logger.exception("Error al recargar la configuración")
+        return jsonify({'error': 'Configuración inválida', 'detalle': str(e)}), 500
+
+    return jsonify({'estado': 'recargada', 'version_esquema': config.version_esquema,
+                    'alcance': 'worker', 'pid': os.getpid()})
 
 
 @app.route('/download-app', methods=['GET'])
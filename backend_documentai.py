@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from google.cloud import documentai_v1 as documentai
+from google.api_core import exceptions as gexc
+
+from cliente_documentai import registro_clientes
+
+logger = logging.getLogger('documentai_invoice')
+
+
+class GrabacionNoEncontrada(KeyError):
+    """El reproductor no tiene una respuesta grabada para el documento pedido."""
+
+
+def clave_grabacion(contenido: bytes, mime_type: str) -> str:
+    """Identifica una respuesta grabada por los bytes enviados y su tipo MIME."""
+    h = hashlib.sha256(contenido)
+    h.update(b'\0')
+    h.update(mime_type.encode('utf-8'))
+    return h.hexdigest()
+
+
+class BackendVivo:
+    """Envía el documento a Document AI con el cliente compartido del proceso."""
+
+    nombre = 'vivo'
+
+    def __init__(self, registro=registro_clientes, timeout: float = 120.0):
+        self.registro = registro
+        self.timeout = timeout
+
+    def procesar(self, contenido: bytes, mime_type: str, config: Dict[str, str]) -> documentai.Document:
+        client, name = self.registro.obtener(config)
+        raw = documentai.RawDocument(content=contenido, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=name, raw_document=raw)
+        try:
+            result = client.process_document(request=request, timeout=self.timeout)
+        except (gexc.ServiceUnavailable, gexc.Unknown) as e:
+            # Canal roto (p. ej. conexión cerrada por inactividad): reconstruir y reintentar una vez
+            logger.warning(f"Fallo del canal de Document AI ({e}); reconstruyendo cliente")
+            self.registro.invalidar(config, cliente=client)
+            client, name = self.registro.obtener(config)
+            result = client.process_document(request=request, timeout=self.timeout)
+        return result.document
+
+
+class BackendGrabador:
+    """
+    Delega en otro backend (normalmente el vivo) y guarda cada Document recibido
+    como JSON en `directorio`, para reproducirlo después sin credenciales.
+    """
+
+    nombre = 'grabar'
+
+    def __init__(self, interno, directorio: str):
+        self.interno = interno
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def procesar(self, contenido: bytes, mime_type: str, config: Dict[str, str]) -> documentai.Document:
+        documento = self.interno.procesar(contenido, mime_type, config)
+        ruta = os.path.join(self.directorio, f"{clave_grabacion(contenido, mime_type)}.json")
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                f.write(documentai.Document.to_json(documento))
+            os.replace(temporal, ruta)
+        except OSError as e:
+            logger.warning(f"No se pudo grabar la respuesta de Document AI: {e}")
+        return documento
+
+
+class BackendReproductor:
+    """
+    Sirve los Document grabados por BackendGrabador, sin red ni credenciales.
+    - latencia_ms / variacion_ms: espera simulada por llamada (p. ej. para pruebas de carga)
+    - semilla: hace reproducible la variación de latencia
+    """
+
+    nombre = 'reproducir'
+
+    def __init__(self, directorio: str, latencia_ms: float = 0.0, variacion_ms: float = 0.0,
+                 semilla: Optional[int] = None):
+        self.directorio = directorio
+        self.latencia_ms = latencia_ms
+        self.variacion_ms = variacion_ms
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self._documentos: Dict[str, documentai.Document] = {}
+
+    def grabaciones(self) -> List[str]:
+        """Claves de las respuestas disponibles en el directorio."""
+        return sorted(n[:-len('.json')] for n in os.listdir(self.directorio) if n.endswith('.json'))
+
+    def cargar(self, clave: str) -> documentai.Document:
+        documento = self._documentos.get(clave)
+        if documento is not None:
+            return documento
+        ruta = os.path.join(self.directorio, f"{clave}.json")
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                documento = documentai.Document.from_json(f.read(), ignore_unknown_fields=True)
+        except FileNotFoundError:
+            raise GrabacionNoEncontrada(clave) from None
+        with self._lock:
+            self._documentos[clave] = documento
+        return documento
+
+    def procesar(self, contenido: bytes, mime_type: str, config: Dict[str, str]) -> documentai.Document:
+        documento = self.cargar(clave_grabacion(contenido, mime_type))
+        if self.latencia_ms or self.variacion_ms:
+            with self._lock:
+                variacion = self._azar.uniform(-self.variacion_ms, self.variacion_ms)
+            time.sleep(max(0.0, self.latencia_ms + variacion) / 1000)
+        return documento
+
+
+def crear_backend():
+    """
+    Elige el backend según DOCUMENTAI_BACKEND:
+    - vivo (por defecto): Document AI
+    - grabar: Document AI, guardando cada respuesta en DOCUMENTAI_GRABACIONES
+    - reproducir: respuestas de DOCUMENTAI_GRABACIONES con DOCUMENTAI_LATENCIA_MS
+      (y DOCUMENTAI_VARIACION_MS) de espera simulada
+    """
+    tipo = os.getenv('DOCUMENTAI_BACKEND', 'vivo').strip().lower()
+    directorio = os.getenv('DOCUMENTAI_GRABACIONES', 'grabaciones_documentai')
+    if tipo == 'vivo':
+        return BackendVivo()
+    if tipo == 'grabar':
+        return BackendGrabador(BackendVivo(), directorio)
+    if tipo == 'reproducir':
+        return BackendReproductor(
+            directorio,
+            latencia_ms=float(os.getenv('DOCUMENTAI_LATENCIA_MS', '0')),
+            variacion_ms=float(os.getenv('DOCUMENTAI_VARIACION_MS', '0')))
+    raise ValueError(f"DOCUMENTAI_BACKEND desconocido: {tipo}")
+
+
+_backend = None
+_lock_backend = threading.Lock()
+
+
+def obtener_backend():
+    """Backend del proceso, creado de forma perezosa desde el entorno."""
+    global _backend
+    if _backend is None:
+        with _lock_backend:
+            if _backend is None:
+                _backend = crear_backend()
+                logger.info(f"Backend de extracción: {_backend.nombre}")
+    return _backend
+
+
+def usar_backend(backend):
+    """Reemplaza el backend del proceso (p. ej. un reproductor en benchmarks y pruebas de carga)."""
+    global _backend
+    with _lock_backend:
+        _backend = backend
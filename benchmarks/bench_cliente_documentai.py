@@ -0,0 +1,89 @@
+"""
+Mide la latencia de preparación por solicitud del cliente de Document AI:
+- antes: un DocumentProcessorServiceClient nuevo por factura (comportamiento original)
+- después: cliente compartido desde RegistroClientes
+
+Uso:
+    python benchmarks/bench_cliente_documentai.py [--iteraciones 200] [--anonimo]
+
+--anonimo usa credenciales anónimas para poder ejecutarlo sin credentials.json
+(no mide la carga de credenciales, solo la construcción del cliente y el canal).
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.auth.credentials import AnonymousCredentials  # noqa: E402
+from google.api_core.client_options import ClientOptions  # noqa: E402
+from google.cloud import documentai_v1 as documentai  # noqa: E402
+
+from cliente_documentai import RegistroClientes  # noqa: E402
+
+CONFIG_PRUEBA = {
+    'project_id': 'proyecto-benchmark',
+    'location': 'us',
+    'processor_id': 'procesador',
+    'processor_version_id': 'version',
+}
+
+
+def cliente_por_solicitud(config, credenciales):
+    opts = ClientOptions(
+        api_endpoint=f"{config['location']}-documentai.googleapis.com")
+    client = documentai.DocumentProcessorServiceClient(
+        client_options=opts, credentials=credenciales)
+    name = client.processor_version_path(
+        config['project_id'], config['location'], config['processor_id'], config['processor_version_id']
+    )
+    client.transport.close()
+    return client, name
+
+
+def medir(funcion, iteraciones):
+    tiempos = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+def resumen(nombre, tiempos):
+    tiempos_ordenados = sorted(tiempos)
+    p95 = tiempos_ordenados[int(len(tiempos_ordenados) * 0.95) - 1]
+    print(f"{nombre:<10} media={statistics.mean(tiempos):8.3f} ms  "
+          f"p50={statistics.median(tiempos):8.3f} ms  p95={p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iteraciones', type=int, default=200)
+    parser.add_argument('--anonimo', action='store_true',
+                        help='Usar credenciales anónimas (sin credentials.json)')
+    args = parser.parse_args()
+
+    if args.anonimo:
+        credenciales = AnonymousCredentials()
+        config = CONFIG_PRUEBA
+    else:
+        from test_documentai import setup_environment
+        credenciales = None
+        config = setup_environment()
+
+    registro = RegistroClientes(credenciales=credenciales)
+
+    antes = medir(lambda: cliente_por_solicitud(config, credenciales), args.iteraciones)
+    despues = medir(lambda: registro.obtener(config), args.iteraciones)
+
+    print(f"Preparación del cliente por solicitud ({args.iteraciones} iteraciones)")
+    resumen('antes', antes)
+    resumen('después', despues)
+    print(f"Aceleración (media): {statistics.mean(antes) / statistics.mean(despues):,.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Compara la corrección de dominios de correo con difflib.get_close_matches y con
+IndiceDominios, con la lista actual y con una lista ampliada a miles de dominios,
+y verifica que los resultados son idénticos.
+
+Uso:
+    python benchmarks/bench_dominios.py [--consultas 5000] [--dominios 3000]
+"""
+import os
+import sys
+import time
+import random
+import string
+import argparse
+from difflib import get_close_matches
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from test_documentai import DOMINIOS_VALIDOS  # noqa: E402
+from indice_dominios import IndiceDominios  # noqa: E402
+
+
+def con_ruido(azar, dominio):
+    """Simula errores de OCR: cambia, borra o inserta un par de caracteres."""
+    letras = list(dominio)
+    for _ in range(azar.randint(0, 2)):
+        i = azar.randrange(len(letras))
+        operacion = azar.choice(('cambiar', 'borrar', 'insertar'))
+        if operacion == 'cambiar':
+            letras[i] = azar.choice(string.ascii_lowercase)
+        elif operacion == 'borrar' and len(letras) > 3:
+            del letras[i]
+        else:
+            letras.insert(i, azar.choice(string.ascii_lowercase))
+    return ''.join(letras)
+
+
+def dominios_ampliados(azar, total):
+    dominios = set(DOMINIOS_VALIDOS)
+    sufijos = ['.com', '.com.ec', '.ec', '.net', '.org', '.edu.ec', '.gob.ec']
+    while len(dominios) < total:
+        nombre = ''.join(azar.choice(string.ascii_lowercase) for _ in range(azar.randint(3, 14)))
+        dominios.add(nombre + azar.choice(sufijos))
+    return dominios
+
+
+def medir(dominios, consultas, etiqueta):
+    # Implementación anterior de normalizar_correo: SequenceMatcher contra cada dominio del set
+    inicio = time.perf_counter()
+    esperado = [get_close_matches(c, dominios, n=1, cutoff=0.6) for c in consultas]
+    antes = time.perf_counter() - inicio
+
+    indice = IndiceDominios(dominios)
+    inicio = time.perf_counter()
+    obtenido = [indice.buscar(c, n=1, cutoff=0.6) for c in consultas]
+    despues = time.perf_counter() - inicio
+
+    distintos = sum(1 for a, b in zip(esperado, obtenido) if a != b)
+    if distintos:
+        print(f"ERROR: {distintos} consultas con resultado distinto a get_close_matches")
+        sys.exit(1)
+    print(f"{etiqueta:<28} get_close_matches {len(consultas) / antes:10,.0f}/s   "
+          f"IndiceDominios {len(consultas) / despues:10,.0f}/s   x{antes / despues:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--consultas', type=int, default=5000)
+    parser.add_argument('--dominios', type=int, default=3000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    for dominios, etiqueta in ((set(DOMINIOS_VALIDOS), f"{len(DOMINIOS_VALIDOS)} dominios"),
+                               (dominios_ampliados(azar, args.dominios), f"{args.dominios} dominios")):
+        lista = sorted(dominios)
+        # Mezcla de dominios exactos, con ruido de OCR y basura; se repiten como en la práctica
+        base = [con_ruido(azar, azar.choice(lista)) for _ in range(args.consultas // 4)]
+        base += [''.join(azar.choice(string.ascii_lowercase + '.') for _ in range(azar.randint(2, 12)))
+                 for _ in range(args.consultas // 20)]
+        consultas = [azar.choice(base) for _ in range(args.consultas)]
+        medir(dominios, consultas, etiqueta)
+
+
+if __name__ == '__main__':
+    main()
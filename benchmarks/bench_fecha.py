@@ -0,0 +1,117 @@
+"""
+Compara validar_fecha (expresiones precompiladas en una pasada y memo) con la
+implementación anterior (regex sin compilar y hasta ocho intentos de strptime),
+verificando que ambas retornan exactamente lo mismo.
+
+Uso:
+    python benchmarks/bench_fecha.py [--fechas 200000] [--distintas 20000]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from test_documentai import validar_fecha  # noqa: E402
+from bench_posprocesamiento import fecha as fecha_sintetica  # noqa: E402
+
+
+def validar_fecha_anterior(texto):
+    """Implementación anterior de validar_fecha, como referencia."""
+    try:
+        patron_especial = r'(\d{1,2})\s*(?:dia)?[^\d]*(\d{1,2})\s*(?:mes)?[^\d]*(\d{4})(?:\s*año)?'
+        match = re.search(patron_especial, texto, re.IGNORECASE)
+        if match:
+            dia, mes, anio = match.groups()
+            fecha = datetime(int(anio), int(mes), int(dia))
+            return fecha.strftime('%d/%m/%Y'), True
+
+        formatos_comunes = ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']
+        texto_limpio = texto.strip()
+
+        for fmt in formatos_comunes:
+            try:
+                fecha = datetime.strptime(texto_limpio, fmt)
+                return fecha.strftime('%d/%m/%Y'), True
+            except ValueError:
+                continue
+
+        solo_numeros = re.sub(r'[^\d/]', '', texto)
+        for fmt in formatos_comunes:
+            try:
+                fecha = datetime.strptime(solo_numeros, fmt)
+                return fecha.strftime('%d/%m/%Y'), True
+            except ValueError:
+                continue
+
+        return texto.strip(), False
+
+    except Exception:
+        return texto.strip(), False
+
+
+def fecha_aleatoria(azar):
+    """Fechas con ruido de OCR, fechas imposibles y texto arbitrario."""
+    tipo = azar.random()
+    if tipo < 0.5:
+        return fecha_sintetica(azar)
+    if tipo < 0.8:
+        d, m = azar.randint(0, 35), azar.randint(0, 14)
+        a = azar.choice([azar.randint(1900, 2099), azar.randint(0, 99)])
+        sep = azar.choice('/-. ')
+        return azar.choice([f"{d}{sep}{m}{sep}{a}", f"{a}{sep}{m:02d}{sep}{d:02d}", f" {d:2d}/{m}/{a:02d} ",
+                            f"{d:02d}/{m:02d}/{a:02d}x", f"Fecha: {d}/{m}/{a}"])
+    return ''.join(azar.choice('0123456789/- .adimesñoAO') for _ in range(azar.randint(0, 14)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fechas', type=int, default=200000,
+                        help='Fechas del lote (con repeticiones, como en una importación)')
+    parser.add_argument('--distintas', type=int, default=20000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    distintas = [fecha_aleatoria(azar) for _ in range(args.distintas)]
+
+    diferentes = [t for t in distintas if validar_fecha(t) != validar_fecha_anterior(t)]
+    if diferentes:
+        print(f"ERROR: {len(diferentes)} entradas con resultado distinto, p. ej. {diferentes[:5]!r}")
+        sys.exit(1)
+    validar_fecha.cache_clear()
+
+    lote = [azar.choice(distintas) for _ in range(args.fechas)]
+
+    inicio = time.perf_counter()
+    for texto in distintas:
+        validar_fecha_anterior(texto)
+    anterior_distintas = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for texto in distintas:
+        validar_fecha.__wrapped__(texto)
+    actual_distintas = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for texto in lote:
+        validar_fecha_anterior(texto)
+    anterior_lote = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for texto in lote:
+        validar_fecha(texto)
+    actual_lote = time.perf_counter() - inicio
+
+    print(f"{args.distintas} entradas distintas: resultados idénticos a la implementación anterior")
+    print(f"{'sin repetir (sin memo)':<28} anterior {args.distintas / anterior_distintas:10,.0f}/s   "
+          f"actual {args.distintas / actual_distintas:10,.0f}/s   x{anterior_distintas / actual_distintas:.1f}")
+    print(f"{'lote de importación':<28} anterior {args.fechas / anterior_lote:10,.0f}/s   "
+          f"actual {args.fechas / actual_lote:10,.0f}/s   x{anterior_lote / actual_lote:.1f}")
+
+
+if __name__ == '__main__':
+    main()
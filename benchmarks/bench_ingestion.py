@@ -0,0 +1,93 @@
+"""
+Compara la ingesta de una subida multipart:
+- antes: Werkzeug por defecto (desborda a disco desde 500 KB) + NamedTemporaryFile
+  + reapertura y lectura del archivo para enviarlo a Document AI
+- después: RequestEnMemoria (spool en memoria hasta SUBIDA_MAX_MEMORIA) + lectura única
+
+Uso:
+    python benchmarks/bench_ingestion.py [archivo] [--iteraciones 200]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+from werkzeug.wrappers import Request  # noqa: E402
+
+from app import RequestEnMemoria  # noqa: E402
+
+
+class RequestContado(Request):
+    """Request por defecto que contabiliza los bytes que el spool manda a disco."""
+    bytes_disco = 0
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if total_content_length and total_content_length > 1024 * 500:
+            RequestContado.bytes_disco += total_content_length
+        return stream
+
+
+def entorno(contenido: bytes):
+    import io
+    return EnvironBuilder(
+        method='POST', path='/upload',
+        data={'file': (io.BytesIO(contenido), 'factura.jpg')}).get_environ()
+
+
+def ingesta_antes(contenido: bytes) -> int:
+    file = RequestContado(entorno(contenido)).files['file']
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+        file.save(temp_file.name)
+    with open(temp_file.name, 'rb') as f:
+        leido = f.read()
+    os.unlink(temp_file.name)
+    # escritura del archivo temporal + lectura posterior
+    return 2 * len(leido)
+
+
+def ingesta_despues(contenido: bytes) -> int:
+    file = RequestEnMemoria(entorno(contenido)).files['file']
+    file.read()
+    return 0
+
+
+def medir(funcion, contenido, iteraciones):
+    tiempos = []
+    disco = 0
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        disco += funcion(contenido)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos, disco
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('archivo', nargs='?',
+                        default=os.path.join(os.path.dirname(__file__), '..', 'image.jpg'))
+    parser.add_argument('--iteraciones', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.archivo, 'rb') as f:
+        contenido = f.read()
+
+    antes, disco_antes = medir(ingesta_antes, contenido, args.iteraciones)
+    disco_antes += RequestContado.bytes_disco
+    despues, disco_despues = medir(ingesta_despues, contenido, args.iteraciones)
+
+    print(f"Ingesta de {len(contenido) / 1024:,.0f} KB ({args.iteraciones} iteraciones)")
+    print(f"antes      media={statistics.mean(antes):8.3f} ms  "
+          f"E/S de disco por subida={disco_antes / args.iteraciones / 1024:,.0f} KB")
+    print(f"después    media={statistics.mean(despues):8.3f} ms  "
+          f"E/S de disco por subida={disco_despues / args.iteraciones / 1024:,.0f} KB")
+    print("Además se elimina el segundo viaje HTTP (redirección JS a /predict/<archivo>).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compara datos_bd como diccionarios anidados con el modelo Factura (modelo_factura.py):
+memoria retenida por N facturas (como en la cache de extracción) y tiempo de
+serialización con indentación frente a JSON compacto. Verifica además que
+Factura.desde_dict(d).a_dict() reproduce exactamente d, incluido el orden de claves.
+
+Uso:
+    python benchmarks/bench_modelo.py [--facturas 20000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from test_documentai import cargar_etiquetas, procesar_entidades, preparar_datos_para_bd  # noqa: E402
+from modelo_factura import Factura, serializar  # noqa: E402
+from bench_posprocesamiento import factura_sintetica  # noqa: E402
+
+
+def memoria_retenida(construir):
+    """Bytes que siguen asignados por el resultado de construir()."""
+    tracemalloc.start()
+    resultado = construir()
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return actual, resultado
+
+
+def medir(funcion, elementos):
+    inicio = time.perf_counter()
+    for elemento in elementos:
+        funcion(elemento)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--facturas', type=int, default=20000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    etiquetas = cargar_etiquetas()
+    textos = [json.dumps(preparar_datos_para_bd(procesar_entidades(factura_sintetica(azar), etiquetas)))
+              for _ in range(args.facturas)]
+    # Secciones y columnas de CAMPOS_EXTRA también deben sobrevivir la conversión
+    extra = json.loads(textos[0])
+    extra['pago']['fecha'] = '01/02/2024'
+    productos, validacion = extra.pop('productos'), extra.pop('validacion')
+    extra['envio'] = {'transportista': 'Servientrega'}
+    extra['productos'], extra['validacion'] = productos, validacion
+    textos[0] = json.dumps(extra)
+
+    bytes_dict, diccionarios = memoria_retenida(lambda: [json.loads(t) for t in textos])
+    bytes_modelo, facturas = memoria_retenida(lambda: [Factura.desde_dict(json.loads(t)) for t in textos])
+
+    for datos, factura in zip(diccionarios, facturas):
+        if json.dumps(factura.a_dict(), ensure_ascii=False) != json.dumps(datos, ensure_ascii=False):
+            print("ERROR: Factura.desde_dict(d).a_dict() no reproduce d")
+            sys.exit(1)
+
+    con_indent = medir(lambda d: json.dumps(d, indent=4, ensure_ascii=False), diccionarios)
+    compacto = medir(serializar, diccionarios)
+    modelo = medir(Factura.a_json, facturas)
+    ida_vuelta = medir(lambda t: Factura.desde_json(t).a_dict(), textos)
+
+    n = args.facturas
+    print(f"{n} facturas sintéticas, conversión idéntica al esquema JSON")
+    print(f"{'memoria dict':<24} {bytes_dict / n:8,.0f} B/factura")
+    print(f"{'memoria Factura':<24} {bytes_modelo / n:8,.0f} B/factura "
+          f"({100 * (1 - bytes_modelo / bytes_dict):.1f}% menos)")
+    print(f"{'json.dumps indent=4':<24} {n / con_indent:10,.0f} facturas/s")
+    print(f"{'serializar compacto':<24} {n / compacto:10,.0f} facturas/s ({con_indent / compacto:.1f}x)")
+    print(f"{'Factura.a_json':<24} {n / modelo:10,.0f} facturas/s ({con_indent / modelo:.1f}x)")
+    print(f"{'desde_json + a_dict':<24} {n / ida_vuelta:10,.0f} facturas/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compara la normalización de montos factura por factura (implementación anterior
+de formatear_monto) con la API por lotes de montos.py sobre columnas de muchas
+facturas, y verifica que los resultados son idénticos.
+
+Uso:
+    python benchmarks/bench_montos.py [--facturas 50000]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from montos import formatear_montos, montos_decimal, normalizar_columnas_montos  # noqa: E402
+from test_documentai import formatear_monto  # noqa: E402
+from bench_posprocesamiento import monto  # noqa: E402
+
+COLUMNAS = ('subtotal', 'total_impuestos', 'total_final', 'abono', 'saldo_pendiente')
+
+
+def formatear_monto_anterior(texto):
+    """Implementación anterior de formatear_monto, como referencia."""
+    try:
+        texto_limpio = re.sub(r"[^\d,\.]", "", texto)
+        texto_limpio = texto_limpio.replace(",", ".")
+        if texto_limpio.count(".") > 1:
+            partes = texto_limpio.split(".")
+            texto_limpio = f"{''.join(partes[:-1])}.{partes[-1]}"
+        val = float(texto_limpio)
+        return f"{val:,.2f}"
+    except ValueError:
+        return texto.strip()
+
+
+def monto_repetido(azar, frecuentes):
+    """Los precios y abonos se repiten mucho entre facturas; el resto es ruido de OCR."""
+    if azar.random() < 0.6:
+        return azar.choice(frecuentes)
+    if azar.random() < 0.1:
+        return ''.join(azar.choice('0123456789.,$ Sl/N') for _ in range(azar.randint(0, 10)))
+    return monto(azar)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--facturas', type=int, default=50000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    frecuentes = [monto(azar) for _ in range(500)]
+    columnas = {c: [monto_repetido(azar, frecuentes) for _ in range(args.facturas)] for c in COLUMNAS}
+    todos = [t for lista in columnas.values() for t in lista]
+
+    esperado = [formatear_monto_anterior(t) for t in todos]
+    if formatear_montos(todos) != esperado or [formatear_monto(t) for t in todos] != esperado:
+        print("ERROR: la API por lotes no produce el mismo resultado que formatear_monto")
+        sys.exit(1)
+    decimales = montos_decimal(todos)
+    if any(d is not None and d != Decimal(e.replace(',', '')) for d, e in zip(decimales, esperado)):
+        print("ERROR: montos_decimal no coincide con el texto formateado")
+        sys.exit(1)
+
+    inicio = time.perf_counter()
+    for lista in columnas.values():
+        [formatear_monto_anterior(t) for t in lista]
+    anterior = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    normalizar_columnas_montos(columnas)
+    lote = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    normalizar_columnas_montos(columnas, como_decimal=True)
+    lote_decimal = time.perf_counter() - inicio
+
+    print(f"{len(todos):,} montos ({args.facturas:,} facturas x {len(COLUMNAS)} columnas), resultados idénticos")
+    print(f"{'uno por uno (anterior)':<26} {len(todos) / anterior:12,.0f} montos/s")
+    print(f"{'por lotes':<26} {len(todos) / lote:12,.0f} montos/s   x{anterior / lote:.1f}")
+    print(f"{'por lotes (Decimal)':<26} {len(todos) / lote_decimal:12,.0f} montos/s")
+
+
+if __name__ == '__main__':
+    main()
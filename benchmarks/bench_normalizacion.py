@@ -0,0 +1,132 @@
+"""
+Compara el plan de normalización precompilado (procesar_entidades actual) con la
+cadena if/elif anterior, sobre facturas sintéticas, y verifica que ambos producen
+exactamente el mismo resultado.
+
+Uso:
+    python benchmarks/bench_normalizacion.py [--facturas 20000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from test_documentai import (  # noqa: E402
+    cargar_etiquetas, procesar_entidades, preparar_datos_para_bd, CAMPOS_PRODUCTO, PATRON_PRODUCTO,
+    validar_telefono_ecuador, validar_cedula_ruc, normalizar_correo, formatear_monto, validar_fecha
+)
+from bench_posprocesamiento import Entidad, factura_sintetica  # noqa: E402
+
+
+def agrupar_productos(datos):
+    """Agrupación anterior: mueve los campos productoN_* de `datos` a una lista ordenada por N."""
+    items = {}
+    for clave in [c for c in datos if c.startswith('producto')]:
+        match = PATRON_PRODUCTO.fullmatch(clave)
+        if match:
+            items.setdefault(int(match.group(1)), dict.fromkeys(CAMPOS_PRODUCTO))[match.group(2)] = datos.pop(clave)
+    return [items[i] for i in sorted(items) if any(items[i].values())]
+
+
+def procesar_entidades_cadena(entidades, etiquetas_validas):
+    """Implementación anterior: cadena de comparaciones por cada entidad."""
+    datos = {}
+    advertencias = []
+
+    for ent in entidades:
+        key = ent.type_
+        text = ent.mention_text or ''
+
+        if key in etiquetas_validas and text.strip():
+            if key == 'Telefono':
+                valor, valido = validar_telefono_ecuador(text)
+                datos[key] = valor
+                if not valido:
+                    advertencias.append(
+                        f"Teléfono '{valor}' no tiene formato ecuatoriano válido (09XXXXXXXX)")
+
+            elif key == 'Ruc':
+                valor, valido = validar_cedula_ruc(text)
+                datos[key] = valor
+                if not valido:
+                    advertencias.append(
+                        f"Identificación '{valor}' no es cédula (10 dígitos) ni RUC (13 dígitos) válido")
+
+            elif key == 'Correo':
+                valor, valido = normalizar_correo(text)
+                datos[key] = valor
+                if not valido:
+                    advertencias.append(
+                        f"Correo '{valor}' podría ser inválido o dominio no reconocido")
+
+            elif key in {'subtotal', 'total_impuestos', 'total_final', 'abono', 'saldo_pendiente'} or \
+                    (key.startswith('producto') and key.endswith(('valor_total', 'valor_unitario'))):
+                datos[key] = formatear_monto(text)
+
+            elif key in {'Fecha_contrato', 'Fecha_entrega'}:
+                datos[key], valido = validar_fecha(text)
+                if not valido:
+                    advertencias.append(
+                        f"Fecha '{text}' tiene un formato inválido, se esperaba dd/mm/yyyy")
+
+            else:
+                datos[key] = text.strip()
+
+    productos = agrupar_productos(datos)
+
+    faltantes = sorted(
+        etiquetas_validas - set(datos.keys()) -
+        {f'producto{i}_{c}' for i in range(1, 21) for c in [
+            'cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total']}
+    )
+
+    return {
+        'datos_generales': datos,
+        'productos': productos,
+        'faltantes': faltantes,
+        'advertencias': advertencias
+    }
+
+
+def medir(funcion, facturas, etiquetas):
+    inicio = time.perf_counter()
+    resultados = [preparar_datos_para_bd(funcion(entidades, etiquetas)) for entidades in facturas]
+    return time.perf_counter() - inicio, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--facturas', type=int, default=20000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    facturas = [factura_sintetica(azar) for _ in range(args.facturas)]
+    # Entidades fuera del esquema, que ambas implementaciones deben descartar
+    for entidades in facturas[::7]:
+        entidades.append(Entidad('sello_notaria', 'x'))
+    etiquetas = cargar_etiquetas()
+
+    # El esquema anterior enumeraba los 20 productos posibles como etiquetas
+    etiquetas_anteriores = etiquetas | {
+        f'producto{i}_{c}' for i in range(1, 21)
+        for c in ('cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total')}
+
+    antes, esperado = medir(procesar_entidades_cadena, facturas, etiquetas_anteriores)
+    despues, obtenido = medir(procesar_entidades, facturas, etiquetas)
+
+    if json.dumps(esperado, ensure_ascii=False) != json.dumps(obtenido, ensure_ascii=False):
+        print("ERROR: el plan de normalización no produce el mismo resultado que la cadena if/elif")
+        sys.exit(1)
+
+    print(f"{args.facturas} facturas sintéticas ({sum(map(len, facturas)):,} entidades), resultados idénticos")
+    print(f"{'cadena if/elif':<18} {antes:7.2f} s {args.facturas / antes:10,.0f} facturas/s")
+    print(f"{'plan precompilado':<18} {despues:7.2f} s {args.facturas / despues:10,.0f} facturas/s "
+          f"({100 * (1 - despues / antes):.1f}% menos tiempo)")
+
+
+if __name__ == '__main__':
+    main()
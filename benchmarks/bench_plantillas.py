@@ -0,0 +1,187 @@
+"""
+Compara el render de /gui con la implementación anterior (HTML armado con += de
+f-strings, ~160 líneas de CSS en línea y render_template_string en cada
+solicitud) frente a la plantilla gui.html precompilada con el CSS en static/.
+Reporta tiempo de render y tamaño de respuesta.
+
+Uso:
+    python benchmarks/bench_plantillas.py [--facturas 2000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import render_template, render_template_string  # noqa: E402
+from app import app, SECCIONES_ADICIONALES  # noqa: E402
+from test_documentai import cargar_etiquetas, procesar_entidades, preparar_datos_para_bd  # noqa: E402
+from bench_posprocesamiento import factura_sintetica  # noqa: E402
+
+with open(os.path.join(app.static_folder, 'css', 'gui.css'), encoding='utf-8') as f:
+    CSS_GUI = f.read()
+
+
+def renderizar_gui_anterior(datos_bd, data_id):
+    """Implementación anterior de mostrar_gui_factura, como referencia."""
+    def format_value(value):
+        if isinstance(value, str):
+            return value.replace('\n', '<br>')
+        return value
+
+    def tabla(titulo, campos, vacio=None):
+        html = f"""
+    <table class="data-table">
+        <tr><th colspan="2">{titulo}</th></tr>
+    """
+        for campo, valor in campos.items():
+            valor_formateado = format_value(valor) if valor is not None or vacio is None else vacio
+            html += f"""
+        <tr>
+            <td class="field-name">{campo.replace('_', ' ').title()}</td>
+            <td>{valor_formateado}</td>
+        </tr>
+        """
+        return html + "</table>"
+
+    tabla_cliente = tabla('Datos del Cliente', datos_bd.get('cliente', {}))
+    tabla_contrato = tabla('Detalles del Contrato', datos_bd.get('contrato', {}))
+    tablas_adicionales = ""
+    for seccion, titulo in SECCIONES_ADICIONALES:
+        if seccion in datos_bd:
+            tablas_adicionales += tabla(titulo, datos_bd[seccion], "N/A")
+
+    tabla_productos = """
+    <table class="data-table">
+        <tr>
+            <th>Cantidad</th>
+            <th>Código</th>
+            <th>Detalle</th>
+            <th>Valor Unitario</th>
+            <th>Valor Total</th>
+        </tr>
+    """
+    for producto in datos_bd.get('productos', []):
+        celdas = [format_value(producto.get(c, 'N/A'))
+                  for c in ('cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total')]
+        tabla_productos += f"""
+        <tr>
+            <td>{celdas[0]}</td>
+            <td>{celdas[1]}</td>
+            <td>{celdas[2]}</td>
+            <td>{celdas[3]}</td>
+            <td>{celdas[4]}</td>
+        </tr>
+        """
+    tabla_productos += "</table>"
+
+    validacion = datos_bd['validacion']
+    tabla_validacion = """
+        <div class="validation-section">
+            <h3>Validación y Advertencias</h3>
+            <div class="validation-grid">
+        """
+    for titulo, elementos in (('Advertencias', validacion['advertencias']),
+                              ('Campos Faltantes', validacion['campos_faltantes'])):
+        if elementos:
+            tabla_validacion += f"""
+            <div class="validation-card">
+                <h4>{titulo}</h4>
+                <ul>
+            """
+            for elemento in elementos:
+                tabla_validacion += f"<li>{elemento}</li>"
+            tabla_validacion += """
+                </ul>
+            </div>
+            """
+    tabla_validacion += "</div></div>"
+
+    return render_template_string(f"""
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Visualizador de Factura - IEVM</title>
+        <style>
+{CSS_GUI}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <header>
+                <h1>Visualizador de Contrato</h1>
+                <p>IEVM - Información detallada del documento</p>
+            </header>
+            <div class="content">
+                <div class="section">
+                    <h2 class="section-title">Información Básica</h2>
+                    <div class="data-grid">
+                        {tabla_cliente}
+                        {tabla_contrato}
+                    </div>
+                </div>
+                <div class="section">
+                    <h2 class="section-title">Detalles Adicionales</h2>
+                    <div class="data-grid">
+                        {tablas_adicionales}
+                    </div>
+                </div>
+                <div class="section">
+                    <h2 class="section-title">Productos/Servicios</h2>
+                    {tabla_productos}
+                </div>
+                <div class="section">
+                    {tabla_validacion}
+                </div>
+                <div class="actions">
+                    <a href="/" class="btn btn-back">Volver al Inicio</a>
+                    <a href="/download/{data_id}" class="btn btn-download">Descargar JSON</a>
+                </div>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+
+def renderizar_gui(datos_bd, data_id):
+    return render_template('gui.html', datos=datos_bd, data_id=data_id,
+                           secciones_adicionales=SECCIONES_ADICIONALES)
+
+
+def medir(funcion, facturas):
+    inicio = time.perf_counter()
+    total = 0
+    for i, datos_bd in enumerate(facturas):
+        total += len(funcion(datos_bd, str(i)).encode('utf-8'))
+    return time.perf_counter() - inicio, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--facturas', type=int, default=2000)
+    args = parser.parse_args()
+
+    azar = random.Random(2024)
+    etiquetas = cargar_etiquetas()
+    facturas = [preparar_datos_para_bd(procesar_entidades(factura_sintetica(azar), etiquetas))
+                for _ in range(args.facturas)]
+
+    with app.test_request_context('/'):
+        antes, bytes_antes = medir(renderizar_gui_anterior, facturas)
+        despues, bytes_despues = medir(renderizar_gui, facturas)
+
+    n = args.facturas
+    css = len(CSS_GUI.encode('utf-8'))
+    print(f"{n} facturas sintéticas")
+    print(f"{'render_template_string':<24} {1000 * antes / n:7.3f} ms/render {bytes_antes / n:8,.0f} B/respuesta")
+    print(f"{'gui.html precompilada':<24} {1000 * despues / n:7.3f} ms/render {bytes_despues / n:8,.0f} B/respuesta "
+          f"({antes / despues:.1f}x; gui.css de {css:,} B se descarga una vez)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Mide el posprocesamiento que corre después de Document AI (validadores, bucle de
+entidades, agrupación de productos y preparar_datos_para_bd) y falla si el
+rendimiento cae por debajo de la línea base guardada.
+
+Uso:
+    python benchmarks/bench_posprocesamiento.py [--tamanos 1,100,1000,10000,100000]
+        [--grabaciones DIR] [--linea-base ARCHIVO] [--tolerancia 0.3] [--guardar-linea-base]
+
+Sin --grabaciones usa facturas sintéticas (con ruido típico de OCR) generadas con
+una semilla fija. Con --grabaciones usa los Document grabados por
+DOCUMENTAI_BACKEND=grabar, repetidos hasta completar cada tamaño.
+Sale con código 1 si alguna métrica queda más de `tolerancia` por debajo de la línea base.
+La línea base guarda además la tasa de una carga de referencia que no depende del
+código del repositorio, medida antes de cada métrica y tomando la mejor; al comparar,
+la línea base se escala por la velocidad de esa referencia en la misma corrida, así
+otra máquina (o una más cargada) no se confunde con una regresión.
+"""
+import os
+import sys
+import json
+import time
+import re
+import random
+import argparse
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from test_documentai import (  # noqa: E402
+    cargar_etiquetas, procesar_entidades, preparar_datos_para_bd,
+    validar_telefono_ecuador, validar_cedula_ruc, normalizar_correo, formatear_monto, validar_fecha
+)
+
+LINEA_BASE = os.path.join(os.path.dirname(__file__), 'linea_base_posprocesamiento.json')
+
+# Facturas generadas por bloque: acota la memoria con 100k facturas
+BLOQUE = 10000
+
+# Cada función se mide sobre este número de tramos disjuntos y se toma el mejor,
+# sin repetir valores (las funciones con memo no deben medirse sobre aciertos)
+TRAMOS = 5
+
+# Con menos facturas el tiempo medido es demasiado ruidoso para compararlo con la línea base
+MIN_FACTURAS_COMPARABLES = 1000
+
+# Misma forma que documentai.Document.Entity para lo que usa procesar_entidades
+Entidad = namedtuple('Entidad', 'type_ mention_text')
+
+NOMBRES = ['Juan Pérez', 'MARIA LOPEZ', 'Carlos Andrade', 'Ana Vélez', 'Industrias Vilema S.A.']
+CIUDADES = ['Quito', 'Guayaquil', 'Cuenca', 'AMBATO', 'Riobamba', 'Loja']
+DOMINIOS = ['gmail.com', 'gmial.com', 'hotmail.com', 'hotmal.com', 'yahoo.es', 'outlok.com',
+            'espol.edu.ec', 'gob.ec', 'empresa.com.ec', 'xyz']
+DETALLES = ['Cortina roller blackout', 'Persiana vertical', 'Instalación', 'Riel doble', 'Tela sheer']
+
+
+def telefono(azar):
+    numero = f"09{azar.randrange(10 ** 8):08d}"
+    return azar.choice([
+        numero, f"{numero[:3]} {numero[3:6]} {numero[6:]}", f"{numero} / 02-{azar.randrange(10 ** 7):07d}",
+        f"{azar.randrange(10 ** 7):07d}"])
+
+
+def identificacion(azar):
+    cedula = f"{azar.randrange(10 ** 10):010d}"
+    return azar.choice([cedula, f"{cedula}001", f"C.I. {cedula[:9]}-{cedula[9]}", f"l{cedula[1:6]}O{cedula[7:]}"])
+
+
+def correo(azar):
+    local = f"{azar.choice(['juan', 'maria.l', 'ventas', 'c_andrade'])}{azar.randrange(1000)}"
+    dominio = azar.choice(DOMINIOS)
+    return azar.choice([f"{local}@{dominio}", f"{local} (at) {dominio}", f"{local} {dominio}",
+                        f"{local.upper()}@{dominio.upper()}"])
+
+
+def fecha(azar):
+    d, m, a = azar.randint(1, 28), azar.randint(1, 12), azar.randint(2018, 2025)
+    return azar.choice([
+        f"{d:02d}/{m:02d}/{a}", f"{d} dia/{m:02d} mes {a}. año", f"{a}-{m:02d}-{d:02d}",
+        f"{d}/{m}/{a % 100:02d}", f"{d:02d}/{m:02d}/{a}.", f"l{d}/O{m}/{a}", "sin fecha"])
+
+
+def monto(azar):
+    valor = azar.randrange(100, 500000) / 100
+    return azar.choice([f"{valor:.2f}", f"$ {valor:,.2f}", f"{valor:.2f}".replace('.', ','),
+                        f"{valor:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'), "S/N"])
+
+
+def factura_sintetica(azar):
+    entidades = [
+        Entidad('Nombrecliente', azar.choice(NOMBRES)),
+        Entidad('Ruc', identificacion(azar)),
+        Entidad('Direccion_factura', f"Av. {azar.randrange(1, 99)} de Agosto N{azar.randrange(100)}-{azar.randrange(100)}"),
+        Entidad('Ciudad', azar.choice(CIUDADES)),
+        Entidad('Correo', correo(azar)),
+        Entidad('Telefono', telefono(azar)),
+        Entidad('Fecha_contrato', fecha(azar)),
+        Entidad('Fecha_entrega', fecha(azar)),
+        Entidad('codigocontrato', f"C-{azar.randrange(100000):05d}"),
+        Entidad('subtotal', monto(azar)),
+        Entidad('total_impuestos', monto(azar)),
+        Entidad('total_final', monto(azar)),
+        Entidad('abono', monto(azar)),
+        Entidad('saldo_pendiente', monto(azar)),
+        Entidad('Operario', azar.choice(NOMBRES)),
+    ]
+    for i in range(1, azar.randint(1, 6) + 1):
+        entidades += [
+            Entidad(f'producto{i}_cantidad', str(azar.randint(1, 12))),
+            Entidad(f'producto{i}_codigo', f"P{azar.randrange(1000):03d}"),
+            Entidad(f'producto{i}_detalle', azar.choice(DETALLES)),
+            Entidad(f'producto{i}_valor_unitario', monto(azar)),
+            Entidad(f'producto{i}_valor_total', monto(azar)),
+        ]
+    azar.shuffle(entidades)
+    return entidades
+
+
+class FuenteSintetica:
+    nombre = 'sintetico'
+
+    def __init__(self, semilla=2024):
+        self.semilla = semilla
+
+    def bloques(self, total):
+        """Genera `total` facturas en bloques de BLOQUE (lista de listas de entidades)."""
+        azar = random.Random(self.semilla)
+        for inicio in range(0, total, BLOQUE):
+            yield [factura_sintetica(azar) for _ in range(min(BLOQUE, total - inicio))]
+
+
+class FuenteGrabada:
+    """Entidades de los Document grabados, tal cual los sirve BackendReproductor."""
+    nombre = 'grabado'
+
+    def __init__(self, directorio):
+        from backend_documentai import BackendReproductor
+        reproductor = BackendReproductor(directorio)
+        self.facturas = [list(reproductor.cargar(clave).entities) for clave in reproductor.grabaciones()]
+        if not self.facturas:
+            raise SystemExit(f"No hay grabaciones en {directorio}")
+
+    def bloques(self, total):
+        for inicio in range(0, total, BLOQUE):
+            yield [self.facturas[i % len(self.facturas)]
+                   for i in range(inicio, min(inicio + BLOQUE, total))]
+
+
+def por_segundo(n, segundos):
+    return round(n / segundos, 1) if segundos else float('inf')
+
+
+def mejor_por_segundo(funcion, valores):
+    """Mejor tasa de `funcion` entre TRAMOS tramos disjuntos de `valores`."""
+    tamano = max(1, len(valores) // TRAMOS)
+    mejor = 0.0
+    for inicio in range(0, len(valores), tamano):
+        tramo = valores[inicio:inicio + tamano]
+        t0 = time.perf_counter()
+        for valor in tramo:
+            funcion(valor)
+        mejor = max(mejor, por_segundo(len(tramo), time.perf_counter() - t0))
+    return mejor
+
+
+REFERENCIA = 'referencia/calibracion'
+
+_PATRON_REFERENCIA = re.compile(r'[^0-9a-z]+')
+_TEXTOS_REFERENCIA = [f"Factura N° {i:05d} / Cliente {i % 97} - Total $ {i * 3.7:,.2f}" for i in range(20000)]
+
+
+def _carga_referencia(texto):
+    # Parecida a un validador (regex, métodos de str, dict) pero ajena al código medido
+    partes = _PATRON_REFERENCIA.split(texto.lower())
+    return {parte: len(parte) for parte in partes if parte}
+
+
+class Referencia:
+    """
+    Operaciones por segundo de una carga fija, para escalar la línea base a esta máquina.
+    Se mide entre métricas y se conserva la mejor, igual que cada métrica toma su mejor tramo.
+    """
+
+    def __init__(self):
+        self.mejor = 0.0
+
+    def medir(self):
+        self.mejor = max(self.mejor, mejor_por_segundo(_carga_referencia, _TEXTOS_REFERENCIA))
+
+
+def medir_funciones(fuente, etiquetas, facturas, referencia):
+    """Operaciones por segundo de cada etapa, sin repetir valores."""
+    facturas = [f for bloque in fuente.bloques(facturas) for f in bloque]
+    textos = {}
+    for entidades in facturas:
+        for ent in entidades:
+            textos.setdefault(ent.type_, []).append(ent.mention_text or '')
+
+    montos = [t for clave, lista in textos.items()
+              if clave in {'subtotal', 'total_impuestos', 'total_final', 'abono', 'saldo_pendiente'}
+              or clave.endswith(('valor_total', 'valor_unitario')) for t in lista]
+    casos = {
+        'validar_telefono_ecuador': (validar_telefono_ecuador, textos.get('Telefono', [])),
+        'validar_cedula_ruc': (validar_cedula_ruc, textos.get('Ruc', [])),
+        'normalizar_correo': (normalizar_correo, textos.get('Correo', [])),
+        'formatear_monto': (formatear_monto, montos),
+        'validar_fecha': (validar_fecha, textos.get('Fecha_contrato', []) + textos.get('Fecha_entrega', [])),
+    }
+
+    resultados = {}
+    for nombre, (funcion, valores) in casos.items():
+        referencia.medir()
+        resultados[nombre] = mejor_por_segundo(funcion, valores)
+
+    procesados = []
+    referencia.medir()
+    resultados['procesar_entidades'] = mejor_por_segundo(
+        lambda entidades: procesados.append(procesar_entidades(entidades, etiquetas)), facturas)
+
+    resultados['preparar_datos_para_bd'] = mejor_por_segundo(preparar_datos_para_bd, procesados)
+    return resultados
+
+
+def medir_extremo_a_extremo(fuente, etiquetas, total):
+    """Facturas por segundo de procesar_entidades + preparar_datos_para_bd (sin contar la generación)."""
+    segundos = 0.0
+    for bloque in fuente.bloques(total):
+        inicio = time.perf_counter()
+        for entidades in bloque:
+            preparar_datos_para_bd(procesar_entidades(entidades, etiquetas))
+        segundos += time.perf_counter() - inicio
+    return por_segundo(total, segundos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tamanos', default='1,100,1000,10000,100000',
+                        help='Cantidades de facturas para la medición de extremo a extremo')
+    parser.add_argument('--facturas-funciones', type=int, default=20000,
+                        help='Facturas cuyos valores se usan para medir cada función')
+    parser.add_argument('--grabaciones', help='Directorio de respuestas grabadas de Document AI')
+    parser.add_argument('--linea-base', default=LINEA_BASE)
+    parser.add_argument('--tolerancia', type=float, default=0.3,
+                        help='Caída máxima aceptada respecto a la línea base (0.3 = 30%%)')
+    parser.add_argument('--guardar-linea-base', action='store_true',
+                        help='Guardar los resultados como nueva línea base en lugar de comparar')
+    args = parser.parse_args()
+
+    fuente = FuenteGrabada(args.grabaciones) if args.grabaciones else FuenteSintetica()
+    etiquetas = cargar_etiquetas()
+
+    referencia = Referencia()
+    metricas = {}
+    for nombre, valor in medir_funciones(fuente, etiquetas, args.facturas_funciones, referencia).items():
+        metricas[f"{fuente.nombre}/{nombre}"] = valor
+    for total in (int(t) for t in args.tamanos.split(',')):
+        referencia.medir()
+        metricas[f"{fuente.nombre}/extremo_a_extremo@{total}"] = medir_extremo_a_extremo(fuente, etiquetas, total)
+    referencia.medir()
+    metricas[REFERENCIA] = referencia.mejor
+
+    linea_base = {}
+    if os.path.isfile(args.linea_base):
+        with open(args.linea_base, 'r', encoding='utf-8') as f:
+            linea_base = json.load(f)
+
+    def comparable(nombre):
+        return '@' not in nombre or int(nombre.rsplit('@', 1)[1]) >= MIN_FACTURAS_COMPARABLES
+
+    # Velocidad de esta corrida respecto a la de la línea base (1.0 si no hay referencia guardada)
+    escala = metricas[REFERENCIA] / linea_base[REFERENCIA] if linea_base.get(REFERENCIA) else 1.0
+    print(f"Referencia: {metricas[REFERENCIA]:,.1f} ops/s; línea base escalada x{escala:.2f}")
+
+    regresiones = []
+    print(f"{'Métrica':<52} {'ops/s':>12} {'base':>12} {'cambio':>8}")
+    for nombre, valor in metricas.items():
+        if nombre == REFERENCIA:
+            continue
+        base = linea_base[nombre] * escala if linea_base.get(nombre) else None
+        cambio = f"{100 * (valor / base - 1):+7.1f}%" if base else '       -'
+        print(f"{nombre:<52} {valor:>12,.1f} {base or 0:>12,.1f} {cambio}")
+        if base and comparable(nombre) and valor < base * (1 - args.tolerancia):
+            regresiones.append(nombre)
+
+    if args.guardar_linea_base:
+        linea_base.update(metricas)
+        with open(args.linea_base, 'w', encoding='utf-8') as f:
+            json.dump(linea_base, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Línea base guardada en {args.linea_base}")
+    elif regresiones:
+        print(f"REGRESIÓN (más de {args.tolerancia:.0%} por debajo de la línea base): {', '.join(regresiones)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Mide el efecto del preprocesamiento (orientación EXIF, límite de resolución/DPI,
+re-codificación JPEG) sobre una carpeta de escaneos de muestra.
+
+Uso:
+    python benchmarks/bench_preprocesamiento.py [carpeta] [--documentai]
+
+Sin --documentai solo reporta bytes ahorrados y tiempo de preprocesamiento.
+Con --documentai (requiere credentials.json y .env) envía cada imagen con y sin
+preprocesar y compara la latencia de extremo a extremo.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from preprocesamiento import preprocesar_imagen, config_desde_entorno  # noqa: E402
+
+EXTENSIONES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp')
+
+
+def listar_imagenes(carpeta):
+    if os.path.isfile(carpeta):
+        return [carpeta]
+    return sorted(
+        os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta)
+        if nombre.lower().endswith(EXTENSIONES))
+
+
+def extraer(contenido, mime_type, entorno, etiquetas):
+    from test_documentai import process_document_bytes
+    inicio = time.perf_counter()
+    process_document_bytes(contenido, entorno, etiquetas, mime_type=mime_type)
+    return (time.perf_counter() - inicio) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('carpeta', nargs='?', default=os.path.join(os.path.dirname(__file__), '..'))
+    parser.add_argument('--documentai', action='store_true',
+                        help='Medir también la latencia de Document AI con y sin preprocesamiento')
+    args = parser.parse_args()
+
+    config = config_desde_entorno()
+    archivos = listar_imagenes(args.carpeta)
+    if not archivos:
+        print(f"No hay imágenes en {args.carpeta}")
+        sys.exit(1)
+
+    if args.documentai:
+        from test_documentai import setup_environment, cargar_etiquetas
+        entorno, etiquetas = setup_environment(), cargar_etiquetas()
+
+    total_original = total_final = 0
+    tiempos_prep, latencias_antes, latencias_despues = [], [], []
+    print(f"{'Archivo':<30} {'Original':>10} {'Final':>10} {'Ahorro':>7} {'Prep ms':>8}")
+    for ruta in archivos:
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        mime_type = 'image/png' if ruta.lower().endswith('.png') else 'image/jpeg'
+        if ruta.lower().endswith(('.tif', '.tiff')):
+            mime_type = 'image/tiff'
+
+        inicio = time.perf_counter()
+        procesado, mime_final, _ = preprocesar_imagen(contenido, mime_type, config)
+        ms = (time.perf_counter() - inicio) * 1000
+
+        tiempos_prep.append(ms)
+        total_original += len(contenido)
+        total_final += len(procesado)
+        ahorro = 100 * (1 - len(procesado) / len(contenido))
+        print(f"{os.path.basename(ruta)[:30]:<30} {len(contenido) / 1024:>8,.0f}KB "
+              f"{len(procesado) / 1024:>8,.0f}KB {ahorro:>6.1f}% {ms:>8.1f}")
+
+        if args.documentai:
+            latencias_antes.append(extraer(contenido, mime_type, entorno, etiquetas))
+            latencias_despues.append(ms + extraer(procesado, mime_final, entorno, etiquetas))
+
+    print('-' * 70)
+    print(f"Total: {total_original / 1024:,.0f} KB -> {total_final / 1024:,.0f} KB "
+          f"({100 * (1 - total_final / total_original):.1f}% menos), "
+          f"preprocesamiento medio {statistics.mean(tiempos_prep):.1f} ms")
+    if args.documentai:
+        print(f"Latencia media extremo a extremo: sin preprocesar {statistics.mean(latencias_antes):,.0f} ms, "
+              f"con preprocesamiento {statistics.mean(latencias_despues):,.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
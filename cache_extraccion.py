@@ -0,0 +1,178 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Mapping
+
+from modelo_factura import Factura
+
+logger = logging.getLogger('documentai_invoice')
+
+
+def clave_cache(contenido: bytes, config: Mapping[str, str], version_esquema: str, version_validadores: str,
+                extra: str = '') -> str:
+    """
+    Clave direccionada por contenido: hash de los bytes subidos más todo lo que
+    cambia el resultado (versión del procesador, del esquema y de los validadores,
+    y en `extra` p. ej. la configuración de preprocesamiento).
+    """
+    h = hashlib.sha256(contenido)
+    procesador = '/'.join((
+        config['project_id'], config['location'],
+        config['processor_id'], config['processor_version_id']
+    ))
+    for parte in (procesador, version_esquema, version_validadores, extra):
+        h.update(b'\0')
+        h.update(parte.encode('utf-8'))
+    return h.hexdigest()
+
+
+class CacheExtraccion:
+    """
+    Cache de `datos_bd` en dos niveles:
+    - memoria: LRU de hasta `max_entradas` resultados, guardados como Factura (con
+      __slots__, bastante más livianos que los diccionarios anidados)
+    - disco (opcional): un JSON por clave en `directorio`, acotado por `max_bytes_disco`
+    Ambos niveles descartan entradas con más de `ttl` segundos.
+    """
+
+    def __init__(self, max_entradas: int = 256, ttl: float = 7 * 24 * 3600,
+                 directorio: Optional[str] = None, max_bytes_disco: int = 100 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.directorio = directorio
+        self.max_bytes_disco = max_bytes_disco
+        self._lock = threading.Lock()
+        self._memoria: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._aciertos_memoria = 0
+        self._aciertos_disco = 0
+        self._fallos = 0
+        self._expulsiones = 0
+        self._bytes_disco = 0
+
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+            self._bytes_disco = sum(
+                e.stat().st_size for e in os.scandir(directorio) if e.name.endswith('.json'))
+
+    def obtener(self, clave: str) -> Optional[Dict[str, Any]]:
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                guardado, factura = entrada
+                if ahora - guardado <= self.ttl:
+                    self._memoria.move_to_end(clave)
+                    self._aciertos_memoria += 1
+                    # a_dict() construye diccionarios nuevos: el llamador puede modificarlos
+                    return factura.a_dict()
+                del self._memoria[clave]
+
+        factura = self._leer_disco(clave, ahora)
+        with self._lock:
+            if factura is None:
+                self._fallos += 1
+                return None
+            self._aciertos_disco += 1
+            self._guardar_memoria(clave, factura, ahora)
+        return factura.a_dict()
+
+    def guardar(self, clave: str, datos: Dict[str, Any]):
+        ahora = time.time()
+        factura = Factura.desde_dict(datos)
+        with self._lock:
+            self._guardar_memoria(clave, factura, ahora)
+        self._escribir_disco(clave, factura)
+
+    def _guardar_memoria(self, clave: str, factura: Factura, ahora: float):
+        self._memoria[clave] = (ahora, factura)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+            self._expulsiones += 1
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.json")
+
+    def _leer_disco(self, clave: str, ahora: float) -> Optional[Factura]:
+        if not self.directorio:
+            return None
+        ruta = self._ruta(clave)
+        try:
+            if ahora - os.path.getmtime(ruta) > self.ttl:
+                self._borrar_archivo(ruta)
+                return None
+            with open(ruta, 'rb') as f:
+                return Factura.desde_json(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Entrada de cache ilegible {ruta}: {e}")
+            self._borrar_archivo(ruta)
+            return None
+
+    def _escribir_disco(self, clave: str, factura: Factura):
+        if not self.directorio:
+            return
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            contenido = factura.a_json().encode('utf-8')
+            with open(temporal, 'wb') as f:
+                f.write(contenido)
+            os.replace(temporal, ruta)
+        except OSError as e:
+            logger.warning(f"No se pudo escribir la cache en disco: {e}")
+            return
+        with self._lock:
+            self._bytes_disco += len(contenido)
+            excedido = self._bytes_disco > self.max_bytes_disco
+        if excedido:
+            self._recortar_disco()
+
+    def _recortar_disco(self):
+        """Borra expirados y luego los archivos más antiguos hasta quedar bajo el límite."""
+        ahora = time.time()
+        archivos = []
+        for entrada in os.scandir(self.directorio):
+            if not entrada.name.endswith('.json'):
+                continue
+            try:
+                st = entrada.stat()
+            except FileNotFoundError:
+                continue
+            archivos.append((st.st_mtime, st.st_size, entrada.path))
+        archivos.sort()
+
+        total = sum(tamano for _, tamano, _ in archivos)
+        for mtime, tamano, ruta in archivos:
+            if total <= self.max_bytes_disco and ahora - mtime <= self.ttl:
+                break
+            self._borrar_archivo(ruta)
+            total -= tamano
+        with self._lock:
+            self._bytes_disco = total
+
+    def _borrar_archivo(self, ruta: str):
+        try:
+            os.unlink(ruta)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._expulsiones += 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self._aciertos_memoria + self._aciertos_disco + self._fallos
+            aciertos = self._aciertos_memoria + self._aciertos_disco
+            return {
+                'aciertos_memoria': self._aciertos_memoria,
+                'aciertos_disco': self._aciertos_disco,
+                'fallos': self._fallos,
+                'tasa_aciertos': round(aciertos / consultas, 3) if consultas else None,
+                'entradas_memoria': len(self._memoria),
+                'bytes_disco': self._bytes_disco if self.directorio else None,
+                'expulsiones': self._expulsiones,
+            }
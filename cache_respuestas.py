@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTIDAD = 'identity'
+
+# Codificaciones ofrecidas, en orden de preferencia ante igual calidad en Accept-Encoding
+CODIFICACIONES: Tuple[str, ...] = (('br',) if brotli is not None else ()) + ('gzip',)
+
+# Por debajo de este tamaño comprimir no compensa las cabeceras ni el CPU
+MIN_COMPRIMIR = 512
+
+
+def comprimir(cuerpo: bytes, codificacion: str) -> bytes:
+    if codificacion == 'gzip':
+        return gzip.compress(cuerpo, compresslevel=6)
+    if codificacion == 'br' and brotli is not None:
+        return brotli.compress(cuerpo, quality=5)
+    raise ValueError(f"Codificación no soportada: {codificacion}")
+
+
+def elegir_codificacion(aceptadas, tamano: int) -> str:
+    """Codificación para una respuesta de `tamano` bytes según Accept-Encoding (werkzeug Accept)."""
+    if tamano < MIN_COMPRIMIR:
+        return IDENTIDAD
+    return aceptadas.best_match(CODIFICACIONES + (IDENTIDAD,), default=IDENTIDAD)
+
+
+def etiqueta(cuerpo: bytes) -> str:
+    """ETag fuerte: hash del cuerpo sin comprimir."""
+    return hashlib.sha256(cuerpo).hexdigest()[:32]
+
+
+class CacheRespuestas:
+    """
+    Cuerpos ya generados (HTML de /gui, JSON de /download) por vista y data_id, con
+    su ETag y sus variantes comprimidas. Los resultados no cambian una vez
+    extraídos, así que cada vista se genera y comprime una sola vez por data_id.
+    LRU acotado por `max_entradas` y `max_bytes` (suma de todas las variantes).
+    """
+
+    def __init__(self, max_entradas: int = 512, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (vista, data_id, codificación) -> (cuerpo, etag)
+        self._entradas: 'OrderedDict[Tuple[str, str, str], Tuple[bytes, str]]' = OrderedDict()
+        self._bytes = 0
+        self._aciertos = 0
+        self._fallos = 0
+
+    def obtener(self, vista: str, data_id: str, codificacion: str,
+                generar: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """
+        Retorna (cuerpo, etag) de la vista en `codificacion`; `generar()` produce el
+        cuerpo sin comprimir y solo se llama si no está en la cache.
+        """
+        clave = (vista, data_id, codificacion)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self._aciertos += 1
+                return entrada
+            self._fallos += 1
+
+        if codificacion == IDENTIDAD:
+            cuerpo = generar()
+            entrada = (cuerpo, etiqueta(cuerpo))
+        else:
+            original, etag = self.obtener(vista, data_id, IDENTIDAD, generar)
+            # Cada representación necesita su propia ETag fuerte
+            entrada = (comprimir(original, codificacion), f"{etag}-{codificacion}")
+
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = entrada
+            self._bytes += len(entrada[0])
+            while len(self._entradas) > 1 and (
+                    len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                self._quitar(next(iter(self._entradas)))
+        return entrada
+
+    def descartar(self, data_id: str):
+        """Olvida todas las vistas de un data_id (p. ej. al expirar su resultado)."""
+        with self._lock:
+            for clave in [c for c in self._entradas if c[1] == data_id]:
+                self._quitar(clave)
+
+    def _quitar(self, clave: Tuple[str, str, str]):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= len(entrada[0])
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._aciertos + self._fallos
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'aciertos': self._aciertos,
+                'fallos': self._fallos,
+                'tasa_aciertos': round(self._aciertos / total, 3) if total else 0.0,
+                'codificaciones': list(CODIFICACIONES),
+            }
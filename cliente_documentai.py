@@ -0,0 +1,119 @@
+import os
+import logging
+import threading
+from typing import Dict, Any, Tuple
+
+from google.cloud import documentai_v1 as documentai
+from google.api_core.client_options import ClientOptions
+from google.cloud.documentai_v1.services.document_processor_service.transports import (
+    DocumentProcessorServiceGrpcTransport
+)
+
+logger = logging.getLogger('documentai_invoice')
+
+# Opciones del canal gRPC para mantener viva la conexión entre facturas
+OPCIONES_CANAL = [
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_send_message_length', 40 * 1024 * 1024),
+    ('grpc.max_receive_message_length', 40 * 1024 * 1024),
+]
+
+
+def clave_procesador(config: Dict[str, str]) -> Tuple[str, str, str, str]:
+    """Proyecto, región (que fija el endpoint), procesador y versión: identifican el cliente."""
+    return (
+        config['project_id'], config['location'],
+        config['processor_id'], config['processor_version_id']
+    )
+
+
+class RegistroClientes:
+    """
+    Mantiene un único cliente de Document AI (y su canal gRPC) por proceso.
+    - Se crea de forma perezosa en la primera factura y se reutiliza después.
+    - Es seguro entre hilos: la creación está protegida por un lock.
+    - Es seguro ante fork (gunicorn --preload): el proceso hijo descarta
+      los clientes heredados y crea los suyos.
+    - invalidar() descarta el cliente para reconstruirlo tras un fallo de canal.
+    """
+
+    def __init__(self, credenciales=None):
+        # None: credenciales por defecto (GOOGLE_APPLICATION_CREDENTIALS)
+        self._credenciales = credenciales
+        self._lock = threading.Lock()
+        self._clientes: Dict[Tuple[str, str, str, str], Tuple[Any, str]] = {}
+        self._pid = os.getpid()
+
+    def _reiniciar_tras_fork(self):
+        # Los canales gRPC no sobreviven a un fork: no se cierran, solo se olvidan
+        self._lock = threading.Lock()
+        self._clientes = {}
+        self._pid = os.getpid()
+
+    def obtener(self, config: Dict[str, str]) -> Tuple[Any, str]:
+        """Retorna (cliente, processor_version_path) para la configuración dada."""
+        if self._pid != os.getpid():
+            self._reiniciar_tras_fork()
+
+        clave = clave_procesador(config)
+        entrada = self._clientes.get(clave)
+        if entrada is not None:
+            return entrada
+
+        with self._lock:
+            entrada = self._clientes.get(clave)
+            if entrada is None:
+                entrada = self._crear_cliente(config)
+                self._clientes[clave] = entrada
+        return entrada
+
+    def _crear_cliente(self, config: Dict[str, str]) -> Tuple[Any, str]:
+        logger.info("Inicializando cliente de Document AI...")
+        endpoint = f"{config['location']}-documentai.googleapis.com"
+        canal = DocumentProcessorServiceGrpcTransport.create_channel(
+            f"{endpoint}:443", credentials=self._credenciales, options=OPCIONES_CANAL)
+        transporte = DocumentProcessorServiceGrpcTransport(
+            host=endpoint, channel=canal)
+        client = documentai.DocumentProcessorServiceClient(
+            transport=transporte,
+            client_options=ClientOptions(api_endpoint=endpoint))
+        name = client.processor_version_path(
+            config['project_id'], config['location'], config['processor_id'], config['processor_version_id']
+        )
+        return client, name
+
+    def invalidar(self, config: Dict[str, str] = None, cliente: Any = None):
+        """
+        Descarta el cliente (o todos) para que se reconstruya en el siguiente uso; las
+        llamadas en curso terminan con el cliente anterior.
+        Si se indica `cliente`, solo se descarta cuando sigue siendo el registrado,
+        así varios hilos que fallan a la vez no tiran un cliente recién creado.
+        """
+        with self._lock:
+            if config is None:
+                descartados = list(self._clientes.values())
+                self._clientes.clear()
+            else:
+                clave = clave_procesador(config)
+                entrada = self._clientes.get(clave)
+                if entrada is not None and (cliente is None or entrada[0] is cliente):
+                    del self._clientes[clave]
+                    descartados = [entrada]
+                else:
+                    descartados = []
+
+        # El canal no se cierra aquí: otros hilos pueden seguir dentro de process_document
+        # y close() cancelaría sus llamadas. gRPC lo cierra cuando el último deja de usarlo.
+        if descartados:
+            logger.warning("Cliente de Document AI descartado; se reconstruirá en el próximo uso")
+
+
+registro_clientes = RegistroClientes()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        after_in_child=lambda: registro_clientes._reiniciar_tras_fork())
+
@@ -0,0 +1,257 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger('documentai_invoice')
+
+PENDIENTE = 'pendiente'
+PROCESANDO = 'procesando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+# Primera etapa de todo trabajo; las siguientes las reporta la extracción con Trabajo.avanzar
+RECIBIDO = 'recibido'
+
+_local = threading.local()
+
+
+def trabajo_actual() -> Optional['Trabajo']:
+    """Trabajo que se está ejecutando en este hilo del pool (None fuera de la cola)."""
+    return getattr(_local, 'trabajo', None)
+
+
+class ColaLlena(Exception):
+    """Se lanza cuando la cola ya tiene el máximo de trabajos pendientes."""
+
+
+class Trabajo:
+    """Estado y tiempos de una extracción enviada a la cola."""
+
+    def __init__(self, trabajo_id: str):
+        self.id = trabajo_id
+        self.estado = PENDIENTE
+        self.creado = time.time()
+        self.iniciado: Optional[float] = None
+        self.terminado: Optional[float] = None
+        self.resultado: Any = None
+        self.error: Optional[str] = None
+        self.etapas: List[Tuple[str, float]] = [(RECIBIDO, self.creado)]
+        self.avisar: Optional[Callable[['Trabajo'], None]] = None
+        self._cambio = threading.Condition()
+        self._listo = False
+        self._futuro = None
+
+    @property
+    def finalizado(self) -> bool:
+        return self.estado in (COMPLETADO, ERROR)
+
+    @property
+    def listo(self) -> bool:
+        """True cuando el trabajo finalizó y ya tiene su resultado o error."""
+        return self._listo
+
+    @property
+    def etapa(self) -> str:
+        return self.etapas[-1][0]
+
+    def avanzar(self, etapa: str):
+        """Registra una etapa de la extracción (las repetidas, p. ej. por lote de páginas, se ignoran)."""
+        with self._cambio:
+            if any(nombre == etapa for nombre, _ in self.etapas):
+                return
+            self.etapas.append((etapa, time.time()))
+            self._cambio.notify_all()
+
+    def esperar(self, timeout: Optional[float] = None) -> bool:
+        """Bloquea hasta que el trabajo finalice; False si vence `timeout` antes."""
+        with self._cambio:
+            return self._cambio.wait_for(lambda: self._listo, timeout)
+
+    def esperar_etapas(self, desde: int, timeout: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Etapas registradas a partir de la posición `desde`. Si no hay nuevas y el trabajo
+        sigue en curso, espera hasta `timeout` a que aparezca alguna o a que finalice.
+        """
+        with self._cambio:
+            self._cambio.wait_for(lambda: len(self.etapas) > desde or self._listo, timeout)
+            return self.etapas[desde:]
+
+    def _finalizar(self):
+        with self._cambio:
+            self._listo = True
+            self._cambio.notify_all()
+
+    def tiempos(self) -> Dict[str, Optional[float]]:
+        def ms(desde, hasta):
+            if desde is None or hasta is None:
+                return None
+            return round((hasta - desde) * 1000, 1)
+
+        ahora = time.time()
+        return {
+            'espera_ms': ms(self.creado, self.iniciado or (None if self.finalizado else ahora)),
+            'proceso_ms': ms(self.iniciado, self.terminado or (ahora if self.iniciado else None)),
+            'total_ms': ms(self.creado, self.terminado or ahora),
+        }
+
+    def a_dict(self) -> Dict[str, Any]:
+        datos = {
+            'id': self.id,
+            'estado': self.estado,
+            'etapa': self.etapa,
+            'tiempos': self.tiempos(),
+        }
+        if self.error:
+            datos['error'] = self.error
+        return datos
+
+
+class ColaTrabajos:
+    """
+    Cola acotada de extracciones ejecutadas por un pool fijo de hilos.
+    - max_trabajadores: extracciones simultáneas (llamadas a Document AI en vuelo)
+    - max_pendientes: trabajos en espera antes de rechazar con ColaLlena
+    - max_retenidos: trabajos finalizados que se conservan para consulta
+    - publicar: callback opcional invocado en cada cambio de estado (p. ej. para
+      compartir el estado con otros workers)
+    """
+
+    def __init__(self, max_trabajadores: int = 4, max_pendientes: int = 32, max_retenidos: int = 1000,
+                 publicar: Optional[Callable[[Trabajo], None]] = None):
+        self.max_trabajadores = max_trabajadores
+        self.max_pendientes = max_pendientes
+        self.max_retenidos = max_retenidos
+        self.publicar = publicar
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_trabajadores, thread_name_prefix='extraccion')
+        self._lock = threading.Lock()
+        self._trabajos: 'OrderedDict[str, Trabajo]' = OrderedDict()
+        self._pendientes = 0
+        self._en_proceso = 0
+        self._completados = 0
+        self._fallidos = 0
+        self._rechazados = 0
+        self._cancelados = 0
+        self._proceso_total_ms = 0.0
+
+    def enviar(self, funcion: Callable[..., Any], *args, trabajo_id: str = None,
+               avisar: Optional[Callable[[Trabajo], None]] = None) -> Trabajo:
+        """
+        Encola `funcion(*args)` y retorna el trabajo sin esperar su resultado.
+        `avisar(trabajo)` se llama desde el hilo del pool cuando el trabajo finaliza,
+        o desde quien lo cancela si se descarta antes de empezar.
+        """
+        trabajo = Trabajo(trabajo_id or str(uuid.uuid4()))
+        trabajo.avisar = avisar
+        with self._lock:
+            if self._pendientes >= self.max_pendientes:
+                self._rechazados += 1
+                raise ColaLlena(
+                    f"Cola llena ({self._pendientes} trabajos pendientes)")
+            self._pendientes += 1
+            self._trabajos[trabajo.id] = trabajo
+            self._purgar()
+
+        self._notificar(trabajo)
+        trabajo._futuro = self._pool.submit(self._ejecutar, trabajo, funcion, args)
+        return trabajo
+
+    def avanzar(self, trabajo: Trabajo, etapa: str):
+        """Registra una etapa del trabajo y la publica."""
+        trabajo.avanzar(etapa)
+        self._notificar(trabajo)
+
+    def cancelar(self, trabajo_id: str) -> bool:
+        """
+        Descarta un trabajo que aún no empezó (p. ej. si el cliente abandonó la espera)
+        y libera su lugar en la cola. Los trabajos en curso no se interrumpen.
+        """
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is None or trabajo._futuro is None or not trabajo._futuro.cancel():
+                return False
+            self._pendientes -= 1
+            self._cancelados += 1
+        trabajo.terminado = time.time()
+        trabajo.error = 'Cancelado'
+        trabajo.estado = ERROR
+        trabajo._finalizar()
+        # Quien espera avisos (p. ej. un lote) cuenta también los trabajos cancelados
+        if trabajo.avisar is not None:
+            trabajo.avisar(trabajo)
+        self._notificar(trabajo)
+        logger.info(f"Trabajo {trabajo.id} cancelado antes de empezar")
+        return True
+
+    def _ejecutar(self, trabajo: Trabajo, funcion: Callable[..., Any], args):
+        with self._lock:
+            self._pendientes -= 1
+            self._en_proceso += 1
+        trabajo.iniciado = time.time()
+        trabajo.estado = PROCESANDO
+        self._notificar(trabajo)
+
+        _local.trabajo = trabajo
+        try:
+            trabajo.resultado = funcion(*args)
+            trabajo.estado = COMPLETADO
+        except Exception as e:
+            logger.exception(f"Error en el trabajo {trabajo.id}")
+            trabajo.error = str(e)
+            trabajo.estado = ERROR
+        finally:
+            _local.trabajo = None
+            trabajo.terminado = time.time()
+            with self._lock:
+                self._en_proceso -= 1
+                if trabajo.estado == COMPLETADO:
+                    self._completados += 1
+                else:
+                    self._fallidos += 1
+                self._proceso_total_ms += (trabajo.terminado - trabajo.iniciado) * 1000
+
+        trabajo._finalizar()
+        if trabajo.avisar is not None:
+            trabajo.avisar(trabajo)
+        self._notificar(trabajo)
+        logger.info(
+            f"Trabajo {trabajo.id} {trabajo.estado} en {trabajo.tiempos()['total_ms']} ms")
+
+    def _notificar(self, trabajo: Trabajo):
+        if self.publicar is None:
+            return
+        try:
+            self.publicar(trabajo)
+        except Exception:
+            logger.exception(f"No se pudo publicar el estado del trabajo {trabajo.id}")
+
+    def _purgar(self):
+        # Descarta los trabajos finalizados más antiguos; nunca los que siguen en curso
+        exceso = len(self._trabajos) - self.max_retenidos
+        if exceso <= 0:
+            return
+        for trabajo_id in [t.id for t in self._trabajos.values() if t.finalizado][:exceso]:
+            del self._trabajos[trabajo_id]
+
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            finalizados = self._completados + self._fallidos
+            return {
+                'pendientes': self._pendientes,
+                'en_proceso': self._en_proceso,
+                'completados': self._completados,
+                'fallidos': self._fallidos,
+                'rechazados': self._rechazados,
+                'cancelados': self._cancelados,
+                'max_trabajadores': self.max_trabajadores,
+                'max_pendientes': self.max_pendientes,
+                'proceso_medio_ms': round(self._proceso_total_ms / finalizados, 1) if finalizados else None,
+            }
@@ -0,0 +1,87 @@
+import os
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, FrozenSet, Optional
+
+from dotenv import load_dotenv
+
+from test_documentai import setup_environment, cargar_etiquetas, cargar_campos, reiniciar_planes
+from cliente_documentai import registro_clientes, clave_procesador
+from preprocesamiento import ConfigPreprocesamiento, config_desde_entorno
+
+logger = logging.getLogger('documentai_invoice')
+
+
+@dataclass(frozen=True)
+class Configuracion:
+    """
+    Configuración y esquema de etiquetas precalculados, compartidos por todos los handlers.
+    Es inmutable: una recarga construye un objeto nuevo y lo reemplaza atómicamente.
+    """
+    entorno: Mapping[str, str]
+    etiquetas: FrozenSet[str]
+    version_esquema: str
+    preprocesamiento: ConfigPreprocesamiento = field(default_factory=ConfigPreprocesamiento)
+    admin_token: Optional[str] = field(default=None, repr=False)
+
+
+def _version_esquema(etiquetas: FrozenSet[str]) -> str:
+    # Incluye las reglas de cada campo: cambiar un normalizador invalida la cache de extracción
+    campos = cargar_campos()
+    lineas = sorted(f"{etiqueta}={campos.get(etiqueta)!r}" for etiqueta in etiquetas)
+    return hashlib.sha1('\n'.join(lineas).encode('utf-8')).hexdigest()[:12]
+
+
+def cargar_configuracion() -> Configuracion:
+    """Valida el entorno y construye el esquema de etiquetas una sola vez."""
+    entorno = setup_environment()
+    etiquetas = frozenset(cargar_etiquetas())
+    return Configuracion(
+        entorno=MappingProxyType(dict(entorno)),
+        etiquetas=etiquetas,
+        version_esquema=_version_esquema(etiquetas),
+        preprocesamiento=config_desde_entorno(),
+        admin_token=os.getenv('ADMIN_TOKEN') or None
+    )
+
+
+_lock = threading.Lock()
+_actual: Optional[Configuracion] = None
+
+
+def obtener_configuracion() -> Configuracion:
+    """Retorna la configuración vigente; solo la construye si aún no existe."""
+    config = _actual
+    if config is not None:
+        return config
+    with _lock:
+        if _actual is None:
+            _establecer(cargar_configuracion())
+        return _actual
+
+
+def recargar_configuracion() -> Configuracion:
+    """
+    Relee .env y el entorno y reemplaza la configuración vigente.
+    Si la nueva configuración no es válida se conserva la anterior y se propaga el error.
+    """
+    with _lock:
+        load_dotenv(override=True)
+        anterior = _actual
+        nueva = cargar_configuracion()
+        _establecer(nueva)
+        reiniciar_planes()
+
+    # Solo si cambió el procesador se descarta el cliente anterior; si no, se sigue usando
+    if anterior is not None and clave_procesador(anterior.entorno) != clave_procesador(nueva.entorno):
+        registro_clientes.invalidar(anterior.entorno)
+    logger.info(f"Configuración recargada (esquema {nueva.version_esquema})")
+    return nueva
+
+
+def _establecer(config: Configuracion):
+    global _actual
+    _actual = config
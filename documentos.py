@@ -0,0 +1,134 @@
+import io
+import logging
+from typing import Dict, Any, List, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+logger = logging.getLogger('documentai_invoice')
+
+# Firmas (magic bytes) de los formatos que acepta Document AI
+FIRMAS_MIME = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+MIME_MULTIPAGINA = {'application/pdf', 'image/tiff'}
+
+
+def detectar_mime_type(contenido: bytes, por_defecto: str = 'image/jpeg') -> str:
+    """Detecta el tipo MIME por los primeros bytes, sin confiar en la extensión."""
+    for firma, mime_type in FIRMAS_MIME:
+        if contenido.startswith(firma):
+            return mime_type
+    if contenido[:4] == b'RIFF' and contenido[8:12] == b'WEBP':
+        return 'image/webp'
+    return por_defecto
+
+
+def dividir_documento(contenido: bytes, mime_type: str, paginas_por_lote: int = 1) -> List[Tuple[bytes, str]]:
+    """
+    Divide un PDF o TIFF multipágina en lotes de `paginas_por_lote` páginas.
+    Los demás formatos (o documentos que caben en un lote) se retornan tal cual.
+    """
+    if mime_type not in MIME_MULTIPAGINA:
+        return [(contenido, mime_type)]
+    try:
+        if mime_type == 'application/pdf':
+            return _dividir_pdf(contenido, paginas_por_lote)
+        return _dividir_tiff(contenido, paginas_por_lote)
+    except Exception as e:
+        logger.warning(f"No se pudo dividir el documento en páginas, se envía completo: {e}")
+        return [(contenido, mime_type)]
+
+
+def _dividir_pdf(contenido: bytes, paginas_por_lote: int) -> List[Tuple[bytes, str]]:
+    if PdfReader is None:
+        logger.debug("pypdf no instalado: el PDF se envía en una sola llamada")
+        return [(contenido, 'application/pdf')]
+
+    lector = PdfReader(io.BytesIO(contenido))
+    total = len(lector.pages)
+    if total <= paginas_por_lote:
+        return [(contenido, 'application/pdf')]
+
+    lotes = []
+    for inicio in range(0, total, paginas_por_lote):
+        escritor = PdfWriter()
+        for pagina in lector.pages[inicio:inicio + paginas_por_lote]:
+            escritor.add_page(pagina)
+        salida = io.BytesIO()
+        escritor.write(salida)
+        lotes.append((salida.getvalue(), 'application/pdf'))
+    return lotes
+
+
+def _dividir_tiff(contenido: bytes, paginas_por_lote: int) -> List[Tuple[bytes, str]]:
+    if Image is None:
+        return [(contenido, 'image/tiff')]
+
+    with Image.open(io.BytesIO(contenido)) as imagen:
+        total = getattr(imagen, 'n_frames', 1)
+        if total <= paginas_por_lote:
+            return [(contenido, 'image/tiff')]
+
+        paginas = []
+        for i in range(total):
+            imagen.seek(i)
+            paginas.append(imagen.copy())
+
+    lotes = []
+    for inicio in range(0, total, paginas_por_lote):
+        grupo = paginas[inicio:inicio + paginas_por_lote]
+        salida = io.BytesIO()
+        grupo[0].save(salida, format='TIFF', save_all=True, append_images=grupo[1:],
+                      compression='tiff_deflate')
+        lotes.append((salida.getvalue(), 'image/tiff'))
+    return lotes
+
+
+def combinar_resultados(resultados: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Une los resultados de process_document de cada lote, en orden de páginas:
+    - datos_generales: gana el primer lote que trae el campo con valor (la cabecera va en la página 1)
+    - productos: se concatenan en orden de páginas, así su posición sigue la del documento
+    - advertencias: se concatenan sin repetir
+    - faltantes: solo los campos que no aparecieron en ningún lote
+    """
+    if len(resultados) == 1:
+        return resultados[0]
+
+    datos: Dict[str, Any] = {}
+    productos: List[Dict[str, Any]] = []
+    advertencias: List[str] = []
+    faltantes = set(resultados[0]['faltantes'])
+
+    for resultado in resultados:
+        for clave, valor in resultado['datos_generales'].items():
+            if datos.get(clave) in (None, ''):
+                datos[clave] = valor
+        productos.extend(resultado['productos'])
+        for advertencia in resultado['advertencias']:
+            if advertencia not in advertencias:
+                advertencias.append(advertencia)
+        faltantes &= set(resultado['faltantes'])
+
+    return {
+        'datos_generales': datos,
+        'productos': productos,
+        'faltantes': sorted(faltantes),
+        'advertencias': advertencias
+    }
@@ -6,9 +6,13 @@ import json
 from fpdf import FPDF
 import os
 from datetime import datetime
+import time
 import requests
 import threading
 
+# Servidor de extracción (app.py)
+SERVIDOR = os.getenv('SERVIDOR_FACTURAS', 'http://localhost:8080')
+
 
 class FacturaGUI:
     def __init__(self, root, json_data=None):
@@ -165,19 +169,37 @@ class FacturaGUI:
         ).start()
 
     def enviar_factura_al_servidor(self, file_path):
-        """Envía la factura al endpoint /predict para procesamiento"""
+        """Envía la factura a POST /api/v1/invoices y recibe datos_bd en la misma respuesta"""
         try:
             with open(file_path, 'rb') as f:
                 files = {'file': f}
                 response = requests.post(
-                    "http://localhost:8080/predict",
-                    files=files
+                    f"{SERVIDOR}/api/v1/invoices",
+                    files=files,
+                    timeout=180
                 )
+            response.raise_for_status()
+            respuesta = response.json()
+
+            # 202: la extracción tardó más de lo que el servidor espera; consultar el
+            # trabajo (GET /jobs/<id> responde 200 también mientras sigue pendiente)
+            if response.status_code == 202:
+                trabajo = respuesta
+                while trabajo['estado'] not in ('completado', 'error'):
+                    time.sleep(1)
+                    response = requests.get(f"{SERVIDOR}/jobs/{trabajo['id']}", timeout=30)
+                    response.raise_for_status()
+                    trabajo = response.json()
+                if trabajo['estado'] == 'error':
+                    raise RuntimeError(trabajo.get('error') or 'Error en el servidor')
+                response = requests.get(f"{SERVIDOR}{trabajo['api_url']}", timeout=30)
                 response.raise_for_status()
-                new_data = response.json()
+                respuesta = response.json()
+
+            new_data = respuesta['datos_bd']
 
-                # Actualizar los datos en la GUI
-                self.root.after(0, self.actualizar_interfaz, new_data)
+            # Actualizar los datos en la GUI
+            self.root.after(0, self.actualizar_interfaz, new_data)
 
         except Exception as e:
             self.root.after(0, messagebox.showerror,
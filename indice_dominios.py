@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from heapq import nlargest
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+
+def _fichas(texto: str) -> FrozenSet[Tuple[str, int]]:
+    """
+    Multiconjunto de caracteres como conjunto de pares (caracter, n-ésima aparición):
+    el tamaño de la intersección de dos fichas es el conteo que usa quick_ratio.
+    """
+    vistos: Dict[str, int] = {}
+    fichas = []
+    for c in texto:
+        vistos[c] = vistos.get(c, 0) + 1
+        fichas.append((c, vistos[c]))
+    return frozenset(fichas)
+
+
+def _ratio(coincidencias: int, longitud: int) -> float:
+    # Misma fórmula que difflib._calculate_ratio: las cotas se comparan sin error de redondeo
+    return 2.0 * coincidencias / longitud if longitud else 1.0
+
+
+class IndiceDominios:
+    """
+    Búsqueda aproximada de dominios de correo con los mismos resultados que
+    difflib.get_close_matches(palabra, dominios, n, cutoff), pero sin recorrer
+    toda la lista con SequenceMatcher:
+    - coincidencia exacta: se retorna de inmediato
+    - cubetas por longitud: solo se consideran longitudes que pueden alcanzar `cutoff`
+    - cota por conteo de caracteres (quick_ratio) precalculada por dominio: los
+      candidatos se evalúan de mayor a menor cota y se corta al no poder mejorar
+    - memo LRU de las últimas `max_memo` consultas
+    """
+
+    def __init__(self, dominios: Iterable[str] = (), max_memo: int = 4096):
+        self.max_memo = max_memo
+        self._lock = threading.Lock()
+        self._dominios: set = set()
+        self._por_longitud: Dict[int, List[Tuple[str, FrozenSet[Tuple[str, int]]]]] = {}
+        self._memo: 'OrderedDict[Tuple[str, int, float], List[str]]' = OrderedDict()
+        self.agregar(*dominios)
+
+    def __contains__(self, dominio: str) -> bool:
+        return dominio in self._dominios
+
+    def __len__(self) -> int:
+        return len(self._dominios)
+
+    def agregar(self, *dominios: str):
+        """Incorpora dominios nuevos (p. ej. aprendidos de clientes) y vacía el memo."""
+        with self._lock:
+            for dominio in dominios:
+                if dominio in self._dominios:
+                    continue
+                self._dominios.add(dominio)
+                self._por_longitud.setdefault(len(dominio), []).append((dominio, _fichas(dominio)))
+            self._memo.clear()
+
+    def buscar(self, palabra: str, n: int = 3, cutoff: float = 0.6) -> List[str]:
+        """Equivalente a get_close_matches(palabra, dominios, n, cutoff)."""
+        clave = (palabra, n, cutoff)
+        with self._lock:
+            resultado = self._memo.get(clave)
+            if resultado is not None:
+                self._memo.move_to_end(clave)
+                return list(resultado)
+
+        resultado = self._buscar(palabra, n, cutoff)
+        with self._lock:
+            self._memo[clave] = resultado
+            if len(self._memo) > self.max_memo:
+                self._memo.popitem(last=False)
+        return list(resultado)
+
+    def _buscar(self, palabra: str, n: int, cutoff: float) -> List[str]:
+        if n <= 0:
+            raise ValueError(f"n must be > 0: {n!r}")
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError(f"cutoff must be in [0.0, 1.0]: {cutoff!r}")
+
+        # Una coincidencia exacta tiene ratio 1.0 y ningún otro dominio puede empatarla
+        if n == 1 and palabra in self._dominios:
+            return [palabra]
+
+        lb = len(palabra)
+        fichas = _fichas(palabra)
+        candidatos = []
+        for la, dominios in self._por_longitud.items():
+            # real_quick_ratio: cota que solo depende de las longitudes
+            longitud = la + lb
+            if _ratio(min(la, lb), longitud) < cutoff:
+                continue
+            for dominio, fichas_dominio in dominios:
+                cota = 2.0 * len(fichas_dominio & fichas) / longitud
+                if cota >= cutoff:
+                    candidatos.append((cota, dominio))
+
+        # De mayor a menor cota; ante igual puntaje difflib prefiere el dominio mayor
+        candidatos.sort(reverse=True)
+        s = SequenceMatcher()
+        s.set_seq2(palabra)
+        resultado = []
+        for cota, dominio in candidatos:
+            if len(resultado) == n and cota < min(resultado)[0]:
+                break
+            s.set_seq1(dominio)
+            puntaje = s.ratio()
+            if puntaje >= cutoff:
+                resultado.append((puntaje, dominio))
+                if len(resultado) > n:
+                    resultado.remove(min(resultado))
+        return [dominio for _, dominio in nlargest(n, resultado)]
@@ -0,0 +1,252 @@
+import os
+import time
+import uuid
+import logging
+from typing import Dict, Any, List, Callable, Iterator, Tuple
+
+from google.cloud import documentai_v1 as documentai
+
+from cliente_documentai import registro_clientes
+from documentos import detectar_mime_type
+
+logger = logging.getLogger('documentai_invoice')
+
+# Límite de documentos por solicitud de batch_process_documents
+MAX_DOCUMENTOS_POR_OPERACION = 1000
+
+
+def _separar_uri(uri: str) -> Tuple[str, str]:
+    """'gs://bucket/a/b' -> ('bucket', 'a/b')"""
+    if not uri.startswith('gs://'):
+        raise ValueError(f"URI de Cloud Storage no válida: {uri}")
+    bucket, _, ruta = uri[len('gs://'):].partition('/')
+    return bucket, ruta
+
+
+class AlmacenamientoGCS:
+    """Operaciones mínimas sobre Cloud Storage que necesita el modo batch."""
+
+    def __init__(self, cliente=None):
+        if cliente is None:
+            from google.cloud import storage
+            cliente = storage.Client()
+        self.cliente = cliente
+
+    def subir(self, uri: str, contenido: bytes, mime_type: str):
+        bucket, ruta = _separar_uri(uri)
+        self.cliente.bucket(bucket).blob(ruta).upload_from_string(contenido, content_type=mime_type)
+
+    def listar(self, prefijo_uri: str) -> List[str]:
+        bucket, prefijo = _separar_uri(prefijo_uri)
+        return sorted(f"gs://{bucket}/{blob.name}" for blob in self.cliente.list_blobs(bucket, prefix=prefijo))
+
+    def descargar(self, uri: str) -> bytes:
+        bucket, ruta = _separar_uri(uri)
+        return self.cliente.bucket(bucket).blob(ruta).download_as_bytes()
+
+
+class AlmacenamientoLocal:
+    """
+    Imita un bucket sobre un directorio local (gs://bucket/ruta -> <raiz>/bucket/ruta).
+    Permite ejecutar el flujo batch de extremo a extremo sin Cloud Storage.
+    """
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+
+    def _ruta(self, uri: str) -> str:
+        bucket, ruta = _separar_uri(uri)
+        return os.path.join(self.raiz, bucket, *ruta.split('/'))
+
+    def subir(self, uri: str, contenido: bytes, mime_type: str):
+        ruta = self._ruta(uri)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as f:
+            f.write(contenido)
+
+    def listar(self, prefijo_uri: str) -> List[str]:
+        bucket, prefijo = _separar_uri(prefijo_uri)
+        base = os.path.join(self.raiz, bucket)
+        uris = []
+        for directorio, _, archivos in os.walk(base):
+            for nombre in archivos:
+                relativa = os.path.relpath(os.path.join(directorio, nombre), base).replace(os.sep, '/')
+                if relativa.startswith(prefijo):
+                    uris.append(f"gs://{bucket}/{relativa}")
+        return sorted(uris)
+
+    def descargar(self, uri: str) -> bytes:
+        with open(self._ruta(uri), 'rb') as f:
+            return f.read()
+
+
+class OperacionLocal:
+    """
+    Operación de larga duración simulada: `done()` devuelve False durante `sondeos`
+    consultas y al completarse ejecuta `al_terminar()`, que escribe la salida y
+    retorna la metadata con el estado de cada documento.
+    """
+
+    def __init__(self, sondeos: int, al_terminar: Callable[[], documentai.BatchProcessMetadata]):
+        self.sondeos = sondeos
+        self.consultas = 0
+        self.metadata = None
+        self._al_terminar = al_terminar
+
+    def done(self) -> bool:
+        self.consultas += 1
+        if self.metadata is None and self.consultas > self.sondeos:
+            self.metadata = self._al_terminar()
+        return self.metadata is not None
+
+    def exception(self):
+        return None
+
+
+class ClienteBatchLocal:
+    """
+    Sustituto de DocumentProcessorServiceClient para batch_process_documents sobre un
+    AlmacenamientoLocal: lee cada entrada, la procesa con `procesar(contenido, mime_type)`
+    (p. ej. un BackendReproductor) y escribe el Document JSON donde lo dejaría Document AI.
+    Junto con AlmacenamientoLocal permite probar sondeo, timeout y recolección sin GCP.
+    """
+
+    def __init__(self, almacenamiento: AlmacenamientoLocal,
+                 procesar: Callable[[bytes, str], documentai.Document], sondeos: int = 2):
+        self.almacenamiento = almacenamiento
+        self.procesar = procesar
+        self.sondeos = sondeos
+        self.operaciones: List[OperacionLocal] = []
+
+    def processor_version_path(self, project, location, processor, processor_version) -> str:
+        return (f"projects/{project}/locations/{location}/processors/{processor}"
+                f"/processorVersions/{processor_version}")
+
+    def batch_process_documents(self, request: documentai.BatchProcessRequest) -> OperacionLocal:
+        documentos = list(request.input_documents.gcs_documents.documents)
+        destino = request.document_output_config.gcs_output_config.gcs_uri.rstrip('/')
+        n = len(self.operaciones)
+
+        def al_terminar() -> documentai.BatchProcessMetadata:
+            estados = []
+            for i, documento in enumerate(documentos):
+                salida = f"{destino}/{n}/{i}"
+                try:
+                    resultado = self.procesar(
+                        self.almacenamiento.descargar(documento.gcs_uri), documento.mime_type)
+                    self.almacenamiento.subir(f"{salida}/documento-0.json",
+                                              documentai.Document.to_json(resultado).encode('utf-8'),
+                                              'application/json')
+                    estado = {'code': 0}
+                except Exception as e:
+                    estado = {'code': 3, 'message': str(e)}
+                estados.append(documentai.BatchProcessMetadata.IndividualProcessStatus(
+                    input_gcs_source=documento.gcs_uri, status=estado, output_gcs_destination=salida))
+            return documentai.BatchProcessMetadata(individual_process_statuses=estados)
+
+        operacion = OperacionLocal(self.sondeos, al_terminar)
+        self.operaciones.append(operacion)
+        return operacion
+
+
+def procesar_con_batch(archivos: List[str], config: Dict[str, str],
+                       posprocesar: Callable[[documentai.Document], Dict[str, Any]],
+                       almacenamiento, gcs_entrada: str, gcs_salida: str,
+                       cliente=None, intervalo_sondeo: float = 10.0,
+                       timeout: float = 6 * 3600) -> Iterator[Dict[str, Any]]:
+    """
+    Procesa `archivos` con batch_process_documents de Document AI:
+    1. Sube cada archivo a `gcs_entrada/<lote>/`
+    2. Lanza una operación de larga duración por cada MAX_DOCUMENTOS_POR_OPERACION archivos
+    3. Sondea las operaciones y registra su avance
+    4. Descarga los Document JSON de `gcs_salida/<lote>/`, los pasa por `posprocesar`
+       y produce un resultado por archivo a medida que están disponibles
+    """
+    if cliente is None:
+        cliente, name = registro_clientes.obtener(config)
+    else:
+        name = cliente.processor_version_path(
+            config['project_id'], config['location'], config['processor_id'], config['processor_version_id']
+        )
+
+    lote_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    entrada = f"{gcs_entrada.rstrip('/')}/{lote_id}"
+    salida = f"{gcs_salida.rstrip('/')}/{lote_id}"
+    inicio = time.perf_counter()
+
+    logger.info(f"Subiendo {len(archivos)} archivos a {entrada}/ ...")
+    archivo_por_uri: Dict[str, str] = {}
+    documentos: List[documentai.GcsDocument] = []
+    for i, ruta in enumerate(archivos):
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        mime_type = detectar_mime_type(contenido)
+        uri = f"{entrada}/{i:06d}_{os.path.basename(ruta)}"
+        almacenamiento.subir(uri, contenido, mime_type)
+        archivo_por_uri[uri] = ruta
+        documentos.append(documentai.GcsDocument(gcs_uri=uri, mime_type=mime_type))
+
+    operaciones = []
+    for n, desde in enumerate(range(0, len(documentos), MAX_DOCUMENTOS_POR_OPERACION)):
+        request = documentai.BatchProcessRequest(
+            name=name,
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(
+                    documents=documentos[desde:desde + MAX_DOCUMENTOS_POR_OPERACION])),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                    gcs_uri=f"{salida}/{n:03d}/")))
+        operaciones.append(cliente.batch_process_documents(request=request))
+    logger.info(f"{len(operaciones)} operaciones batch lanzadas para el lote {lote_id}")
+
+    pendientes = list(operaciones)
+    entregados = set()
+    limite = time.monotonic() + timeout
+    while pendientes:
+        for operacion in [op for op in pendientes if op.done()]:
+            pendientes.remove(operacion)
+            for resultado in _resultados_operacion(operacion, archivo_por_uri, almacenamiento, posprocesar):
+                resultado['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+                entregados.add(resultado['archivo'])
+                yield resultado
+        if not pendientes:
+            break
+        if time.monotonic() > limite:
+            raise TimeoutError(f"Las operaciones batch no terminaron en {timeout:.0f} s")
+        logger.info(
+            f"Esperando {len(pendientes)} operaciones batch ({len(entregados)}/{len(archivos)} documentos listos)...")
+        time.sleep(intervalo_sondeo)
+
+    # Documentos sin estado individual (p. ej. la operación completa falló antes de empezar)
+    for ruta in archivos:
+        if ruta not in entregados:
+            yield {'archivo': ruta, 'ok': False, 'error': 'Sin resultado en la operación batch',
+                   'ms': round((time.perf_counter() - inicio) * 1000, 1)}
+
+
+def _resultados_operacion(operacion, archivo_por_uri: Dict[str, str], almacenamiento,
+                          posprocesar) -> Iterator[Dict[str, Any]]:
+    error_operacion = operacion.exception()
+    if error_operacion is not None:
+        logger.error(f"Operación batch fallida: {error_operacion}")
+
+    metadata = operacion.metadata
+    estados = metadata.individual_process_statuses if metadata is not None else []
+    for estado in estados:
+        ruta = archivo_por_uri.get(estado.input_gcs_source, estado.input_gcs_source)
+        if estado.status.code != 0:
+            yield {'archivo': ruta, 'ok': False, 'error': estado.status.message or 'Error en Document AI'}
+            continue
+        try:
+            # Un documento grande puede venir repartido en varios fragmentos JSON
+            entidades = []
+            for uri in almacenamiento.listar(estado.output_gcs_destination.rstrip('/') + '/'):
+                if uri.endswith('.json'):
+                    documento = documentai.Document.from_json(
+                        almacenamiento.descargar(uri), ignore_unknown_fields=True)
+                    entidades.extend(documento.entities)
+            datos_bd = posprocesar(documentai.Document(entities=entidades))
+            yield {'archivo': ruta, 'ok': True, 'datos_bd': datos_bd}
+        except Exception as e:
+            logger.error(f"Error leyendo la salida batch de {ruta}: {e}")
+            yield {'archivo': ruta, 'ok': False, 'error': str(e)}
@@ -0,0 +1,147 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Seccion:
+    """
+    Sección de datos_bd con un atributo por columna (`__slots__`, sin __dict__ por
+    instancia). Las columnas agregadas por configuración (CAMPOS_EXTRA) van en `extra`.
+    """
+    __slots__ = ('extra',)
+    campos: Tuple[str, ...] = ()
+
+    def __init__(self, **valores):
+        for campo in self.campos:
+            setattr(self, campo, valores.pop(campo, None))
+        self.extra: Optional[Dict[str, Any]] = valores or None
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> 'Seccion':
+        return cls(**datos)
+
+    def a_dict(self) -> Dict[str, Any]:
+        datos = {campo: getattr(self, campo) for campo in self.campos}
+        if self.extra:
+            datos.update(self.extra)
+        return datos
+
+    def __eq__(self, otro) -> bool:
+        return type(self) is type(otro) and self.a_dict() == otro.a_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.a_dict()!r})"
+
+
+class Cliente(Seccion):
+    __slots__ = campos = ('nombre', 'ruc_cedula', 'direccion', 'direccion_instalacion', 'ciudad', 'correo', 'telefono')
+
+
+class Contrato(Seccion):
+    __slots__ = campos = ('codigo', 'fecha_contrato', 'fecha_entrega', 'observacion')
+
+
+class Facturacion(Seccion):
+    __slots__ = campos = ('subtotal', 'iva', 'total', 'abono', 'saldo_pendiente')
+
+
+class Pago(Seccion):
+    __slots__ = campos = ('banco', 'numero_cheque')
+
+
+class Responsables(Seccion):
+    __slots__ = campos = ('operario', 'responsable_medicion')
+
+
+class Producto(Seccion):
+    __slots__ = campos = ('cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total')
+
+
+class Validacion:
+    __slots__ = ('advertencias', 'campos_faltantes')
+
+    def __init__(self, advertencias: List[str] = (), campos_faltantes: List[str] = ()):
+        self.advertencias = list(advertencias)
+        self.campos_faltantes = list(campos_faltantes)
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> 'Validacion':
+        return cls(datos.get('advertencias', ()), datos.get('campos_faltantes', ()))
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {'advertencias': list(self.advertencias), 'campos_faltantes': list(self.campos_faltantes)}
+
+    def __eq__(self, otro) -> bool:
+        return isinstance(otro, Validacion) and self.a_dict() == otro.a_dict()
+
+
+# Secciones de datos_bd en el orden del esquema JSON
+SECCIONES: Tuple[Tuple[str, type], ...] = (
+    ('cliente', Cliente),
+    ('contrato', Contrato),
+    ('facturacion', Facturacion),
+    ('pago', Pago),
+    ('responsables', Responsables),
+)
+_CONOCIDAS = frozenset(nombre for nombre, _ in SECCIONES) | {'productos', 'validacion'}
+
+SEPARADORES_COMPACTOS = (',', ':')
+
+
+class Factura:
+    """
+    datos_bd como objetos con __slots__: ocupa bastante menos memoria que los
+    diccionarios anidados (p. ej. en la cache de extracción). a_dict()/desde_dict()
+    son la única conversión con el esquema JSON actual.
+    """
+    __slots__ = ('cliente', 'contrato', 'facturacion', 'pago', 'responsables', 'productos', 'validacion',
+                 'extra')
+
+    def __init__(self, cliente: Cliente = None, contrato: Contrato = None, facturacion: Facturacion = None,
+                 pago: Pago = None, responsables: Responsables = None, productos: List[Producto] = (),
+                 validacion: Validacion = None, extra: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.cliente = cliente or Cliente()
+        self.contrato = contrato or Contrato()
+        self.facturacion = facturacion or Facturacion()
+        self.pago = pago or Pago()
+        self.responsables = responsables or Responsables()
+        self.productos = list(productos)
+        self.validacion = validacion or Validacion()
+        # Secciones agregadas por configuración (CAMPOS_EXTRA)
+        self.extra = extra or None
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> 'Factura':
+        secciones = {nombre: clase.desde_dict(datos.get(nombre) or {}) for nombre, clase in SECCIONES}
+        extra = {nombre: dict(valor) for nombre, valor in datos.items() if nombre not in _CONOCIDAS}
+        return cls(
+            productos=[Producto.desde_dict(p) for p in datos.get('productos') or ()],
+            validacion=Validacion.desde_dict(datos.get('validacion') or {}),
+            extra=extra,
+            **secciones)
+
+    @classmethod
+    def desde_json(cls, texto) -> 'Factura':
+        return cls.desde_dict(json.loads(texto))
+
+    def a_dict(self) -> Dict[str, Any]:
+        datos = {nombre: getattr(self, nombre).a_dict() for nombre, _ in SECCIONES}
+        if self.extra:
+            for nombre, valor in self.extra.items():
+                datos[nombre] = dict(valor)
+        datos['productos'] = [p.a_dict() for p in self.productos]
+        datos['validacion'] = self.validacion.a_dict()
+        return datos
+
+    def a_json(self, indent: Optional[int] = None) -> str:
+        """JSON compacto por defecto (encoder en C); con `indent`, legible pero varias veces más lento."""
+        return serializar(self.a_dict(), indent)
+
+    def __eq__(self, otro) -> bool:
+        return isinstance(otro, Factura) and self.a_dict() == otro.a_dict()
+
+
+def serializar(datos: Any, indent: Optional[int] = None) -> str:
+    """JSON de datos_bd (u otro resultado): compacto salvo que se pida `indent`."""
+    if indent is None:
+        return json.dumps(datos, ensure_ascii=False, separators=SEPARADORES_COMPACTOS)
+    return json.dumps(datos, ensure_ascii=False, indent=indent)
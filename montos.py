@@ -0,0 +1,91 @@
+import re
+from decimal import Decimal
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Todo lo que no sea dígito, coma o punto se descarta antes de convertir
+NO_NUMERICO = re.compile(r"[^\d,\.]")
+
+# Desde este tamaño se agrupan las entradas repetidas antes de convertirlas
+MIN_LOTE = 64
+
+
+def limpiar_monto(texto: str) -> str:
+    """'$ 1.234,50' -> '1234.50': coma como separador decimal y solo el último punto como decimal."""
+    limpio = NO_NUMERICO.sub('', texto).replace(',', '.')
+    if limpio.count('.') > 1:
+        entero, _, decimales = limpio.rpartition('.')
+        limpio = f"{entero.replace('.', '')}.{decimales}"
+    return limpio
+
+
+def _valor(texto: str) -> Optional[float]:
+    try:
+        return float(limpiar_monto(texto))
+    except ValueError:
+        return None
+
+
+def _formatear(texto: str) -> str:
+    valor = _valor(texto)
+    return texto.strip() if valor is None else f"{valor:,.2f}"
+
+
+def _decimal(texto: str) -> Optional[Decimal]:
+    valor = _valor(texto)
+    return None if valor is None else Decimal(f"{valor:.2f}")
+
+
+def _aplicar(funcion, textos: Sequence[str]) -> list:
+    """Aplica `funcion` una sola vez por texto distinto (los montos se repiten mucho en un lote)."""
+    if len(textos) < MIN_LOTE:
+        return [funcion(t) for t in textos]
+    unicos: Dict[str, object] = {}
+    for texto in textos:
+        if texto not in unicos:
+            unicos[texto] = funcion(texto)
+    return [unicos[t] for t in textos]
+
+
+def formatear_montos(textos: Sequence[str]) -> List[str]:
+    """
+    Versión por lotes de formatear_monto: '1.234,5' -> '1,234.50'.
+    Lo que no se puede interpretar como número se retorna sin espacios alrededor.
+    """
+    return _aplicar(_formatear, textos)
+
+
+def montos_decimal(textos: Sequence[str]) -> List[Optional[Decimal]]:
+    """Los mismos montos como Decimal con dos decimales (None si no es un número)."""
+    return _aplicar(_decimal, textos)
+
+
+def montos_array(textos: Sequence[str]):
+    """Los montos como arreglo float64 de NumPy, con NaN donde no hay número (requiere numpy)."""
+    if np is None:
+        raise RuntimeError("montos_array requiere numpy (pip install numpy)")
+    valores = _aplicar(_valor, textos)
+    return np.array([np.nan if v is None else v for v in valores], dtype=np.float64)
+
+
+def normalizar_columnas_montos(columnas: Mapping[str, Iterable[str]],
+                               como_decimal: bool = False) -> Dict[str, list]:
+    """
+    Normaliza varias columnas de montos (p. ej. subtotal, total_final... de miles de
+    facturas) en una sola pasada, compartiendo la conversión de los valores repetidos.
+    """
+    nombres = list(columnas)
+    listas = [list(columnas[nombre]) for nombre in nombres]
+    todos = [texto for lista in listas for texto in lista]
+    resultado = montos_decimal(todos) if como_decimal else formatear_montos(todos)
+
+    salida: Dict[str, list] = {}
+    inicio = 0
+    for nombre, lista in zip(nombres, listas):
+        salida[nombre] = resultado[inicio:inicio + len(lista)]
+        inicio += len(lista)
+    return salida
@@ -0,0 +1,138 @@
+import io
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger('documentai_invoice')
+
+# Formatos que Pillow puede normalizar; el resto (p. ej. PDF) pasa sin cambios
+MIME_IMAGEN = {'image/jpeg', 'image/png', 'image/tiff', 'image/bmp', 'image/webp', 'image/gif'}
+
+
+@dataclass(frozen=True)
+class ConfigPreprocesamiento:
+    activo: bool = True
+    max_lado: int = 2400
+    max_dpi: int = 300
+    calidad: int = 85
+
+    def firma(self) -> str:
+        """Identifica la configuración (forma parte de la clave de la cache de extracción)."""
+        if not self.activo or Image is None:
+            return 'prep:off'
+        return f"prep:{self.max_lado}:{self.max_dpi}:{self.calidad}"
+
+
+def config_desde_entorno() -> ConfigPreprocesamiento:
+    return ConfigPreprocesamiento(
+        activo=os.getenv('PREPROCESAMIENTO', '1').strip().lower() not in ('0', 'false', 'no'),
+        max_lado=int(os.getenv('PREPROC_MAX_LADO', '2400')),
+        max_dpi=int(os.getenv('PREPROC_MAX_DPI', '300')),
+        calidad=int(os.getenv('PREPROC_CALIDAD', '85')),
+    )
+
+
+class _Estadisticas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.imagenes = 0
+        self.bytes_originales = 0
+        self.bytes_finales = 0
+        self.ms_total = 0.0
+
+    def registrar(self, originales: int, finales: int, ms: float):
+        with self._lock:
+            self.imagenes += 1
+            self.bytes_originales += originales
+            self.bytes_finales += finales
+            self.ms_total += ms
+
+    def a_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'imagenes': self.imagenes,
+                'bytes_originales': self.bytes_originales,
+                'bytes_finales': self.bytes_finales,
+                'bytes_ahorrados': self.bytes_originales - self.bytes_finales,
+                'ms_medio': round(self.ms_total / self.imagenes, 1) if self.imagenes else None,
+            }
+
+
+estadisticas = _Estadisticas()
+
+
+def preprocesar_imagen(contenido: bytes, mime_type: str,
+                       config: ConfigPreprocesamiento) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Normaliza una foto o escaneo antes de enviarlo a Document AI:
+    1. Aplica la orientación EXIF (fotos de celular giradas)
+    2. Limita el lado mayor a `max_lado` px y la resolución a `max_dpi`
+    3. Re-codifica como JPEG con `calidad`, sin metadatos
+    Retorna (bytes, mime_type, info). Si no hay nada que ganar, retorna el original.
+    """
+    info = {'bytes_originales': len(contenido), 'bytes_finales': len(contenido), 'aplicado': False}
+    if not config.activo or Image is None or mime_type not in MIME_IMAGEN:
+        return contenido, mime_type, info
+
+    inicio = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(contenido)) as original:
+            if getattr(original, 'n_frames', 1) > 1:
+                # Re-codificar como JPEG perdería las páginas siguientes
+                return contenido, mime_type, info
+            dpi = original.info.get('dpi', (0, 0))[0] or 0
+            girada = original.getexif().get(0x0112, 1) != 1
+            imagen = ImageOps.exif_transpose(original) if girada else original
+            tamano_original = imagen.size
+
+            escala = 1.0
+            if max(imagen.size) > config.max_lado:
+                escala = config.max_lado / max(imagen.size)
+            if dpi > config.max_dpi:
+                escala = min(escala, config.max_dpi / dpi)
+            if escala < 1.0:
+                nuevo = (max(1, round(imagen.width * escala)), max(1, round(imagen.height * escala)))
+                imagen = imagen.resize(nuevo, Image.Resampling.LANCZOS)
+
+            if imagen.mode not in ('RGB', 'L'):
+                imagen = imagen.convert('RGB')
+
+            salida = io.BytesIO()
+            opciones = {'quality': config.calidad, 'optimize': True}
+            if dpi:
+                # El tamaño físico no cambia: la resolución baja en la misma proporción
+                opciones['dpi'] = (round(dpi * escala),) * 2
+            imagen.save(salida, format='JPEG', **opciones)
+            procesado = salida.getvalue()
+    except Exception as e:
+        logger.warning(f"No se pudo preprocesar la imagen, se envía la original: {e}")
+        return contenido, mime_type, info
+
+    # Sin giro ni reducción, solo vale la pena si la re-codificación es más liviana
+    if not girada and escala >= 1.0 and len(procesado) >= len(contenido):
+        procesado, mime_final = contenido, mime_type
+    else:
+        mime_final = 'image/jpeg'
+
+    ms = (time.perf_counter() - inicio) * 1000
+    estadisticas.registrar(len(contenido), len(procesado), ms)
+    info.update({
+        'bytes_finales': len(procesado),
+        'aplicado': procesado is not contenido,
+        'dimensiones_originales': tamano_original,
+        'dimensiones_finales': imagen.size,
+        'ms': round(ms, 1),
+    })
+    if info['aplicado']:
+        logger.info(
+            f"Imagen preprocesada: {len(contenido) / 1024:,.0f} KB -> {len(procesado) / 1024:,.0f} KB "
+            f"({tamano_original[0]}x{tamano_original[1]} -> {imagen.size[0]}x{imagen.size[1]}) en {ms:.0f} ms")
+    return procesado, mime_final, info
@@ -2,20 +2,31 @@ import sys
 import os
 import re
 import json
+import glob
+import time
 import argparse
 import logging
-from typing import Dict, Any, List, Tuple
-from difflib import get_close_matches
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Callable, Optional, FrozenSet
 from datetime import datetime
 from datetime import datetime
 from typing import Tuple
 
 # Validación de importaciones necesarias
 try:
-    from google.cloud import documentai_v1 as documentai
-    from google.api_core.client_options import ClientOptions
     from google.api_core.retry import Retry
+    from google.api_core import exceptions as gexc
     from dotenv import load_dotenv
+    from backend_documentai import obtener_backend
+    from documentos import detectar_mime_type, dividir_documento, combinar_resultados
+    from preprocesamiento import preprocesar_imagen, config_desde_entorno
+    from lote_documentai import procesar_con_batch, AlmacenamientoGCS
+    from indice_dominios import IndiceDominios
+    from montos import formatear_montos
+    from modelo_factura import Producto
 except ImportError as e:
     print(
         f"Error de importación: {e}. Asegúrate de haber instalado todas las dependencias necesarias.")
@@ -59,6 +70,33 @@ DOMINIOS_VALIDOS = {
 }
 
 
+def cargar_dominios() -> set:
+    """DOMINIOS_VALIDOS más los del archivo DOMINIOS_CORREO_EXTRA (uno por línea), si existe."""
+    dominios = set(DOMINIOS_VALIDOS)
+    ruta = os.getenv('DOMINIOS_CORREO_EXTRA')
+    if ruta and os.path.isfile(ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            dominios.update(linea.strip().lower() for linea in f if linea.strip())
+    return dominios
+
+
+# Índice para corregir dominios por similitud (mismos resultados que get_close_matches)
+INDICE_DOMINIOS = IndiceDominios(cargar_dominios())
+
+# Páginas por llamada a Document AI y llamadas simultáneas para PDF/TIFF multipágina
+PAGINAS_POR_LOTE = int(os.getenv('PAGINAS_POR_LOTE', '1'))
+PAGINAS_EN_PARALELO = int(os.getenv('PAGINAS_EN_PARALELO', '4'))
+
+# Tope de llamadas a Document AI en curso en todo el proceso. Sin él, los documentos
+# multipágina multiplicarían el límite de la cola (MAX_TRABAJOS_CONCURRENTES × PAGINAS_EN_PARALELO)
+LLAMADAS_DOCUMENTAI_MAX = int(os.getenv('LLAMADAS_DOCUMENTAI_MAX', '8'))
+_llamadas_documentai = threading.BoundedSemaphore(LLAMADAS_DOCUMENTAI_MAX)
+
+# Incrementar cuando cambie la salida de los validadores o de preparar_datos_para_bd
+# (forma parte de la clave de la cache de extracción)
+VERSION_VALIDADORES = '2'
+
+
 def setup_environment() -> Dict[str, str]:
     logger.info("Validando configuración del entorno...")
 
@@ -67,7 +105,9 @@ def setup_environment() -> Dict[str, str]:
     )
 
     creds = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-    if not creds or not os.path.isfile(creds):
+    # Reproduciendo respuestas grabadas no se llama a Google: las credenciales no hacen falta
+    sin_red = os.getenv('DOCUMENTAI_BACKEND', '').strip().lower() == 'reproducir'
+    if not sin_red and (not creds or not os.path.isfile(creds)):
         logger.error(f"Archivo de credenciales no encontrado: {creds}")
         raise EnvironmentError("GOOGLE_APPLICATION_CREDENTIALS no válido.")
 
@@ -86,15 +126,8 @@ def setup_environment() -> Dict[str, str]:
 
 
 def cargar_etiquetas() -> set:
-    etiquetas = {
-        'Nombrecliente', 'Ruc', 'Direccion_factura', 'direccioninstalacion', 'Ciudad', 'Correo', 'Telefono',
-        'Fecha_contrato', 'Fecha_entrega', 'codigocontrato', 'observacion', 'Operario', 'Resp_Medicion',
-        'subtotal', 'total_impuestos', 'total_final', 'abono', 'saldo_pendiente', 'Banco', 'Numerocheque'
-    }
-    for i in range(1, 21):
-        for campo in ('cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total'):
-            etiquetas.add(f'producto{i}_{campo}')
-    return etiquetas
+    """Campos generales del esquema; los productoN_* se reconocen por PATRON_PRODUCTO, sin límite de N."""
+    return set(cargar_campos())
 
 
 def validar_telefono_ecuador(texto: str) -> Tuple[str, bool]:
@@ -178,8 +211,7 @@ def normalizar_correo(texto: str) -> Tuple[str, bool]:
         local_part = ''.join(tokens[:-1])
 
     # 5. Corregir dominio por similitud contra DOMINIOS_VALIDOS
-    posibles = get_close_matches(
-        domain_candidate, DOMINIOS_VALIDOS, n=1, cutoff=0.6)
+    posibles = INDICE_DOMINIOS.buscar(domain_candidate, n=1, cutoff=0.6)
     if not posibles:
         return INVALID_EMAIL_MESSAGE, False
     domain = posibles[0]
@@ -193,55 +225,69 @@ def normalizar_correo(texto: str) -> Tuple[str, bool]:
 
 
 def formatear_monto(texto: str) -> str:
+    """'$ 1.234,5' -> '1,234.50'. Para columnas enteras usar montos.formatear_montos."""
+    return formatear_montos((texto,))[0]
+
+
+# 1. Formato especial tipo OCR: '12 dia/08 mes 2024. año'
+PATRON_FECHA_ESPECIAL = re.compile(
+    r'(\d{1,2})\s*(?:dia)?[^\d]*(\d{1,2})\s*(?:mes)?[^\d]*(\d{4})(?:\s*año)?', re.IGNORECASE)
+
+# 2. Formatos comunes '%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y' en una sola expresión,
+# con los mismos patrones que usa datetime.strptime para %d, %m, %Y y %y
+_DIA = r'(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])'
+_MES = r'(1[0-2]|0[1-9]|[1-9])'
+PATRON_FECHA_COMUN = re.compile(
+    rf'{_DIA}/{_MES}/(\d\d\d\d)'
+    rf'|{_DIA}-{_MES}-(\d\d\d\d)'
+    rf'|(\d\d\d\d)-{_MES}-{_DIA}'
+    rf'|{_DIA}/{_MES}/(\d\d)', re.IGNORECASE)
+
+SOLO_DIGITOS_Y_BARRAS = re.compile(r'[^\d/]')
+
+
+def _fecha_comun(texto: str) -> Optional[str]:
+    """Fecha dd/mm/yyyy si `texto` completo tiene uno de los formatos comunes, o None."""
+    match = PATRON_FECHA_COMUN.fullmatch(texto)
+    if not match:
+        return None
+    g = match.groups()
+    if g[0]:
+        dia, mes, anio = g[0], g[1], int(g[2])
+    elif g[3]:
+        dia, mes, anio = g[3], g[4], int(g[5])
+    elif g[6]:
+        anio, mes, dia = int(g[6]), g[7], g[8]
+    else:
+        # Igual que strptime: %y de 69 a 99 es 19xx, de 00 a 68 es 20xx
+        dia, mes, anio = g[9], g[10], int(g[11])
+        anio += 2000 if anio <= 68 else 1900
     try:
-        # Manejar diferentes formatos numéricos
-        texto_limpio = re.sub(r"[^\d,\.]", "", texto)
-        texto_limpio = texto_limpio.replace(",", ".")
-
-        # Manejar casos con múltiples puntos
-        if texto_limpio.count(".") > 1:
-            partes = texto_limpio.split(".")
-            texto_limpio = f"{''.join(partes[:-1])}.{partes[-1]}"
-
-        val = float(texto_limpio)
-        return f"{val:,.2f}"
+        return datetime(anio, int(mes), int(dia)).strftime('%d/%m/%Y')
     except ValueError:
-        return texto.strip()
+        return None
 
 
+@lru_cache(maxsize=4096)
 def validar_fecha(texto: str) -> Tuple[str, bool]:
     """
     Valida y formatea fechas en formato dd/mm/yyyy.
     Soporta entradas especiales como '12 dia/08 mes 2024. año' o similares.
+    Las expresiones están precompiladas y los resultados se memorizan (el OCR repite fechas).
     """
     try:
-        # 1. Formato especial tipo OCR: '12 dia/08 mes 2024. año'
-        patron_especial = r'(\d{1,2})\s*(?:dia)?[^\d]*(\d{1,2})\s*(?:mes)?[^\d]*(\d{4})(?:\s*año)?'
-        match = re.search(patron_especial, texto, re.IGNORECASE)
+        match = PATRON_FECHA_ESPECIAL.search(texto)
         if match:
             dia, mes, anio = match.groups()
             fecha = datetime(int(anio), int(mes), int(dia))
             return fecha.strftime('%d/%m/%Y'), True
 
-        # 2. Formatos comunes
-        formatos_comunes = ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']
-        texto_limpio = texto.strip()
-
-        for fmt in formatos_comunes:
-            try:
-                fecha = datetime.strptime(texto_limpio, fmt)
-                return fecha.strftime('%d/%m/%Y'), True
-            except ValueError:
-                continue
-
-        # 3. Extrae solo números y barras (para OCR con mucho ruido)
-        solo_numeros = re.sub(r'[^\d/]', '', texto)
-        for fmt in formatos_comunes:
-            try:
-                fecha = datetime.strptime(solo_numeros, fmt)
-                return fecha.strftime('%d/%m/%Y'), True
-            except ValueError:
-                continue
+        fecha = _fecha_comun(texto.strip())
+        if fecha is None:
+            # 3. Extrae solo números y barras (para OCR con mucho ruido)
+            fecha = _fecha_comun(SOLO_DIGITOS_Y_BARRAS.sub('', texto))
+        if fecha is not None:
+            return fecha, True
 
         return texto.strip(), False
 
@@ -250,94 +296,267 @@ def validar_fecha(texto: str) -> Tuple[str, bool]:
         return texto.strip(), False
 
 
+def normalizar_texto(texto: str) -> Tuple[str, bool]:
+    return texto.strip(), True
+
+
+def normalizar_monto(texto: str) -> Tuple[str, bool]:
+    return formatear_monto(texto), True
+
+
+# Normalizadores disponibles para el plan: texto -> (valor, es_valido)
+NORMALIZADORES: Dict[str, Callable[[str], Tuple[str, bool]]] = {
+    'texto': normalizar_texto,
+    'telefono': validar_telefono_ecuador,
+    'cedula_ruc': validar_cedula_ruc,
+    'correo': normalizar_correo,
+    'monto': normalizar_monto,
+    'fecha': validar_fecha,
+}
+
+
+@dataclass(frozen=True)
+class ReglaCampo:
+    """
+    Cómo se normaliza un campo y dónde termina en datos_bd.
+    `advertencia` es una plantilla con {valor} (normalizado) y {texto} (original).
+    """
+    normalizador: str = 'texto'
+    advertencia: Optional[str] = None
+    seccion: Optional[str] = None
+    columna: Optional[str] = None
+
+
+# Esquema de campos generales, en el orden en que aparecen en datos_bd
+CAMPOS: Dict[str, ReglaCampo] = {
+    'Nombrecliente': ReglaCampo(seccion='cliente', columna='nombre'),
+    'Ruc': ReglaCampo('cedula_ruc', "Identificación '{valor}' no es cédula (10 dígitos) ni RUC (13 dígitos) válido",
+                      'cliente', 'ruc_cedula'),
+    'Direccion_factura': ReglaCampo(seccion='cliente', columna='direccion'),
+    'direccioninstalacion': ReglaCampo(seccion='cliente', columna='direccion_instalacion'),
+    'Ciudad': ReglaCampo(seccion='cliente', columna='ciudad'),
+    'Correo': ReglaCampo('correo', "Correo '{valor}' podría ser inválido o dominio no reconocido",
+                         'cliente', 'correo'),
+    'Telefono': ReglaCampo('telefono', "Teléfono '{valor}' no tiene formato ecuatoriano válido (09XXXXXXXX)",
+                           'cliente', 'telefono'),
+    'codigocontrato': ReglaCampo(seccion='contrato', columna='codigo'),
+    'Fecha_contrato': ReglaCampo('fecha', "Fecha '{texto}' tiene un formato inválido, se esperaba dd/mm/yyyy",
+                                 'contrato', 'fecha_contrato'),
+    'Fecha_entrega': ReglaCampo('fecha', "Fecha '{texto}' tiene un formato inválido, se esperaba dd/mm/yyyy",
+                                'contrato', 'fecha_entrega'),
+    'observacion': ReglaCampo(seccion='contrato', columna='observacion'),
+    'subtotal': ReglaCampo('monto', seccion='facturacion', columna='subtotal'),
+    'total_impuestos': ReglaCampo('monto', seccion='facturacion', columna='iva'),
+    'total_final': ReglaCampo('monto', seccion='facturacion', columna='total'),
+    'abono': ReglaCampo('monto', seccion='facturacion', columna='abono'),
+    'saldo_pendiente': ReglaCampo('monto', seccion='facturacion', columna='saldo_pendiente'),
+    'Banco': ReglaCampo(seccion='pago', columna='banco'),
+    'Numerocheque': ReglaCampo(seccion='pago', columna='numero_cheque'),
+    'Operario': ReglaCampo(seccion='responsables', columna='operario'),
+    'Resp_Medicion': ReglaCampo(seccion='responsables', columna='responsable_medicion'),
+}
+
+# Campos de cada línea de producto, en el orden en que aparecen en datos_bd
+CAMPOS_PRODUCTO = Producto.campos
+
+# 'producto12_valor_total' -> (12, 'valor_total')
+PATRON_PRODUCTO = re.compile(rf"producto([1-9]\d*)_({'|'.join(CAMPOS_PRODUCTO)})")
+
+
+def cargar_campos() -> Dict[str, ReglaCampo]:
+    """
+    CAMPOS más los campos definidos en el JSON de CAMPOS_EXTRA (si existe), p. ej.:
+    {"vendedor": {"seccion": "responsables", "columna": "vendedor"},
+     "fecha_pago": {"normalizador": "fecha", "advertencia": "Fecha '{texto}' inválida",
+                    "seccion": "pago", "columna": "fecha"}}
+    """
+    campos = dict(CAMPOS)
+    ruta = os.getenv('CAMPOS_EXTRA')
+    if not ruta:
+        return campos
+    with open(ruta, 'r', encoding='utf-8') as f:
+        extra = json.load(f)
+    for campo, definicion in extra.items():
+        regla = ReglaCampo(**definicion)
+        if regla.normalizador not in NORMALIZADORES:
+            raise ValueError(f"Normalizador desconocido para {campo}: {regla.normalizador}")
+        if (regla.seccion is None) != (regla.columna is None):
+            raise ValueError(f"El campo {campo} debe indicar sección y columna juntas")
+        campos[campo] = regla
+    return campos
+
+
+class PlanNormalizacion:
+    """
+    Plan precompilado a partir del esquema de etiquetas: por cada etiqueta, su
+    normalizador y plantilla de advertencia, de modo que cada entidad se resuelve
+    con una sola búsqueda en un diccionario.
+    """
+
+    def __init__(self, etiquetas: FrozenSet[str], campos: Dict[str, ReglaCampo]):
+        self.reglas: Dict[str, Tuple[Callable[[str], Tuple[str, bool]], Optional[str]]] = {}
+        for etiqueta in etiquetas:
+            if PATRON_PRODUCTO.fullmatch(etiqueta):
+                continue
+            regla = campos.get(etiqueta, ReglaCampo())
+            self.reglas[etiqueta] = (NORMALIZADORES[regla.normalizador], regla.advertencia)
+
+        # Etiquetas que se reportan como faltantes (los productos son opcionales)
+        self.generales = frozenset(self.reglas)
+
+        # Clave productoN_campo ya vista -> (N, campo, normalizador); None si no es de producto
+        self._productos: Dict[str, Optional[Tuple[int, str, Callable[[str], Tuple[str, bool]]]]] = {}
+
+    def producto(self, clave: str) -> Optional[Tuple[int, str, Callable[[str], Tuple[str, bool]]]]:
+        """(índice, campo, normalizador) si `clave` es un campo de producto, si no None."""
+        try:
+            return self._productos[clave]
+        except KeyError:
+            pass
+        match = PATRON_PRODUCTO.fullmatch(clave)
+        resultado = None
+        if match:
+            campo = match.group(2)
+            normalizador = NORMALIZADORES['monto' if campo.startswith('valor_') else 'texto']
+            resultado = (int(match.group(1)), campo, normalizador)
+        self._productos[clave] = resultado
+        return resultado
+
+
+def secciones_bd(campos: Dict[str, ReglaCampo]) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """[(sección, [(columna, campo), ...]), ...] en el orden de `campos`."""
+    secciones: Dict[str, List[Tuple[str, str]]] = {}
+    for campo, regla in campos.items():
+        if regla.seccion:
+            secciones.setdefault(regla.seccion, []).append((regla.columna, campo))
+    return list(secciones.items())
+
+
+_planes: Dict[FrozenSet[str], PlanNormalizacion] = {}
+_secciones: Optional[List[Tuple[str, List[Tuple[str, str]]]]] = None
+
+
+def obtener_plan(etiquetas_validas) -> PlanNormalizacion:
+    """Plan para el esquema dado; se construye una vez por esquema."""
+    clave = etiquetas_validas if isinstance(etiquetas_validas, frozenset) else frozenset(etiquetas_validas)
+    plan = _planes.get(clave)
+    if plan is None:
+        plan = _planes[clave] = PlanNormalizacion(clave, cargar_campos())
+    return plan
+
+
+def obtener_secciones_bd() -> List[Tuple[str, List[Tuple[str, str]]]]:
+    global _secciones
+    if _secciones is None:
+        _secciones = secciones_bd(cargar_campos())
+    return _secciones
+
+
+def reiniciar_planes():
+    """Descarta los planes y secciones compilados (p. ej. tras recargar la configuración)."""
+    global _secciones
+    _planes.clear()
+    _secciones = None
+
+
 def process_document(file_path: str, config: Dict[str, str], etiquetas_validas: set) -> Dict[str, Any]:
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"El archivo {file_path} no existe.")
 
-    logger.info("Inicializando cliente de Document AI...")
-    try:
-        opts = ClientOptions(
-            api_endpoint=f"{config['location']}-documentai.googleapis.com")
-        client = documentai.DocumentProcessorServiceClient(client_options=opts)
-        name = client.processor_version_path(
-            config['project_id'], config['location'], config['processor_id'], config['processor_version_id']
-        )
-    except Exception as e:
-        logger.exception("Error al crear cliente de Document AI")
-        raise e
+    with open(file_path, 'rb') as f:
+        contenido = f.read()
+    # Mismo preprocesamiento que el servidor (PREPROCESAMIENTO y PREPROC_*)
+    return procesar_documento(contenido, config, etiquetas_validas, preprocesamiento=config_desde_entorno())
+
 
+def procesar_documento(contenido: bytes, config: Dict[str, str], etiquetas_validas: set,
+                       mime_type: str = None, preprocesamiento=None,
+                       progreso: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Procesa una imagen, PDF o TIFF:
+    1. Detecta el tipo MIME por los magic bytes (si no se indica)
+    2. Divide los documentos multipágina en lotes de PAGINAS_POR_LOTE páginas
+    3. Preprocesa cada lote (si se indica configuración) y los extrae en paralelo
+    4. Une los resultados en uno solo, en orden de páginas
+    `progreso(etapa)` recibe 'preprocesado', 'enviado_documentai' y 'postprocesamiento'
+    (con varios lotes, una vez por lote).
+    """
+    mime_type = mime_type or detectar_mime_type(contenido)
+    lotes = dividir_documento(contenido, mime_type, PAGINAS_POR_LOTE)
+
+    def procesar_lote(lote: Tuple[bytes, str]) -> Dict[str, Any]:
+        datos, mime = lote
+        if preprocesamiento is not None:
+            datos, mime, _ = preprocesar_imagen(datos, mime, preprocesamiento)
+        if progreso is not None:
+            progreso('preprocesado')
+        return process_document_bytes(datos, config, etiquetas_validas, mime_type=mime, progreso=progreso)
+
+    if len(lotes) == 1:
+        return procesar_lote(lotes[0])
+
+    logger.info(f"Documento de {len(lotes)} lotes de páginas; extrayendo en paralelo...")
+    with ThreadPoolExecutor(max_workers=min(len(lotes), PAGINAS_EN_PARALELO)) as pool:
+        resultados = list(pool.map(procesar_lote, lotes))
+    return combinar_resultados(resultados)
+
+
+def process_document_bytes(contenido: bytes, config: Dict[str, str], etiquetas_validas: set,
+                           mime_type: str = "image/jpeg",
+                           progreso: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Igual que process_document pero sobre los bytes ya leídos (p. ej. directamente de la subida)."""
     logger.info("Procesando documento...")
+    if progreso is not None:
+        progreso('enviado_documentai')
     try:
-        with open(file_path, 'rb') as f:
-            raw = documentai.RawDocument(
-                content=f.read(), mime_type="image/jpeg")
-        request = documentai.ProcessRequest(name=name, raw_document=raw)
-        result = client.process_document(request=request, timeout=120.0)
+        with _llamadas_documentai:
+            documento = obtener_backend().procesar(contenido, mime_type, config)
     except Exception as e:
         logger.exception("Error durante el procesamiento del documento")
         raise e
 
+    if progreso is not None:
+        progreso('postprocesamiento')
+    return procesar_entidades(documento.entities, etiquetas_validas)
+
+
+def procesar_entidades(entidades, etiquetas_validas: set) -> Dict[str, Any]:
+    """Valida y normaliza las entidades de Document AI y agrupa los productos."""
     datos: Dict[str, Any] = {}
     advertencias: List[str] = []
 
-    for ent in result.document.entities:
-        key = ent.type_
+    plan = obtener_plan(etiquetas_validas)
+    items: Dict[int, Dict[str, Any]] = {}
+
+    for ent in entidades:
+        regla = plan.reglas.get(ent.type_)
+        producto = None
+        if regla is None:
+            producto = plan.producto(ent.type_)
+            if producto is None:
+                continue
         text = ent.mention_text or ''
+        if not text.strip():
+            continue
 
-        if key in etiquetas_validas and text.strip():
-            if key == 'Telefono':
-                valor, valido = validar_telefono_ecuador(text)
-                datos[key] = valor
-                if not valido:
-                    advertencias.append(
-                        f"Teléfono '{valor}' no tiene formato ecuatoriano válido (09XXXXXXXX)")
-
-            elif key == 'Ruc':
-                valor, valido = validar_cedula_ruc(text)
-                datos[key] = valor
-                if not valido:
-                    advertencias.append(
-                        f"Identificación '{valor}' no es cédula (10 dígitos) ni RUC (13 dígitos) válido")
-
-            elif key == 'Correo':
-                valor, valido = normalizar_correo(text)
-                datos[key] = valor
-                if not valido:
-                    advertencias.append(
-                        f"Correo '{valor}' podría ser inválido o dominio no reconocido")
-
-            elif key in {'subtotal', 'total_impuestos', 'total_final', 'abono', 'saldo_pendiente'} or \
-                    (key.startswith('producto') and key.endswith(('valor_total', 'valor_unitario'))):
-                datos[key] = formatear_monto(text)
-
-            elif key in {'Fecha_contrato', 'Fecha_entrega'}:
-                datos[key], valido = validar_fecha(text)
-                if not valido:
-                    advertencias.append(
-                        f"Fecha '{text}' tiene un formato inválido, se esperaba dd/mm/yyyy")
-
-            else:
-                datos[key] = text.strip()
-
-    productos: List[Dict[str, Any]] = []
-    for i in range(1, 21):
-        campos = {
-            'cantidad': datos.get(f'producto{i}_cantidad'),
-            'codigo': datos.get(f'producto{i}_codigo'),
-            'detalle': datos.get(f'producto{i}_detalle'),
-            'valor_unitario': datos.get(f'producto{i}_valor_unitario'),
-            'valor_total': datos.get(f'producto{i}_valor_total'),
-        }
-        if any(campos.values()):
-            productos.append(campos)
-            for k in campos:
-                datos.pop(f'producto{i}_{k}', None)
-
-    faltantes = sorted(
-        etiquetas_validas - set(datos.keys()) -
-        {f'producto{i}_{c}' for i in range(1, 21) for c in [
-            'cantidad', 'codigo', 'detalle', 'valor_unitario', 'valor_total']}
-    )
+        if producto is not None:
+            # Línea de producto: se agrupa directamente por su índice, sin tope de filas
+            indice, campo, normalizador = producto
+            item = items.get(indice)
+            if item is None:
+                item = items[indice] = dict.fromkeys(CAMPOS_PRODUCTO)
+            item[campo] = normalizador(text)[0]
+            continue
+
+        normalizador, advertencia = regla
+        valor, valido = normalizador(text)
+        datos[ent.type_] = valor
+        if not valido and advertencia:
+            advertencias.append(advertencia.format(valor=valor, texto=text))
+
+    productos = [items[i] for i in sorted(items)]
+
+    faltantes = sorted(plan.generales - datos.keys())
 
     return {
         'datos_generales': datos,
@@ -425,49 +644,15 @@ def probar_correo():
 
 def preparar_datos_para_bd(resultado: Dict[str, Any]) -> Dict[str, Any]:
     """Prepara los datos extraídos en formato adecuado para BD."""
-    datos_bd = {
-        # Datos del cliente
-        'cliente': {
-            'nombre': resultado['datos_generales'].get('Nombrecliente'),
-            'ruc_cedula': resultado['datos_generales'].get('Ruc'),
-            'direccion': resultado['datos_generales'].get('Direccion_factura'),
-            'direccion_instalacion': resultado['datos_generales'].get('direccioninstalacion'),
-            'ciudad': resultado['datos_generales'].get('Ciudad'),
-            'correo': resultado['datos_generales'].get('Correo'),
-            'telefono': resultado['datos_generales'].get('Telefono')
-        },
-        # Datos del contrato
-        'contrato': {
-            'codigo': resultado['datos_generales'].get('codigocontrato'),
-            'fecha_contrato': resultado['datos_generales'].get('Fecha_contrato'),
-            'fecha_entrega': resultado['datos_generales'].get('Fecha_entrega'),
-            'observacion': resultado['datos_generales'].get('observacion')
-        },
-        # Datos de facturación
-        'facturacion': {
-            'subtotal': resultado['datos_generales'].get('subtotal'),
-            'iva': resultado['datos_generales'].get('total_impuestos'),
-            'total': resultado['datos_generales'].get('total_final'),
-            'abono': resultado['datos_generales'].get('abono'),
-            'saldo_pendiente': resultado['datos_generales'].get('saldo_pendiente')
-        },
-        # Datos de pago
-        'pago': {
-            'banco': resultado['datos_generales'].get('Banco'),
-            'numero_cheque': resultado['datos_generales'].get('Numerocheque')
-        },
-        # Datos de responsables
-        'responsables': {
-            'operario': resultado['datos_generales'].get('Operario'),
-            'responsable_medicion': resultado['datos_generales'].get('Resp_Medicion')
-        },
-        # Lista de productos
-        'productos': resultado['productos'],
-        # Validaciones y advertencias
-        'validacion': {
-            'advertencias': resultado['advertencias'],
-            'campos_faltantes': resultado['faltantes']
-        }
+    generales = resultado['datos_generales']
+    datos_bd: Dict[str, Any] = {
+        seccion: {columna: generales.get(campo) for columna, campo in columnas}
+        for seccion, columnas in obtener_secciones_bd()
+    }
+    datos_bd['productos'] = resultado['productos']
+    datos_bd['validacion'] = {
+        'advertencias': resultado['advertencias'],
+        'campos_faltantes': resultado['faltantes']
     }
 
     return datos_bd
@@ -530,6 +715,191 @@ def guardar_datos_json(datos: Dict[str, Any], nombre_archivo: str):
         logger.error(f"Error al guardar datos en JSON: {e}")
 
 
+EXTENSIONES_VALIDAS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.pdf')
+
+
+class LimitadorTasa:
+    """Espacia las llamadas para no superar `por_segundo` facturas por segundo entre todos los hilos."""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._lock = threading.Lock()
+        self._siguiente = time.monotonic()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+def expandir_rutas(rutas: List[str], recursivo: bool = False) -> List[str]:
+    """Convierte directorios, archivos y patrones glob en la lista ordenada de facturas a procesar."""
+    archivos = set()
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            patron = os.path.join(ruta, '**', '*') if recursivo else os.path.join(ruta, '*')
+            candidatos = glob.glob(patron, recursive=recursivo)
+        else:
+            candidatos = glob.glob(ruta, recursive=recursivo) or [ruta]
+        archivos.update(
+            c for c in candidatos if c.lower().endswith(EXTENSIONES_VALIDAS) and os.path.isfile(c))
+    return sorted(archivos)
+
+
+def procesar_lote(archivos: List[str], config: Dict[str, str], etiquetas: set, salida,
+                  concurrencia: int = 4, por_segundo: float = 0) -> Dict[str, Any]:
+    """
+    Procesa `archivos` con un pool de `concurrencia` hilos que comparten el cliente de Document AI.
+    Escribe una línea NDJSON por factura en `salida` a medida que terminan y retorna el resumen.
+    """
+    limitador = LimitadorTasa(por_segundo)
+
+    def procesar(ruta: str) -> Dict[str, Any]:
+        limitador.esperar()
+        inicio = time.perf_counter()
+        try:
+            datos_bd = preparar_datos_para_bd(process_document(ruta, config, etiquetas))
+            linea = {'archivo': ruta, 'ok': True, 'datos_bd': datos_bd}
+        except Exception as e:
+            logger.error(f"Error procesando {ruta}: {e}")
+            linea = {'archivo': ruta, 'ok': False, 'error': str(e)}
+        linea['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        return linea
+
+    def resultados():
+        with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as pool:
+            for futuro in as_completed([pool.submit(procesar, ruta) for ruta in archivos]):
+                yield futuro.result()
+
+    return escribir_resultados(resultados(), salida)
+
+
+def procesar_lote_batch(archivos: List[str], config: Dict[str, str], etiquetas: set, salida,
+                        gcs_entrada: str, gcs_salida: str, almacenamiento=None) -> Dict[str, Any]:
+    """
+    Igual que procesar_lote pero mediante batch_process_documents de Document AI
+    (pensado para miles de contratos archivados). Los Document de salida pasan por
+    el mismo procesar_entidades y preparar_datos_para_bd que el modo en línea.
+    """
+    def posprocesar(documento) -> Dict[str, Any]:
+        return preparar_datos_para_bd(procesar_entidades(documento.entities, etiquetas))
+
+    return escribir_resultados(
+        procesar_con_batch(archivos, config, posprocesar, almacenamiento or AlmacenamientoGCS(),
+                           gcs_entrada, gcs_salida),
+        salida)
+
+
+def escribir_resultados(resultados, salida) -> Dict[str, Any]:
+    """Escribe cada resultado como una línea NDJSON a medida que llega y retorna el resumen del lote."""
+    latencias: List[float] = []
+    errores = 0
+    inicio = time.perf_counter()
+    for linea in resultados:
+        salida.write(json.dumps(linea, ensure_ascii=False) + '\n')
+        salida.flush()
+        latencias.append(linea['ms'])
+        if not linea['ok']:
+            errores += 1
+    duracion = time.perf_counter() - inicio
+    total = len(latencias)
+
+    latencias.sort()
+
+    def percentil(p: float) -> float:
+        return latencias[min(total - 1, int(total * p))] if latencias else 0.0
+
+    return {
+        'facturas': total,
+        'correctas': total - errores,
+        'errores': errores,
+        'segundos': round(duracion, 2),
+        'facturas_por_segundo': round(total / duracion, 2) if duracion else 0.0,
+        'latencia_p50_ms': percentil(0.50),
+        'latencia_p95_ms': percentil(0.95),
+        'latencia_max_ms': latencias[-1] if latencias else 0.0,
+    }
+
+
+def main_lote(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='test_documentai.py lote',
+        description='Procesa en paralelo todas las facturas de directorios o patrones glob.')
+    parser.add_argument(
+        'rutas', nargs='+', help='Directorios, archivos o patrones glob (p. ej. "escaneos/**/*.pdf")')
+    parser.add_argument('--recursivo', '-r', action='store_true',
+                        help='Recorrer subdirectorios')
+    parser.add_argument('--concurrencia', '-c', type=int, default=4,
+                        help='Facturas procesándose a la vez (por defecto 4)')
+    parser.add_argument('--tasa', '-t', type=float, default=0,
+                        help='Máximo de facturas por segundo (0 = sin límite)')
+    parser.add_argument('--output', '-o',
+                        help='Archivo NDJSON de salida ("-" para la salida estándar)')
+    parser.add_argument('--gcs-entrada',
+                        help='Usar batch_process_documents: prefijo gs:// donde subir las facturas')
+    parser.add_argument('--gcs-salida',
+                        help='Prefijo gs:// donde Document AI deja los resultados del modo batch')
+    args = parser.parse_args(argv)
+
+    if bool(args.gcs_entrada) != bool(args.gcs_salida):
+        parser.error('--gcs-entrada y --gcs-salida deben indicarse juntos')
+
+    archivos = expandir_rutas(args.rutas, args.recursivo)
+    if not archivos:
+        logger.error("No se encontraron facturas en las rutas indicadas")
+        sys.exit(1)
+
+    if args.output == '-':
+        # La salida estándar queda reservada para el NDJSON
+        handler.setStream(sys.stderr)
+        salida = sys.stdout
+    else:
+        nombre = args.output or f"lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+        salida = open(nombre, 'w', encoding='utf-8')
+        logger.info(f"Se guardarán los resultados en: {nombre}")
+
+    try:
+        config = setup_environment()
+        etiquetas = cargar_etiquetas()
+        if args.gcs_entrada:
+            logger.info(f"Procesando {len(archivos)} facturas con batch_process_documents...")
+            resumen = procesar_lote_batch(archivos, config, etiquetas, salida,
+                                          args.gcs_entrada, args.gcs_salida)
+        else:
+            logger.info(f"Procesando {len(archivos)} facturas con concurrencia {args.concurrencia}...")
+            resumen = procesar_lote(archivos, config, etiquetas, salida,
+                                    concurrencia=args.concurrencia, por_segundo=args.tasa)
+    except TimeoutError as e:
+        # TimeoutError es un EnvironmentError: debe capturarse antes
+        logger.error(f"El lote batch no terminó a tiempo: {e}. Los resultados recibidos ya están en la "
+                     f"salida; las operaciones pendientes siguen ejecutándose en Document AI")
+        sys.exit(1)
+    except gexc.GoogleAPIError as e:
+        logger.error(f"Error de la API de Google Cloud: {e}")
+        sys.exit(1)
+    except EnvironmentError as e:
+        logger.error(f"Error de configuración: {e}")
+        sys.exit(1)
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+
+    logger.info('\n===== RESUMEN DEL LOTE =====')
+    logger.info(
+        f"Facturas: {resumen['facturas']}    Correctas: {resumen['correctas']}    Errores: {resumen['errores']}")
+    logger.info(
+        f"Tiempo total: {resumen['segundos']} s    Rendimiento: {resumen['facturas_por_segundo']} facturas/s")
+    logger.info(
+        f"Latencia p50: {resumen['latencia_p50_ms']} ms    p95: {resumen['latencia_p95_ms']} ms    "
+        f"máx: {resumen['latencia_max_ms']} ms")
+    sys.exit(1 if resumen['errores'] else 0)
+
+
 def test_validar_fecha():
     """Pruebas para la función validar_fecha."""
     casos_prueba = [
@@ -549,11 +919,695 @@ def test_validar_fecha():
             print(f"✓ Caso '{entrada}' validado correctamente")
 
 
+def test_productos_sin_tope_y_ordenados_por_indice():
+    """productoN_* se agrupa para cualquier N (antes solo 1..20), en orden numérico, y nunca cuenta como faltante."""
+    from google.cloud import documentai_v1 as documentai
+
+    def entidad(tipo, texto):
+        return documentai.Document.Entity(type_=tipo, mention_text=texto)
+
+    resultado = procesar_entidades([
+        entidad('producto25_detalle', 'Puerta corrediza'),
+        entidad('producto3_cantidad', '2'),
+        entidad('producto10_codigo', 'A-1'),
+        entidad('producto25_valor_total', '12.50'),
+        entidad('producto0_detalle', 'índice no válido'),
+        entidad('producto2_color', 'campo desconocido'),
+        entidad('Nombrecliente', 'ACME'),
+    ], cargar_etiquetas() | {'producto1_cantidad', 'producto21_detalle'})
+
+    productos = resultado['productos']
+    assert [p['cantidad'] or p['codigo'] or p['detalle'] for p in productos] == ['2', 'A-1', 'Puerta corrediza']
+    assert productos[2]['valor_total'] == '12.50' and list(productos[2]) == list(CAMPOS_PRODUCTO)
+    assert 'Nombrecliente' not in resultado['faltantes']
+    assert not [f for f in resultado['faltantes'] if f.startswith('producto')]
+
+
+def test_combinar_resultados_por_paginas():
+    def pagina(datos, productos, faltantes, advertencias=()):
+        return {'datos_generales': datos, 'productos': productos,
+                'faltantes': faltantes, 'advertencias': list(advertencias)}
+
+    combinado = combinar_resultados([
+        pagina({'Nombrecliente': 'ACME', 'Ciudad': ''}, [{'detalle': 'p1-a'}, {'detalle': 'p1-b'}],
+               ['Ciudad', 'Correo', 'Ruc'], ['Teléfono no válido']),
+        pagina({'Nombrecliente': 'Otro', 'Ciudad': 'Quito'}, [{'detalle': 'p2-a'}],
+               ['Correo', 'Nombrecliente', 'Ruc'], ['Teléfono no válido']),
+        pagina({'Correo': 'a@b.ec'}, [], ['Nombrecliente', 'Ruc']),
+    ])
+    assert combinado['datos_generales'] == {'Nombrecliente': 'ACME', 'Ciudad': 'Quito', 'Correo': 'a@b.ec'}
+    assert [p['detalle'] for p in combinado['productos']] == ['p1-a', 'p1-b', 'p2-a']
+    assert combinado['faltantes'] == ['Ruc']
+    assert combinado['advertencias'] == ['Teléfono no válido']
+
+
+def test_dividir_pdf_y_tiff_multipagina():
+    import io
+    from PIL import Image
+    from pypdf import PdfReader, PdfWriter
+
+    escritor = PdfWriter()
+    for _ in range(3):
+        escritor.add_blank_page(width=200, height=200)
+    pdf = io.BytesIO()
+    escritor.write(pdf)
+
+    lotes = dividir_documento(pdf.getvalue(), 'application/pdf', 2)
+    assert [len(PdfReader(io.BytesIO(lote)).pages) for lote, _ in lotes] == [2, 1]
+    assert {mime for _, mime in lotes} == {'application/pdf'}
+
+    paginas = [Image.new('L', (20, 20), color) for color in (0, 128, 255)]
+    tiff = io.BytesIO()
+    paginas[0].save(tiff, format='TIFF', save_all=True, append_images=paginas[1:])
+    lotes = dividir_documento(tiff.getvalue(), 'image/tiff', 1)
+    assert len(lotes) == 3
+    assert [Image.open(io.BytesIO(lote)).getpixel((0, 0)) for lote, _ in lotes] == [0, 128, 255]
+
+    # Un documento que cabe en un lote (o una imagen simple) se envía tal cual
+    assert dividir_documento(pdf.getvalue(), 'application/pdf', 5) == [(pdf.getvalue(), 'application/pdf')]
+    assert dividir_documento(b'\xff\xd8\xff', 'image/jpeg', 1) == [(b'\xff\xd8\xff', 'image/jpeg')]
+
+
+def test_cli_preprocesa_como_el_servidor(tmp_path, monkeypatch):
+    """process_document (CLI y lote) reduce las fotos grandes antes de enviarlas, como /upload."""
+    import io
+    import backend_documentai
+    from PIL import Image
+    from google.cloud import documentai_v1 as documentai
+
+    enviados = []
+
+    class BackendCaptura:
+        def procesar(self, contenido, mime_type, config):
+            enviados.append((Image.open(io.BytesIO(contenido)).size, mime_type))
+            return documentai.Document()
+
+    foto = tmp_path / 'foto.png'
+    Image.new('RGB', (4000, 3000), 'white').save(foto)
+    monkeypatch.setattr(backend_documentai, '_backend', BackendCaptura())
+    monkeypatch.setenv('PREPROC_MAX_LADO', '1000')
+
+    process_document(str(foto), {}, set())
+    monkeypatch.setenv('PREPROCESAMIENTO', '0')
+    process_document(str(foto), {}, set())
+    assert enviados == [((1000, 750), 'image/jpeg'), ((4000, 3000), 'image/png')]
+
+
+def test_llamadas_a_documentai_acotadas_en_todo_el_proceso(monkeypatch):
+    """Las páginas de varios documentos a la vez no superan LLAMADAS_DOCUMENTAI_MAX llamadas en curso."""
+    import io
+    import backend_documentai
+    from google.cloud import documentai_v1 as documentai
+    from pypdf import PdfWriter
+
+    class BackendMedido:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.en_curso = self.maximo = self.llamadas = 0
+
+        def procesar(self, contenido, mime_type, config):
+            with self.lock:
+                self.en_curso += 1
+                self.llamadas += 1
+                self.maximo = max(self.maximo, self.en_curso)
+            time.sleep(0.02)
+            with self.lock:
+                self.en_curso -= 1
+            return documentai.Document()
+
+    escritor = PdfWriter()
+    for _ in range(6):
+        escritor.add_blank_page(width=200, height=200)
+    pdf = io.BytesIO()
+    escritor.write(pdf)
+
+    backend = BackendMedido()
+    monkeypatch.setattr(backend_documentai, '_backend', backend)
+    monkeypatch.setattr(sys.modules[__name__], '_llamadas_documentai', threading.BoundedSemaphore(2))
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        list(pool.map(lambda _: procesar_documento(pdf.getvalue(), {}, set()), range(3)))
+    assert backend.llamadas == 18 and backend.maximo == 2
+
+
+def test_clave_cache_extraccion():
+    from cache_extraccion import clave_cache
+
+    config = {'project_id': 'p', 'location': 'us', 'processor_id': 'f', 'processor_version_id': 'v1'}
+    base = clave_cache(b'factura', config, 'esquema', '2')
+    assert base == clave_cache(b'factura', dict(config), 'esquema', '2')
+    assert len({base,
+                clave_cache(b'otra factura', config, 'esquema', '2'),
+                clave_cache(b'factura', {**config, 'processor_version_id': 'v2'}, 'esquema', '2'),
+                clave_cache(b'factura', config, 'otro esquema', '2'),
+                clave_cache(b'factura', config, 'esquema', '3'),
+                clave_cache(b'factura', config, 'esquema', '2', extra='preproc')}) == 6
+
+
+def test_cache_extraccion_memoria_lru_y_ttl(monkeypatch):
+    import types
+    import cache_extraccion
+    from cache_extraccion import CacheExtraccion
+
+    reloj = [1000.0]
+    monkeypatch.setattr(cache_extraccion, 'time', types.SimpleNamespace(time=lambda: reloj[0]))
+    datos = preparar_datos_para_bd(procesar_entidades([], cargar_etiquetas()))
+    cache = CacheExtraccion(max_entradas=2, ttl=60)
+
+    cache.guardar('a', datos)
+    cache.guardar('b', datos)
+    assert cache.obtener('a') == datos
+    cache.guardar('c', datos)
+    assert cache.obtener('b') is None
+    assert cache.obtener('c') == datos
+
+    # Lo retornado es una copia: modificarla no altera la cache
+    cache.obtener('a')['cliente']['nombre'] = 'modificado'
+    assert cache.obtener('a') == datos
+
+    reloj[0] += 61
+    assert cache.obtener('a') is None
+    estadisticas = cache.estadisticas()
+    assert (estadisticas['aciertos_memoria'], estadisticas['fallos'], estadisticas['expulsiones']) == (4, 2, 1)
+    assert estadisticas['tasa_aciertos'] == round(4 / 6, 3) and estadisticas['entradas_memoria'] == 1
+
+
+def test_cache_extraccion_en_disco(tmp_path):
+    from cache_extraccion import CacheExtraccion
+
+    datos = preparar_datos_para_bd(procesar_entidades([], cargar_etiquetas()))
+    CacheExtraccion(directorio=str(tmp_path)).guardar('a', datos)
+
+    # Otro proceso (otra instancia) lo encuentra en disco y luego en su memoria
+    cache = CacheExtraccion(directorio=str(tmp_path), ttl=60)
+    assert cache.obtener('a') == datos
+    assert cache.obtener('a') == datos
+    estadisticas = cache.estadisticas()
+    assert (estadisticas['aciertos_disco'], estadisticas['aciertos_memoria']) == (1, 1)
+    assert estadisticas['bytes_disco'] == (tmp_path / 'a.json').stat().st_size
+
+    # Expirados e ilegibles se borran y cuentan como fallo
+    CacheExtraccion(directorio=str(tmp_path)).guardar('viejo', datos)
+    os.utime(tmp_path / 'viejo.json', (time.time() - 120, time.time() - 120))
+    (tmp_path / 'roto.json').write_text('{no es json', encoding='utf-8')
+    cache = CacheExtraccion(directorio=str(tmp_path), ttl=60)
+    assert cache.obtener('viejo') is None and cache.obtener('roto') is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.json']
+
+    # Superado max_bytes_disco se recortan los archivos más antiguos
+    tamano = (tmp_path / 'a.json').stat().st_size
+    cache = CacheExtraccion(directorio=str(tmp_path), max_bytes_disco=2 * tamano)
+    os.utime(tmp_path / 'a.json', (time.time() - 30, time.time() - 30))
+    cache.guardar('b', datos)
+    cache.guardar('c', datos)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['b.json', 'c.json']
+
+
+def test_almacen_rechaza_entrada_demasiado_grande():
+    """Un resultado mayor que max_bytes no se guarda ni expulsa a los demás."""
+    from almacen_sesiones import AlmacenSesiones, EntradaDemasiadoGrande
+
+    almacen = AlmacenSesiones(max_bytes=200)
+    almacen.guardar('a', {'x': 1})
+    almacen.guardar('b', {'x': 2})
+    try:
+        almacen.guardar('grande', {'x': 'y' * 500})
+    except EntradaDemasiadoGrande:
+        pass
+    else:
+        raise AssertionError("se esperaba EntradaDemasiadoGrande")
+    assert 'grande' not in almacen
+    assert almacen.obtener('a') == {'x': 1} and almacen.obtener('b') == {'x': 2}
+
+
+def test_almacen_sqlite_compartido_entre_procesos(tmp_path):
+    """Lo que guarda un proceso lo lee otro con su propia conexión al mismo archivo."""
+    import gc
+    import multiprocessing
+    from almacen_sesiones import AlmacenSQLite
+
+    ruta = str(tmp_path / 'sesiones.sqlite3')
+    padre = AlmacenSQLite(ruta)
+    padre.guardar('padre', {'cliente': {'nombre': 'A'}})
+    # SQLite no admite conexiones abiertas a través de un fork; las conexiones por hilo
+    # viven en un threading.local que solo libera el recolector de ciclos
+    del padre
+    gc.collect()
+
+    def hijo():
+        almacen = AlmacenSQLite(ruta)
+        almacen.guardar('hijo', {'cliente': {'nombre': 'B'}})
+        os._exit(0 if almacen.obtener('padre') == {'cliente': {'nombre': 'A'}} else 1)
+
+    proceso = multiprocessing.get_context('fork').Process(target=hijo)
+    proceso.start()
+    proceso.join(30)
+    assert proceso.exitcode == 0
+    assert AlmacenSQLite(ruta).obtener('hijo') == {'cliente': {'nombre': 'B'}}
+
+
+def test_almacen_sqlite_expulsion_y_estados_de_trabajos(tmp_path):
+    """LRU por entradas; los estados de trabajos no ocupan lugares de resultados."""
+    from almacen_sesiones import AlmacenSQLite, crear_almacen_trabajos
+
+    resultados = AlmacenSQLite(str(tmp_path / 'sesiones.sqlite3'), max_entradas=2)
+    resultados.guardar('a', {'n': 1})
+    resultados.guardar('b', {'n': 2})
+    resultados.obtener('a')
+    resultados.guardar('c', {'n': 3})
+    assert 'b' not in resultados
+    assert resultados.obtener('a') == {'n': 1} and resultados.obtener('c') == {'n': 3}
+
+    trabajos = crear_almacen_trabajos(resultados)
+    for i in range(10):
+        trabajos.guardar(f"t{i}", {'estado': 'pendiente'})
+    assert len(resultados) == 2 and 'a' in resultados and 'c' in resultados
+    assert len(trabajos) == 10 and 'a' not in trabajos
+
+
+def test_almacen_redis_compartido():
+    """Dos clientes del mismo servidor (fakeredis) ven los mismos datos, con TTL y prefijos separados."""
+    import pytest
+    fakeredis = pytest.importorskip('fakeredis')
+    from almacen_sesiones import AlmacenRedis, crear_almacen_trabajos
+
+    servidor = fakeredis.FakeServer()
+    uno = AlmacenRedis(fakeredis.FakeRedis(server=servidor), ttl=60)
+    otro = AlmacenRedis(fakeredis.FakeRedis(server=servidor), ttl=60)
+    uno.guardar('x', {'cliente': {'nombre': 'Ñ'}})
+    assert otro.obtener('x') == {'cliente': {'nombre': 'Ñ'}}
+    assert 0 < otro.cliente.ttl(otro.prefijo + 'x') <= 60
+
+    trabajos = crear_almacen_trabajos(otro)
+    trabajos.guardar('t1', {'estado': 'completado'})
+    assert trabajos.cliente.ttl(trabajos.prefijo + 't1') <= trabajos.ttl
+    assert len(uno) == 1 and 't1' not in uno and trabajos.obtener('t1') == {'estado': 'completado'}
+
+    otro.eliminar('x')
+    assert uno.obtener('x') is None
+
+
+def test_rutas_de_resultados_solo_aceptan_data_id():
+    """Claves que no son data_id (p. ej. 'trabajo:<id>') no se sirven como facturas."""
+    from app import app, session_data
+
+    session_data.guardar('trabajo:1', {'estado': 'completado'})
+    cliente = app.test_client()
+    for ruta in ('/gui/trabajo:1', '/download/trabajo:1', '/resultado/trabajo:1', '/api/v1/invoices/trabajo:1'):
+        assert cliente.get(ruta).status_code == 404, ruta
+    session_data.eliminar('trabajo:1')
+
+
+def test_respuestas_memorizadas_con_etag(tmp_path, monkeypatch):
+    """/gui y /download se generan una vez por data_id; luego solo se comprueba que existan."""
+    import gzip
+    import uuid
+    import app as servidor
+    from almacen_sesiones import AlmacenSQLite
+    from cache_respuestas import CacheRespuestas
+
+    almacen = AlmacenSQLite(str(tmp_path / 'sesiones.sqlite3'))
+    monkeypatch.setattr(servidor, 'session_data', almacen)
+    monkeypatch.setattr(servidor, 'cache_respuestas', CacheRespuestas())
+    data_id = str(uuid.uuid4())
+    datos_bd = {'cliente': {'nombre': 'A' * 1000}, 'productos': [], 'validacion': {}}
+    almacen.guardar(data_id, datos_bd)
+
+    lecturas = []
+    obtener = almacen.obtener
+    monkeypatch.setattr(almacen, 'obtener', lambda clave: lecturas.append(clave) or obtener(clave))
+
+    cliente = servidor.app.test_client()
+    primera = cliente.get(f"/download/{data_id}")
+    etag = primera.headers['ETag']
+    assert primera.status_code == 200 and primera.json == datos_bd
+    assert cliente.get(f"/download/{data_id}", headers={'If-None-Match': etag}).status_code == 304
+    comprimida = cliente.get(f"/download/{data_id}", headers={'Accept-Encoding': 'gzip'})
+    assert comprimida.headers['Content-Encoding'] == 'gzip' and comprimida.headers['ETag'] != etag
+    assert gzip.decompress(comprimida.data) == primera.data
+    assert lecturas == [data_id]
+
+    almacen.eliminar(data_id)
+    assert cliente.get(f"/download/{data_id}").status_code == 404
+
+
+def test_descargas_ndjson_y_compacta(monkeypatch):
+    import types
+    import uuid
+    import almacen_sesiones
+    import app as servidor
+    from almacen_sesiones import AlmacenSesiones
+    from cache_respuestas import CacheRespuestas
+
+    reloj = [0.0]
+    monkeypatch.setattr(almacen_sesiones, 'time', types.SimpleNamespace(monotonic=lambda: reloj[0]))
+    monkeypatch.setattr(servidor, 'session_data', AlmacenSesiones(ttl=60))
+    monkeypatch.setattr(servidor, 'cache_respuestas', CacheRespuestas())
+    vigente, expirado, desconocido = (str(uuid.uuid4()) for _ in range(3))
+    datos_bd = {'cliente': {'nombre': 'ACME', 'ruc': None}, 'productos': [{'cantidad': 2}]}
+    servidor.session_data.guardar(expirado, datos_bd)
+    reloj[0] = 50
+    servidor.session_data.guardar(vigente, datos_bd)
+    reloj[0] = 70
+    cliente = servidor.app.test_client()
+
+    respuesta = cliente.get(f"/download?ids={vigente},{expirado}, {desconocido},no-es-uuid")
+    assert respuesta.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in respuesta.data.decode().splitlines()]
+    assert lineas[0] == {'data_id': vigente, 'datos_bd': datos_bd}
+    assert [(linea['data_id'], linea['error']) for linea in lineas[1:]] == [
+        (data_id, 'Datos no encontrados o expirados') for data_id in (expirado, desconocido, 'no-es-uuid')]
+    assert cliente.get('/download?ids=').status_code == 400
+    assert cliente.get('/download?ids=' + ','.join(['x'] * (servidor.MAX_IDS_DESCARGA + 1))).status_code == 400
+
+    compacta = cliente.get(f"/download/{vigente}?compacto=1")
+    indentada = cliente.get(f"/download/{vigente}")
+    assert compacta.data == json.dumps(datos_bd, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    assert json.loads(indentada.data) == datos_bd and b'\n    ' in indentada.data
+    assert compacta.headers['ETag'] != indentada.headers['ETag']
+
+
+def test_respuestas_comprimidas_con_brotli(monkeypatch):
+    import uuid
+    import pytest
+    brotli = pytest.importorskip('brotli')
+    import app as servidor
+    from almacen_sesiones import AlmacenSesiones
+    from cache_respuestas import CacheRespuestas
+
+    monkeypatch.setattr(servidor, 'session_data', AlmacenSesiones())
+    monkeypatch.setattr(servidor, 'cache_respuestas', CacheRespuestas())
+    data_id = str(uuid.uuid4())
+    servidor.session_data.guardar(data_id, {'cliente': {'nombre': 'A' * 1000}, 'productos': [], 'validacion': {}})
+
+    cliente = servidor.app.test_client()
+    original = cliente.get(f"/download/{data_id}")
+    comprimida = cliente.get(f"/download/{data_id}", headers={'Accept-Encoding': 'gzip, br'})
+    assert comprimida.headers['Content-Encoding'] == 'br'
+    assert comprimida.headers['ETag'] != original.headers['ETag']
+    assert 'Accept-Encoding' in comprimida.headers['Vary']
+    assert brotli.decompress(comprimida.data) == original.data
+
+
+def test_api_acepta_multipart_y_cuerpo_crudo(monkeypatch):
+    """POST /api/v1/invoices con `file` multipart o con el archivo como cuerpo, sea cual sea su Content-Type."""
+    import io
+    import uuid
+    import app as servidor
+
+    recibidos = []
+
+    def procesar_falso(contenido):
+        recibidos.append(contenido)
+        data_id = str(uuid.uuid4())
+        servidor.session_data.guardar(data_id, {'productos': [], 'validacion': {}})
+        return data_id
+
+    monkeypatch.setattr(servidor, 'procesar_factura', procesar_falso)
+    cliente = servidor.app.test_client()
+    contenido = b'%PDF-1.4 a=1&b=2'
+
+    for kwargs in ({'data': {'file': (io.BytesIO(contenido), 'factura.pdf')}},
+                   {'data': contenido, 'content_type': 'application/x-www-form-urlencoded'},
+                   {'data': contenido, 'content_type': 'application/pdf'}):
+        respuesta = cliente.post('/api/v1/invoices', **kwargs)
+        assert respuesta.status_code == 200, respuesta.json
+        assert respuesta.json['datos_bd'] == {'productos': [], 'validacion': {}}
+    assert recibidos == [contenido] * 3
+
+    vacio = cliente.post('/api/v1/invoices', data={'otro': 'x'}, content_type='multipart/form-data')
+    assert vacio.status_code == 400
+
+
+def test_api_rechaza_cuerpo_crudo_demasiado_grande(monkeypatch):
+    """MAX_CONTENT_LENGTH también limita el cuerpo crudo, no solo los formularios multipart."""
+    import io
+    import pytest
+    import app as servidor
+
+    monkeypatch.setitem(servidor.app.config, 'MAX_CONTENT_LENGTH', 1000)
+    monkeypatch.setattr(servidor, 'procesar_factura', lambda contenido: pytest.fail('no debía encolarse'))
+    cliente = servidor.app.test_client()
+    contenido = b'%PDF-1.4' + b'0' * 5000
+
+    crudo = cliente.post('/api/v1/invoices', data=contenido, content_type='application/pdf')
+    assert crudo.status_code == 413 and crudo.json['max_bytes'] == 1000
+    # Sin Content-Length (chunked) el límite se aplica mientras se lee
+    sin_longitud = cliente.post('/api/v1/invoices', input_stream=io.BytesIO(contenido),
+                                content_type='application/pdf', headers={'Transfer-Encoding': 'chunked'},
+                                environ_overrides={'wsgi.input_terminated': True})
+    assert sin_longitud.status_code == 413
+    multipart = cliente.post('/api/v1/invoices', data={'file': (io.BytesIO(contenido), 'factura.pdf')})
+    assert multipart.status_code == 413
+
+
+def test_api_lote_ndjson_en_orden_de_finalizacion(monkeypatch):
+    """Una línea por archivo apenas termina; los vacíos y los que no entran en la cola van como error."""
+    import io
+    import uuid
+    import app as servidor
+    from cola_trabajos import ColaTrabajos, ColaLlena
+
+    def procesar_falso(contenido):
+        time.sleep(0.3 if contenido == b'lento' else 0)
+        data_id = str(uuid.uuid4())
+        servidor.session_data.guardar(data_id, {'contenido': contenido.decode()})
+        return data_id
+
+    cola = ColaTrabajos(max_trabajadores=2)
+    rechazos = [ColaLlena('ocupada')]
+    enviar = cola.enviar
+
+    def enviar_con_rechazo(*args, **kwargs):
+        if rechazos:
+            raise rechazos.pop()
+        return enviar(*args, **kwargs)
+
+    monkeypatch.setattr(cola, 'enviar', enviar_con_rechazo)
+    monkeypatch.setattr(servidor, 'cola_trabajos', cola)
+    monkeypatch.setattr(servidor, 'procesar_factura', procesar_falso)
+    cliente = servidor.app.test_client()
+
+    archivos = [(io.BytesIO(contenido), f"{contenido.decode() or 'vacio'}.jpg")
+                for contenido in (b'lento', b'rapido', b'', b'tercero')]
+    respuesta = cliente.post('/api/v1/invoices/batch', data={'file': archivos})
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in respuesta.data.decode().splitlines()]
+
+    # El primer envío encontró la cola llena y se reintentó; 'lento' sale último
+    assert [linea['archivo'] for linea in lineas] == ['rapido.jpg', 'vacio.jpg', 'tercero.jpg', 'lento.jpg']
+    assert lineas[1] == {'archivo': 'vacio.jpg', 'error': 'Archivo vacío'}
+    assert [linea['datos_bd']['contenido'] for linea in lineas if 'datos_bd' in linea] == \
+        ['rapido', 'tercero', 'lento']
+
+    # Si la cola sigue llena más de API_TIMEOUT_SEGUNDOS, cada archivo se informa como error
+    rechazos.extend(ColaLlena('ocupada') for _ in range(10))
+    monkeypatch.setattr(servidor, 'API_TIMEOUT_SEGUNDOS', 0)
+    ocupado = cliente.post('/api/v1/invoices/batch', data={'file': [(io.BytesIO(b'x'), 'x.jpg')]})
+    assert json.loads(ocupado.data) == {'archivo': 'x.jpg', 'error': 'Servidor ocupado'}
+
+
+def test_cancelar_trabajo_avisa():
+    """Un trabajo cancelado antes de empezar también llama a `avisar`, como uno terminado."""
+    import queue
+    import threading
+    from cola_trabajos import ColaTrabajos, ERROR
+
+    cola = ColaTrabajos(max_trabajadores=1)
+    liberar = threading.Event()
+    terminados = queue.Queue()
+    en_curso = cola.enviar(liberar.wait, 10, avisar=terminados.put)
+    en_espera = cola.enviar(len, b'x', avisar=terminados.put)
+
+    assert cola.cancelar(en_espera.id)
+    assert terminados.get(timeout=5) is en_espera and en_espera.estado == ERROR
+    liberar.set()
+    assert terminados.get(timeout=5) is en_curso
+
+
+def test_lote_batch_de_extremo_a_extremo(tmp_path, monkeypatch):
+    """procesar_con_batch con ClienteBatchLocal: sondeo, varias operaciones, errores por documento y timeout."""
+    import pytest
+    import lote_documentai
+    from google.cloud import documentai_v1 as documentai
+    from lote_documentai import AlmacenamientoLocal, ClienteBatchLocal
+
+    archivos = []
+    for nombre, contenido in (('a.pdf', b'%PDF-1.4 a'), ('b.jpg', b'\xff\xd8\xff b'), ('c.jpg', b'\xff\xd8\xff falla')):
+        ruta = tmp_path / nombre
+        ruta.write_bytes(contenido)
+        archivos.append(str(ruta))
+
+    def procesar(contenido, mime_type):
+        if contenido.endswith(b'falla'):
+            raise ValueError('Documento ilegible')
+        return documentai.Document(entities=[documentai.Document.Entity(type_=mime_type, mention_text='x')])
+
+    config = {'project_id': 'p', 'location': 'us', 'processor_id': 'f', 'processor_version_id': 'v'}
+    almacenamiento = AlmacenamientoLocal(str(tmp_path / 'gcs'))
+    monkeypatch.setattr(lote_documentai, 'MAX_DOCUMENTOS_POR_OPERACION', 2)
+    cliente = ClienteBatchLocal(almacenamiento, procesar, sondeos=2)
+    resultados = {os.path.basename(r['archivo']): r for r in lote_documentai.procesar_con_batch(
+        archivos, config, lambda documento: [e.type_ for e in documento.entities], almacenamiento,
+        'gs://entrada/lotes', 'gs://salida/lotes', cliente=cliente, intervalo_sondeo=0)}
+
+    assert [op.consultas for op in cliente.operaciones] == [3, 3]
+    assert resultados['a.pdf']['datos_bd'] == ['application/pdf']
+    assert resultados['b.jpg']['datos_bd'] == ['image/jpeg']
+    assert not resultados['c.jpg']['ok'] and resultados['c.jpg']['error'] == 'Documento ilegible'
+
+    lento = ClienteBatchLocal(almacenamiento, procesar, sondeos=100)
+    with pytest.raises(TimeoutError):
+        list(lote_documentai.procesar_con_batch(
+            archivos, config, lambda documento: {}, almacenamiento, 'gs://entrada/lotes',
+            'gs://salida/lotes', cliente=lento, intervalo_sondeo=0, timeout=0))
+
+
+def test_main_lote_informa_timeout_y_errores_de_api(tmp_path, monkeypatch, caplog):
+    import pytest
+
+    modulo = sys.modules[__name__]
+    factura = tmp_path / 'factura.pdf'
+    factura.write_bytes(b'%PDF-1.4')
+    monkeypatch.setattr(modulo, 'setup_environment', lambda: {})
+    monkeypatch.setattr(modulo, 'cargar_etiquetas', set)
+    argv = [str(factura), '-o', str(tmp_path / 'salida.ndjson'),
+            '--gcs-entrada', 'gs://entrada', '--gcs-salida', 'gs://salida']
+
+    for error, mensaje in ((TimeoutError('6 h'), 'no terminó a tiempo'),
+                           (gexc.PermissionDenied('sin acceso al bucket'), 'API de Google Cloud'),
+                           (OSError('falta GOOGLE_CLOUD_PROJECT'), 'Error de configuración')):
+        def fallar(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(modulo, 'procesar_lote_batch', fallar)
+        caplog.clear()
+        with pytest.raises(SystemExit) as salida:
+            main_lote(argv)
+        assert salida.value.code == 1
+        assert mensaje in caplog.text
+
+
+def test_invalidar_cliente_no_corta_llamadas_en_curso():
+    """invalidar() solo saca el cliente del registro: su canal sigue sirviendo a quien ya lo usa."""
+    from cliente_documentai import RegistroClientes
+
+    class Transporte:
+        cerrado = False
+
+        def close(self):
+            self.cerrado = True
+
+    class Registro(RegistroClientes):
+        def _crear_cliente(self, config):
+            cliente = type('Cliente', (), {})()
+            cliente.transport = Transporte()
+            return cliente, config['processor_id']
+
+    config = {'project_id': 'p', 'location': 'us', 'processor_id': 'f', 'processor_version_id': 'v'}
+    registro = Registro()
+    anterior, _ = registro.obtener(config)
+    assert registro.obtener(config)[0] is anterior
+
+    registro.invalidar(config, cliente=object())
+    assert registro.obtener(config)[0] is anterior
+    registro.invalidar()
+    nuevo, _ = registro.obtener(config)
+    assert nuevo is not anterior and not anterior.transport.cerrado
+
+
+def test_recargar_configuracion_conserva_el_cliente_si_no_cambia_el_procesador(monkeypatch):
+    import configuracion
+
+    invalidados = []
+    monkeypatch.setattr(configuracion, 'load_dotenv', lambda override: None)
+    monkeypatch.setattr(configuracion, '_actual', None)
+    monkeypatch.setattr(configuracion.registro_clientes, 'invalidar', invalidados.append)
+    # setup_environment fija GOOGLE_APPLICATION_CREDENTIALS; así monkeypatch lo restaura
+    monkeypatch.setenv('GOOGLE_APPLICATION_CREDENTIALS', '')
+    monkeypatch.setenv('DOCUMENTAI_BACKEND', 'reproducir')
+    for variable, valor in (('PROJECT_ID', 'p'), ('LOCATION', 'us'),
+                            ('PROCESSOR_ID', 'f'), ('PROCESSOR_VERSION_ID', 'v1')):
+        monkeypatch.setenv(variable, valor)
+
+    configuracion.obtener_configuracion()
+    configuracion.recargar_configuracion()
+    assert invalidados == []
+
+    monkeypatch.setenv('PROCESSOR_VERSION_ID', 'v2')
+    configuracion.recargar_configuracion()
+    assert [dict(entorno)['processor_version_id'] for entorno in invalidados] == ['v1']
+
+
+class _BackendFijo:
+    """Backend de prueba: el texto que sigue a la firma JPEG se extrae como Nombrecliente."""
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def procesar(self, contenido, mime_type, config):
+        from google.cloud import documentai_v1 as documentai
+        self.llamadas += 1
+        nombre = contenido[len(b'\xff\xd8\xff '):].decode()
+        return documentai.Document(entities=[
+            documentai.Document.Entity(type_='Nombrecliente', mention_text=nombre, confidence=0.9)])
+
+
+def test_backend_grabar_y_reproducir(tmp_path):
+    """Lo que graba BackendGrabador lo sirve BackendReproductor sin llamar a Document AI."""
+    import pytest
+    from google.cloud import documentai_v1 as documentai
+    from backend_documentai import (BackendGrabador, BackendReproductor, GrabacionNoEncontrada,
+                                    clave_grabacion)
+
+    interno = _BackendFijo()
+    grabador = BackendGrabador(interno, str(tmp_path))
+    grabado = grabador.procesar(b'\xff\xd8\xff factura', 'image/jpeg', {})
+
+    reproductor = BackendReproductor(str(tmp_path))
+    assert reproductor.grabaciones() == [clave_grabacion(b'\xff\xd8\xff factura', 'image/jpeg')]
+    reproducido = reproductor.procesar(b'\xff\xd8\xff factura', 'image/jpeg', {})
+    assert documentai.Document.to_json(reproducido) == documentai.Document.to_json(grabado)
+    assert interno.llamadas == 1
+
+    # La clave incluye el tipo MIME: los mismos bytes con otro tipo no están grabados
+    with pytest.raises(GrabacionNoEncontrada):
+        reproductor.procesar(b'\xff\xd8\xff factura', 'application/pdf', {})
+
+
+def test_procesar_lote_con_respuestas_grabadas(tmp_path, monkeypatch):
+    """El modo lote en paralelo escribe una línea NDJSON por factura, incluidas las fallidas."""
+    import io
+    import backend_documentai
+    from backend_documentai import BackendGrabador, BackendReproductor
+
+    grabaciones = str(tmp_path / 'grabaciones')
+    archivos = []
+    for nombre in ('ACME', 'Vilema', 'sin grabar'):
+        ruta = tmp_path / f"{nombre}.jpg"
+        ruta.write_bytes(b'\xff\xd8\xff ' + nombre.encode())
+        archivos.append(str(ruta))
+        if nombre != 'sin grabar':
+            BackendGrabador(_BackendFijo(), grabaciones).procesar(ruta.read_bytes(), 'image/jpeg', {})
+    monkeypatch.setattr(backend_documentai, '_backend', BackendReproductor(grabaciones))
+
+    salida = io.StringIO()
+    resumen = procesar_lote(archivos, {}, cargar_etiquetas(), salida, concurrencia=3)
+
+    lineas = {os.path.basename(linea['archivo']): linea
+              for linea in map(json.loads, salida.getvalue().splitlines())}
+    assert (resumen['facturas'], resumen['correctas'], resumen['errores']) == (3, 2, 1)
+    assert lineas['ACME.jpg']['datos_bd']['cliente']['nombre'] == 'ACME'
+    assert lineas['Vilema.jpg']['datos_bd']['cliente']['nombre'] == 'Vilema'
+    assert not lineas['sin grabar.jpg']['ok']
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'lote':
+        return main_lote(sys.argv[2:])
+
     parser = argparse.ArgumentParser(
         description='Extrae datos de una imagen de factura usando Google Document AI.')
     parser.add_argument(
-        'file', help='Ruta al archivo de imagen (jpeg) de la factura')
+        'file', help='Ruta a la imagen (jpg, png, tiff) o PDF de la factura')
     parser.add_argument(
         '--output', '-o', help='Archivo de salida para guardar los datos en formato JSON')
     parser.add_argument('--format', '-f', choices=['text', 'json', 'both'], default='both',
@@ -561,9 +1615,9 @@ def main():
     args = parser.parse_args()
 
     # Validar que el archivo de entrada tenga una extensión de imagen válida
-    if not args.file.lower().endswith(('.jpg', '.jpeg', '.png')):
+    if not args.file.lower().endswith(EXTENSIONES_VALIDAS):
         logger.error(
-            "Error: El archivo debe ser una imagen (jpg, jpeg, o png)")
+            "Error: El archivo debe ser una imagen (jpg, jpeg, png, tif o tiff) o un PDF")
         sys.exit(1)
 
     # Validar coherencia entre argumentos